@@ -0,0 +1,65 @@
+import asyncio
+import csv
+import itertools
+from config import BULK_CHUNK_ROWS, BULK_MAX_ROWS
+
+# Bulk balance adjustments uploaded by admins as CSV lines `user_id,delta,reason`
+# (a header line is allowed). The file is validated in one streaming pass, then
+# re-read and applied BULK_CHUNK_ROWS rows per transaction (Database.apply_adjustments).
+
+MAX_REASON = 100
+
+
+def read_rows(path):
+    # Yields (line number, user_id, delta, reason) or (line number, None, None, error)
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for line_no, row in enumerate(csv.reader(f), 1):
+            if not row or not "".join(row).strip(): continue
+            if line_no == 1 and row[0].strip().lower() == "user_id": continue
+            if len(row) < 2:
+                yield line_no, None, None, "expected user_id,delta,reason"
+                continue
+            try: user_id, delta = int(row[0]), int(row[1])
+            except ValueError:
+                yield line_no, None, None, "user_id and delta must be integers"
+                continue
+            reason = ",".join(row[2:]).strip()
+            if not delta: yield line_no, None, None, "delta is 0"
+            elif len(reason) > MAX_REASON: yield line_no, None, None, f"reason over {MAX_REASON} characters"
+            else: yield line_no, user_id, delta, reason
+
+
+def validate(path, max_errors=10):
+    # Blocking; returns {'rows', 'credit', 'debit', 'users', 'errors': [(line, message)]}
+    report = {'rows': 0, 'credit': 0, 'debit': 0, 'users': 0, 'errors': []}
+    users = set()
+    for line_no, user_id, delta, reason in read_rows(path):
+        if user_id is None:
+            if len(report['errors']) < max_errors: report['errors'].append((line_no, reason))
+            else: break
+            continue
+        report['rows'] += 1
+        if delta > 0: report['credit'] += delta
+        else: report['debit'] -= delta
+        users.add(user_id)
+    report['users'] = len(users)
+    if report['rows'] > BULK_MAX_ROWS:
+        report['errors'].append((0, f"{report['rows']} rows, the limit is {BULK_MAX_ROWS}"))
+    return report
+
+
+async def apply(db, path, ref=None, notify_for=None, chunk=BULK_CHUNK_ROWS):
+    # Applies a validated file; returns {'applied', 'credit', 'debit', 'unknown', 'insufficient'}
+    result = {'applied': 0, 'credit': 0, 'debit': 0, 'unknown': [], 'insufficient': []}
+    rows = ((user_id, delta, reason) for _, user_id, delta, reason in read_rows(path))
+    while True:
+        batch = list(itertools.islice(rows, chunk))
+        if not batch: break
+        done = await db.apply_adjustments(batch, ref, notify_for)
+        result['applied'] += len(done['applied'])
+        result['credit'] += sum(d for _, d, _ in done['applied'] if d > 0)
+        result['debit'] -= sum(d for _, d, _ in done['applied'] if d < 0)
+        result['unknown'] += done['unknown']
+        result['insufficient'] += done['insufficient']
+        await asyncio.sleep(0)  # let other writers in between chunks
+    return result
@@ -1,11 +1,23 @@
 
 import asyncio
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Bot
-from telegram.ext import ContextTypes, CommandHandler, ConversationHandler, MessageHandler, CallbackQueryHandler, filters
-from database import Database
-from config import ADMIN_IDS, ADMIN_BOT_TOKEN, USER_BOT_TOKEN
-
-db = Database()
+import os
+import tempfile
+import time
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes, CommandHandler, ConversationHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters
+from config import ORDER_CLAIM_SECONDS, REFERRAL_UPLINE_BONUSES
+import adjustments
+import backup
+import exports
+import ratelimit
+import render
+import router
+import tenants
+import tracing
+
+# The shop of the update being handled (tenants.py)
+db = tenants.Proxy('db')
 
 # States
 ADD_SVC_NAME, ADD_SVC_PRICE, ADD_SVC_TYPE, ADD_SVC_QUESTION = range(4)
@@ -16,14 +28,14 @@ ADD_CODE_VAL, ADD_CODE_USES = range(2)
 
 # --- Helpers ---
 def is_admin(user_id):
-    return user_id in ADMIN_IDS
+    return user_id in tenants.current().admin_ids
 
 async def admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id): return
     context.user_data.clear()
     
-    pending = await db.get_pending_orders()
-    pending_text = f"⏳ Pending ({len(pending)})" if pending else "⏳ Pending Orders"
+    pending = await db.count_pending_orders()
+    pending_text = f"⏳ Pending ({pending})" if pending else "⏳ Pending Orders"
     
     text = "👑 **Admin Panel**\nSelect an action:"
     keyboard = [
@@ -35,12 +47,16 @@ async def admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
          InlineKeyboardButton("📢 Broadcast", callback_data="admin_broadcast")],
         [InlineKeyboardButton("⚙️ Settings", callback_data="admin_settings"),
          InlineKeyboardButton("🎁 Codes", callback_data="admin_codes")],
-        [InlineKeyboardButton("📊 Stats", callback_data="admin_stats")]
+        [InlineKeyboardButton("📊 Stats", callback_data="admin_stats"),
+         InlineKeyboardButton("💾 Backup", callback_data="admin_backup")],
+        [InlineKeyboardButton("🗂 Categories", callback_data="admin_cats"),
+         InlineKeyboardButton("📤 Export", callback_data="admin_export")]
     ]
     
     if update.callback_query:
-        try: await update.callback_query.edit_message_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
-        except: await update.callback_query.message.reply_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+        # Re-opening the panel it already shows costs no edit; a message that can't be edited gets a new one
+        try: await render.edit(update.callback_query, text, InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+        except BadRequest: await update.callback_query.message.reply_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
     else:
         await update.message.reply_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
     return ConversationHandler.END
@@ -130,110 +146,338 @@ async def finish_add_service(update, context, q):
 
 
 # --- Other lists and handlers (Kept same) ---
+PENDING_PAGE_SIZE = 20
+
+def _complete_notices(rows):
+    return [('user', uid, f"✅ **Order Complete**\n\nYour account is active, you can check it now.\n\nService: {name}")
+            for oid, uid, price, name in rows]
+
+def _refund_notices(rows):
+    return [('user', uid, f"↩️ Order #{oid} Refunded.") for oid, uid, price, name in rows]
+
+async def pending_page(update, context):
+    context.user_data['ord_page'] = context.args[0]
+    await list_pending_orders(update, context)
+
 async def list_pending_orders(update, context):
     query = update.callback_query
-    orders = await db.get_pending_orders()
-    if not orders:
-        await query.answer("No Pending Orders!", show_alert=True)
+    selected = context.user_data.setdefault('ord_sel', set())
+    total = await db.count_pending_orders()
+    if not total:
+        selected.clear()
+        # A batch action that emptied the list has answered already
+        await render.answer_once(query, "No Pending Orders!", show_alert=True)
         await admin_start(update, context)
         return
-    text = "⏳ **Pending Orders**\nSelect an order:"
-    keyboard = []
+    pages = (total - 1) // PENDING_PAGE_SIZE + 1
+    page = min(context.user_data.get('ord_page', 0), pages - 1)
+    orders = await db.get_pending_orders(PENDING_PAGE_SIZE, page * PENDING_PAGE_SIZE)
+    text = f"⏳ **Pending Orders** ({total})\nTap an order to claim it, ☐ to select it. 🔒 another admin is on it."
+    keyboard = [[InlineKeyboardButton("🎯 Claim Next", callback_data="ord_next"), InlineKeyboardButton("📈 Admin Stats", callback_data="ord_stats")]]
+    now, me = time.time(), query.from_user.id
     for o in orders:
-        btn_text = f"#{o['id']} U:{o['user_id']} - {o['service_name']}"
-        keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"ord_view_{o['id']}")])
-    keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="admin_home")])
-    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+        claim = "" if not o['claimed_by'] or o['claimed_until'] < now else ("📌 " if o['claimed_by'] == me else "🔒 ")
+        btn_text = f"{claim}#{o['id']} U:{o['user_id']} - {o['service_name']}"
+        mark = "☑️" if o['id'] in selected else "☐"
+        keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"ord_view_{o['id']}"),
+                         InlineKeyboardButton(mark, callback_data=f"ord_sel_{o['id']}")])
+    nav = []
+    if page > 0: nav.append(InlineKeyboardButton("⬅️", callback_data=f"ord_page_{page - 1}"))
+    if pages > 1: nav.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"ord_page_{page}"))
+    if page < pages - 1: nav.append(InlineKeyboardButton("➡️", callback_data=f"ord_page_{page + 1}"))
+    if nav: keyboard.append(nav)
+    if selected:
+        keyboard.append([InlineKeyboardButton(f"✅ Complete ({len(selected)})", callback_data="ord_batch_complete_sel"),
+                         InlineKeyboardButton(f"↩️ Refund ({len(selected)})", callback_data="ord_batch_refund_sel")])
+        keyboard.append([InlineKeyboardButton("✖️ Clear Selection", callback_data="ord_sel_clear")])
+    keyboard.append([InlineKeyboardButton("📦 By Service", callback_data="ord_svcs"),
+                     InlineKeyboardButton("⬅️ Back", callback_data="admin_home")])
+    await render.edit(query, text, InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+async def toggle_order_select(update, context):
+    query = update.callback_query
+    selected = context.user_data.setdefault('ord_sel', set())
+    if context.args: selected.symmetric_difference_update({context.args[0]})
+    else: selected.clear()  # ord_sel_clear
+    await render.answer(query)
+    await list_pending_orders(update, context)
 
-async def view_order(update, context):
+async def pending_by_service(update, context):
     query = update.callback_query
-    oid = int(query.data.split("_")[2])
-    order = await db.get_order(oid)
-    if not order or order['status'] != 'pending': 
-        await query.answer("Invalid Order")
+    groups = await db.get_pending_by_service()
+    if not groups:
         await list_pending_orders(update, context)
         return
+    keyboard = [[InlineKeyboardButton(f"{name or f'#{sid}'} ({count})", callback_data=f"ord_svc_{sid}")] for sid, name, count in groups]
+    keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="admin_pending")])
+    await render.edit(query, "📦 **Pending by Service**", InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+async def pending_service_actions(update, context):
+    query = update.callback_query
+    sid = context.args[0]
+    count = next((c for s, n, c in await db.get_pending_by_service() if s == sid), 0)
+    svc = await db.get_service(sid)
+    text = f"📦 **{svc['name'] if svc else f'Service #{sid}'}**\nPending: {count}"
+    keyboard = [[InlineKeyboardButton(f"✅ Complete All ({count})", callback_data=f"ord_batch_complete_svc_{sid}")],
+                [InlineKeyboardButton(f"↩️ Refund All ({count})", callback_data=f"ord_batch_refund_svc_{sid}")],
+                [InlineKeyboardButton("⬅️ Back", callback_data="ord_svcs")]]
+    await render.edit(query, text, InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+async def batch_order_action(update, context):
+    # ord_batch_{complete|refund}_sel  or  ord_batch_{complete|refund}_svc_{service_id}
+    query = update.callback_query
+    action, target, sid = context.args
+    selected = context.user_data.setdefault('ord_sel', set())
+    if target == "sel": scope = {'order_ids': list(selected)}
+    else: scope = {'service_id': sid}
+    # One transaction; orders no longer pending or claimed by another admin are skipped,
+    # notifications go out via the outbox
+    me = query.from_user.id
+    if action == "complete": rows = await db.complete_orders(**scope, notify_for=_complete_notices, admin_id=me)
+    else: rows = await db.refund_orders(**scope, notify_for=_refund_notices, admin_id=me)
+    if target == "sel": selected.clear()
+    else: selected.difference_update(r[0] for r in rows)
+    await render.answer(query, f"{'Completed' if action == 'complete' else 'Refunded'} {len(rows)} order(s)", show_alert=True)
+    await list_pending_orders(update, context)
+
+# --- Fulfillment queue: an admin claims an order before completing or refunding it ---
+async def _show_order(query, oid):
+    order = await db.get_order(oid)
     u_input = order.get('user_input') or "None"
-    text = (f"📦 **Order #{order['id']}**\n👤 User: `{order['user_id']}`\n🛍️ Service: {order.get('service_name')}\n💵 Price: {order['price']} TK\n📝 Input: `{u_input}`\n\nSelect Action:")
-    keyboard = [[InlineKeyboardButton("✅ Mark Complete", callback_data=f"ord_act_complete_{oid}")], [InlineKeyboardButton("↩️ Refund", callback_data=f"ord_act_refund_{oid}")], [InlineKeyboardButton("⬅️ Back", callback_data="admin_pending")]]
-    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+    minutes = max(0, int((order['claimed_until'] - time.time()) // 60))
+    text = (f"📦 **Order #{order['id']}**\n👤 User: `{order['user_id']}`\n🛍️ Service: {order.get('service_name')}\n💵 Price: {order['price']} TK\n📝 Input: `{u_input}`\n\n"
+            f"📌 Claimed by you for {minutes} min. Select Action:")
+    keyboard = [[InlineKeyboardButton("✅ Mark Complete", callback_data=f"ord_act_complete_{oid}")], [InlineKeyboardButton("↩️ Refund", callback_data=f"ord_act_refund_{oid}")],
+                [InlineKeyboardButton("🔓 Release", callback_data=f"ord_rel_{oid}"), InlineKeyboardButton("⬅️ Back", callback_data="admin_pending")]]
+    await render.edit(query, text, InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
-async def order_action(update, context):
+async def view_order(update, context):
+    # Opening an order claims it (or renews this admin's claim)
     query = update.callback_query
-    data = query.data.split("_")
-    action, oid = data[2], int(data[3])
+    oid = context.args[0]
+    if await db.claim_order(query.from_user.id, ORDER_CLAIM_SECONDS, oid):
+        await _show_order(query, oid)
+        return
     order = await db.get_order(oid)
-    if not order: return
-    user_bot = Bot(USER_BOT_TOKEN)
-    if action == "complete":
-        await db.update_order_status(oid, 'completed')
-        await query.answer("Completed")
-        try: 
-            print(f"DEBUG: Attempting to notify User {order['user_id']}")
-            msg = f"✅ **Order Complete**\n\nYour account is active, you can check it now.\n\nService: {order['service_name']}"
-            await user_bot.send_message(order['user_id'], msg) 
-            print("DEBUG: Notification Sent Successfully")
-        except Exception as e:
-            print(f"DEBUG: Error sending msg to user: {e}")
-    elif action == "refund":
-        await db.update_order_status(oid, 'refunded')
-        await db.update_balance(order['user_id'], order['price'], add=True)
-        await query.answer("Refunded")
-        try: await user_bot.send_message(order['user_id'], f"↩️ Order #{oid} Refunded.")
-        except: pass
+    if order and order['status'] == 'pending': await render.answer(query, f"🔒 Admin {order['claimed_by']} is handling this order", show_alert=True)
+    else: await render.answer(query, "Invalid Order")
     await list_pending_orders(update, context)
 
+async def next_order(update, context):
+    query = update.callback_query
+    oid = await db.claim_order(query.from_user.id, ORDER_CLAIM_SECONDS)
+    if oid: await _show_order(query, oid)
+    else:
+        await render.answer(query, "No unclaimed orders", show_alert=True)
+        await list_pending_orders(update, context)
+
+async def release_order(update, context):
+    query = update.callback_query
+    await db.release_order(context.args[0], query.from_user.id)
+    await render.answer(query, "Released")
+    await list_pending_orders(update, context)
+
+async def order_action(update, context):
+    query = update.callback_query
+    action, oid = context.args
+    # Needs this admin's claim; user notifications go through the outbox, committed with the status change
+    handle = db.complete_orders if action == "complete" else db.refund_orders
+    done = await handle([oid], notify_for=_complete_notices if action == "complete" else _refund_notices,
+                        admin_id=query.from_user.id, claimed=True)
+    context.user_data.get('ord_sel', set()).discard(oid)
+    if not done:
+        await render.answer(query, "Already handled, or claimed by another admin", show_alert=True)
+        await list_pending_orders(update, context)
+        return
+    await render.answer(query, "Completed" if action == "complete" else "Refunded")
+    # Straight on to the next order in the queue
+    oid = await db.claim_order(query.from_user.id, ORDER_CLAIM_SECONDS)
+    if oid: await _show_order(query, oid)
+    else: await list_pending_orders(update, context)
+
+async def admin_stats(update, context):
+    query = update.callback_query
+    now = time.time()
+    text = "📈 **Orders handled per admin**"
+    for label, days in (("24h", 1), ("7 days", 7)):
+        rows = await db.get_admin_stats(now - days * 86400)
+        text += f"\n\n__{label}__\n" + ("\n".join(
+            f"`{aid}`: ✅ {done} ↩️ {refunded}" + (f", avg {avg / 60:.1f} min from claim" if avg is not None else "")
+            for aid, done, refunded, avg in rows) or "Nothing handled.")
+    await render.edit(query, text, InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="admin_pending")]]), parse_mode='Markdown')
+
 async def list_services_btn(update, context):
     query = update.callback_query
     services = await db.get_services()
     if not services:
-        await query.edit_message_text("No services.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="admin_home")]]))
+        await render.edit(query, "No services.", InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="admin_home")]]))
         return
     text = "📋 **Services List**\nClick to Delete:"
     keyboard = []
     for s in services:
-        stock = await db.get_stock_count(s['id'])
         q_mark = "❓" if s.get('question') else ""
-        btn_text = f"ID:{s['id']} {s['name']} ({s['price']}TK) [{stock}] {q_mark}"
+        low = "📉" if s['low_stock'] and s['stock_count'] < s['low_stock'] else ""
+        btn_text = f"ID:{s['id']} {s['name']} ({s['price']}TK) [{s['stock_count']}]{low} {q_mark}"
         keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"svc_opt_{s['id']}")])
     keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="admin_home")])
-    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+    await render.edit(query, text, InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
 async def service_options(update, context):
+    # svc_opt_{sid} (also reached from svc_setcat_{sid}_{cid}: the sid is context.args[0] in both)
     query = update.callback_query
-    sid = int(query.data.split("_")[2])
+    sid = context.args[0]
     svc = await db.get_service(sid)
     if not svc:
         await list_services_btn(update, context)
         return
-    text = f"⚙️ **Service**\nName: {svc['name']}\nPrice: {svc['price']}\nType: {svc['type']}"
-    keyboard = [[InlineKeyboardButton("🗑️ Delete", callback_data=f"svc_del_{sid}")], [InlineKeyboardButton("⬅️ Back", callback_data="admin_list_svc")]]
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    category = next((name for cid, name, _ in await db.get_categories() if cid and cid == svc['category_id']), "Other")
+    text = f"⚙️ **Service**\nName: {svc['name']}\nPrice: {svc['price']}\nType: {svc['type']}\nCategory: {category}"
+    if svc['type'] == 'auto':
+        alert = f"below {svc['low_stock']}" if svc['low_stock'] else "off"
+        text += f"\nStock: {svc['stock_count']}\nLow-stock alert: {alert} (/lowstock {sid} N)"
+    keyboard = [[InlineKeyboardButton("🗂 Category", callback_data=f"svc_cat_{sid}"), InlineKeyboardButton("🗑️ Delete", callback_data=f"svc_del_{sid}")],
+                [InlineKeyboardButton("⬅️ Back", callback_data="admin_list_svc")]]
+    await render.edit(query, text, InlineKeyboardMarkup(keyboard))
+
+async def service_category_menu(update, context):
+    query = update.callback_query
+    sid = context.args[0]
+    cats = [c for c in await db.get_categories() if c[0]]
+    keyboard = [[InlineKeyboardButton(name, callback_data=f"svc_setcat_{sid}_{cid}")] for cid, name, _ in cats]
+    keyboard.append([InlineKeyboardButton("🚫 None", callback_data=f"svc_setcat_{sid}_0")])
+    keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data=f"svc_opt_{sid}")])
+    await render.edit(query, "🗂 Choose a category (add one with /addcat Name):", InlineKeyboardMarkup(keyboard))
+
+async def set_service_category_btn(update, context):
+    query = update.callback_query
+    sid, cid = context.args
+    await db.set_service_category(sid, cid or None)
+    await render.answer(query, "Saved")
+    await service_options(update, context)
+
+# --- Categories ---
+async def categories_menu(update, context):
+    query = update.callback_query
+    cats = await db.get_categories()
+    text = "🗂 **Categories**\nTap one to delete it (its services move to Other).\nAdd: `/addcat Name`"
+    keyboard = [[InlineKeyboardButton(f"🗑️ {name} ({count})", callback_data=f"acat_del_{cid}")] for cid, name, count in cats if cid]
+    keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="admin_home")])
+    await render.edit(query, text, InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+async def delete_category_btn(update, context):
+    await db.delete_category(context.args[0])
+    await render.answer(update.callback_query, "Deleted")
+    await categories_menu(update, context)
+
+async def add_category_cmd(update, context):
+    if not is_admin(update.effective_user.id): return
+    name = " ".join(context.args).strip()
+    if not name:
+        await update.message.reply_text("Usage: /addcat [Name]")
+        return
+    cid = await db.add_category(name[:64])
+    if cid is None: await update.message.reply_text("❌ A category with that name exists")
+    else: await update.message.reply_text(f"✅ Category #{cid} added. Assign services from 📋 Services.",
+                                          reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🗂 Categories", callback_data="admin_cats")]]))
+
+async def low_stock_cmd(update, context):
+    # /lowstock SERVICE_ID LEVEL  - alert admins when stock drops below LEVEL (0 = off)
+    if not is_admin(update.effective_user.id): return
+    try: sid, level = int(context.args[0]), int(context.args[1])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /lowstock [Service ID] [Level] (0 = off)")
+        return
+    if level < 0 or not await db.set_low_stock(sid, level):
+        await update.message.reply_text("❌ Invalid service or level")
+        return
+    count = await db.get_stock_count(sid)
+    await update.message.reply_text(f"✅ Alert below {level} (now {count} in stock)" if level else "✅ Low-stock alert off")
 
 async def delete_service_btn(update, context):
-    sid = int(update.callback_query.data.split("_")[2])
+    sid = context.args[0]
     await db.delete_service(sid)
-    await update.callback_query.answer("Deleted")
+    await render.answer(update.callback_query, "Deleted")
     await list_services_btn(update, context)
 
 async def stats_btn(update, context):
     cnt = await db.get_all_users_count()
-    await update.callback_query.edit_message_text(f"Users: {cnt}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="admin_home")]]))
+    orders, revenue = await db.get_order_totals()
+    await render.edit(update.callback_query, f"Users: {cnt}\nCompleted Orders: {orders}\nRevenue: {revenue} TK", InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="admin_home")]]))
+
+async def backup_cmd(update, context):
+    if not is_admin(update.effective_user.id): return
+    if update.callback_query: await update.callback_query.answer("Creating backup...")
+    msg = update.effective_message
+    # Copies in small steps on a worker thread, so purchases keep going meanwhile.
+    # The order archive is part of the shop too, like in the scheduled backup.
+    for db_path in backup.databases(db.db_path):
+        try: info = await backup.snapshot(db_path)
+        except Exception as e:
+            await msg.reply_text(f"❌ Backup of {os.path.basename(db_path)} failed: {e}")
+            return
+        name = os.path.basename(info['path'])
+        caption = f"💾 {name}\n{info['db_bytes'] // 1024} KB → {info['gz_bytes'] // 1024} KB in {info['seconds']}s"
+        if info['gz_bytes'] > 50 * 1024 * 1024:
+            await msg.reply_text(caption + "\nToo large for Telegram; kept on the server.")
+            continue
+        with open(info['path'], 'rb') as f:
+            await msg.reply_document(f, filename=name, caption=caption)
+
+async def export_menu(update, context):
+    query = update.callback_query
+    text = "📤 **Export (CSV)**\nOrders by date: `/export orders 2024-01-01 2024-02-01`"
+    keyboard = [[InlineKeyboardButton("👥 Users", callback_data="export_users"),
+                 InlineKeyboardButton("🧾 Orders", callback_data="export_orders"),
+                 InlineKeyboardButton("📦 Stock", callback_data="export_stock")],
+                [InlineKeyboardButton("⬅️ Back", callback_data="admin_home")]]
+    await render.edit(query, text, InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+async def export_cmd(update, context):
+    # /export users | orders [FROM] [TO] | stock   (dates as YYYY-MM-DD, TO exclusive)
+    if not is_admin(update.effective_user.id): return
+    if update.callback_query: await update.callback_query.answer("Exporting...")
+    args = context.args or []  # export_{kind} buttons arrive as the same args
+    msg = update.effective_message
+    if not args or args[0] not in exports.EXPORTS:
+        await msg.reply_text("/export users | orders [YYYY-MM-DD] [YYYY-MM-DD] | stock")
+        return
+    kind = args[0]
+    try: since, until = (exports.parse_date(a) for a in (args[1:3] + [None, None])[:2])
+    except ValueError:
+        await msg.reply_text("❌ Dates must be YYYY-MM-DD")
+        return
+    try: spool, count = await exports.export_csv(db, kind, since, until)
+    except Exception as e:
+        await msg.reply_text(f"❌ Export failed: {e}")
+        return
+    with spool:
+        size = spool.seek(0, os.SEEK_END)
+        spool.seek(0)
+        if size > 50 * 1024 * 1024:
+            await msg.reply_text(f"❌ {count} rows is {size // 1024 // 1024} MB, over Telegram's 50 MB limit. Narrow the date range.")
+            return
+        await msg.reply_document(spool, filename=exports.filename(kind, since, until), caption=f"📤 {kind}: {count} rows")
 
 # --- Settings & Others ---
 async def settings_menu(update, context):
     query = update.callback_query
     ref_bonus = await db.get_setting('ref_bonus')
-    text = f"⚙️ **Settings**\nRef Bonus: {ref_bonus} TK"
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("✏️ Edit Ref Bonus", callback_data="set_ref_edit"), InlineKeyboardButton("⬅️ Back", callback_data="admin_home")]]))
+    upline = await db.get_setting('ref_upline')
+    if upline is None: upline = REFERRAL_UPLINE_BONUSES
+    text = f"⚙️ **Settings**\nRef Bonus: {ref_bonus} TK" + (f"\nUpline (level 2+): {upline.replace(',', '/')} TK" if upline else "")
+    await render.edit(query, text, InlineKeyboardMarkup([[InlineKeyboardButton("✏️ Edit Ref Bonus", callback_data="set_ref_edit"), InlineKeyboardButton("⬅️ Back", callback_data="admin_home")]]))
 
 async def start_edit_ref(update, context):
-    await update.callback_query.message.reply_text("New Amount:")
+    await update.callback_query.message.reply_text("New Amount (per level, e.g. 10 or 10/3/1):")
     return SETTINGS_REF_BONUS
 
 async def set_ref_bonus(update, context):
     try:
-        await db.set_setting('ref_bonus', int(update.message.text))
+        # "10/3/1": 10 TK to the referrer, 3 to its referrer, 1 to the next one up
+        levels = [int(x) for x in update.message.text.replace(",", "/").split("/")]
+        if any(x < 0 for x in levels): raise ValueError
+        await db.set_setting('ref_bonus', levels[0])
+        await db.set_setting('ref_upline', ",".join(str(x) for x in levels[1:]))
         await update.message.reply_text("✅ Saved", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Menu", callback_data="admin_home")]]))
     except: pass
     return ConversationHandler.END
@@ -242,7 +486,7 @@ async def codes_menu(update, context):
     query = update.callback_query
     text = "🎁 **Redeem Codes**"
     keyboard = [[InlineKeyboardButton("➕ Create Code", callback_data="code_add"), InlineKeyboardButton("📋 List/Del", callback_data="code_list")], [InlineKeyboardButton("⬅️ Back", callback_data="admin_home")]]
-    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+    await render.edit(query, text, InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
 async def start_add_code(update, context):
     await update.callback_query.message.reply_text("Amount:")
@@ -265,12 +509,13 @@ async def list_codes(update, context):
     codes = await db.get_all_codes()
     if not codes: await update.callback_query.edit_message_text("No Codes", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="admin_codes")]])); return
     keyboard = []
-    for c in codes: keyboard.append([InlineKeyboardButton(f"{c['code']} ({c['used_count']}/{c['max_uses']})", callback_data=f"del_code_{c['code']}")])
+    for c in codes: keyboard.append([InlineKeyboardButton(f"{c['code']} ({c['used_count']}/{c['max_uses']})", callback_data=router.data("del_code", c['code']))])
     keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="admin_codes")])
-    await update.callback_query.edit_message_text("Click to Delete:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await render.edit(update.callback_query, "Click to Delete:", InlineKeyboardMarkup(keyboard))
 
 async def delete_code_btn(update, context):
-    await db.delete_code(update.callback_query.data.split("_")[2])
+    # The code is the whole rest of the payload, underscores included
+    await db.delete_code(context.args[0])
     await list_codes(update, context)
 
 async def start_add_stock(update, context):
@@ -297,49 +542,198 @@ async def start_broadcast(update, context):
 async def broadcast_send(update, context):
     msg = update.message.text
     ids = await db.get_all_users_ids()
-    sender = Bot(USER_BOT_TOKEN)
-    for i in ids: 
-        try: await sender.send_message(i, msg); await asyncio.sleep(0.05)
-        except: pass
-    await update.message.reply_text("✅ Sent", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Menu", callback_data="admin_home")]]))
+    sent = 0
+    # Bulk class on the user bot's shared limiter (ratelimit.py): paced to the global rate and
+    # always behind purchase replies and notifications, so those stay fast meanwhile
+    async with ratelimit.bot(tenants.current().user_token) as sender:
+        async def send(uid):
+            try: await sender.send_message(uid, msg, rate_limit_args={'priority': 'bulk'}); return 1
+            except: return 0
+        for start in range(0, len(ids), 100):
+            sent += sum(await asyncio.gather(*(send(i) for i in ids[start:start + 100])))
+    await update.message.reply_text(f"✅ Sent to {sent}/{len(ids)}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Menu", callback_data="admin_home")]]))
     return ConversationHandler.END
 
 async def start_pay(update, context):
     if update.callback_query: await update.callback_query.answer()
-    await update.effective_message.reply_text("/pay [ID] [Amt]")
+    await update.effective_message.reply_text("/pay [ID] [Amt] [reason]\nUse a negative amount to deduct, e.g. /pay 123 -50\n\n"
+                                              "For many users, send a .csv file with lines: user_id,delta,reason")
 
 async def manage_balance_cmd(update, context):
     if not is_admin(update.effective_user.id): return
-    try: await db.update_balance(int(context.args[0]), int(context.args[1]), True); await update.message.reply_text("Done")
-    except: pass
+    try: uid, amount = int(context.args[0]), int(context.args[1])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /pay [ID] [Amt] [reason] (negative Amt deducts)")
+        return
+    if not amount:
+        await update.message.reply_text("❌ Amount can't be 0")
+        return
+    if not await db.get_user(uid):
+        await update.message.reply_text(f"❌ User {uid} not found")
+        return
+    reason = " ".join(context.args[2:])
+    ref = f"{update.effective_user.id}: {reason}" if reason else update.effective_user.id
+    balance = await db.update_balance(uid, amount, True, type='admin', ref=ref, check_funds=amount < 0)
+    if balance is None:
+        await update.message.reply_text(f"❌ Balance of {uid} is lower than {-amount} TK")
+        return
+    await update.message.reply_text(f"✅ {amount:+} TK for {uid}. New balance: {balance} TK")
+
+# --- Bulk Balance Adjustments (CSV upload) ---
+def _adjustment_notices(rows):
+    return [('user', uid, f"💰 Balance {'credited' if delta > 0 else 'debited'}: {delta:+} TK" + (f"\n📝 {reason}" if reason else ""))
+            for uid, delta, reason in rows]
+
+def _discard_upload(context):
+    path = context.user_data.pop('bulk_path', None)
+    if path and os.path.exists(path): os.remove(path)
+
+async def bulk_upload(update, context):
+    if not is_admin(update.effective_user.id): return
+    doc = update.message.document
+    _discard_upload(context)
+    fd, path = tempfile.mkstemp(suffix=".csv", prefix="bulk-")
+    os.close(fd)
+    try:
+        await (await doc.get_file()).download_to_drive(path)
+        report = await asyncio.to_thread(adjustments.validate, path)
+    except Exception as e:
+        os.remove(path)
+        await update.message.reply_text(f"❌ Couldn't read the file: {e}")
+        return
+    if report['errors'] or not report['rows']:
+        os.remove(path)
+        lines = "\n".join(f"Line {n}: {err}" if n else err for n, err in report['errors']) or "No rows found."
+        await update.message.reply_text(f"❌ **File rejected**\n{lines}", parse_mode='Markdown')
+        return
+    context.user_data['bulk_path'] = path
+    text = (f"📄 **Bulk Adjustment**\nRows: {report['rows']}\nUsers: {report['users']}\n"
+            f"Credit: +{report['credit']} TK\nDebit: -{report['debit']} TK")
+    keyboard = [[InlineKeyboardButton("✅ Apply", callback_data="bulk_apply"),
+                 InlineKeyboardButton("✅ Apply + Notify", callback_data="bulk_notify")],
+                [InlineKeyboardButton("❌ Cancel", callback_data="bulk_cancel")]]
+    await update.message.reply_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def bulk_action(update, context):
+    query = update.callback_query
+    if not is_admin(query.from_user.id): return
+    action = context.args[0]
+    path = context.user_data.get('bulk_path')
+    if action == "cancel" or not path:
+        _discard_upload(context)
+        await query.answer()
+        await query.edit_message_text("Cancelled." if path else "Nothing to apply, upload the file again.")
+        return
+    await query.answer("Applying...")
+    await query.edit_message_text("⏳ Applying...")
+    try:
+        # Notifications are queued with each chunk and delivered by the rate-limited outbox
+        result = await adjustments.apply(db, path, ref=f"bulk {query.from_user.id}",
+                                         notify_for=_adjustment_notices if action == "notify" else None)
+    finally:
+        _discard_upload(context)
+    text = (f"✅ **Applied {result['applied']} rows**\nCredit: +{result['credit']} TK\nDebit: -{result['debit']} TK")
+    for label, ids in (("Unknown users", result['unknown']), ("Skipped, balance too low", result['insufficient'])):
+        if ids: text += f"\n\n{label} ({len(ids)}): " + ", ".join(map(str, ids[:50])) + (" ..." if len(ids) > 50 else "")
+    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Menu", callback_data="admin_home")]]))
+
+async def reconcile_cmd(update, context):
+    if not is_admin(update.effective_user.id): return
+    msg = await update.message.reply_text("🔎 Reconciling balances...")
+    start = time.perf_counter()
+    checked, bad, rows = await db.reconcile_balances()
+    text = f"🧾 **Reconciliation**\nUsers: {checked}\nMismatches: {bad}\nTime: {time.perf_counter() - start:.2f}s"
+    if rows:
+        text += "\n\n" + "\n".join(f"`{uid}` balance {bal}, ledger {exp}" for uid, bal, exp in rows)
+    await msg.edit_text(text, parse_mode='Markdown')
+
+async def ledger_cmd(update, context):
+    if not is_admin(update.effective_user.id): return
+    try: uid = int(context.args[0])
+    except: return await update.message.reply_text("/ledger [ID]")
+    rows = await db.get_ledger(uid)
+    lines = [f"#{lid} {delta:+} {kind}" + (f" ({ref})" if ref else "") + f" {str(at)[:16]}" for lid, delta, kind, ref, at in rows]
+    await update.message.reply_text(f"📒 Ledger of {uid}\n" + ("\n".join(lines) or "No entries."))
+
+async def traces_cmd(update, context):
+    # /traces [count] [hours] - slowest exported traces, optionally only recent ones
+    if not is_admin(update.effective_user.id): return
+    try:
+        n = min(10, int(context.args[0])) if context.args else 5
+        hours = float(context.args[1]) if len(context.args) > 1 else None
+    except: return await update.message.reply_text("/traces [count] [hours]")
+    rows = await tracing.slowest(n, time.time() - hours * 3600 if hours else None, tenants.current().prefix)
+    if not rows:
+        return await update.message.reply_text(f"🐢 No traces yet (sampling {tracing.TRACE_SAMPLE_RATE:g}, slow ≥ {tracing.TRACE_SLOW_MS:g}ms)")
+    text = "🐢 Slowest traces\n\n" + "\n\n".join(tracing.format_trace(t) for t in rows)
+    await update.message.reply_text(text[:4000])
+
+async def routes_cmd(update, context):
+    # Callback routes of the bots in this process, busiest first
+    if not is_admin(update.effective_user.id): return
+    prefix = tenants.current().prefix
+    text = "\n\n".join(r.report() for name, r in router.routers.items() if name.startswith(prefix)) or "No routers."
+    await update.message.reply_text(f"🧭 Callback routes\n\n{text}"[:4000])
 
 async def cancel(update, context):
     await update.message.reply_text("Cancelled.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Menu", callback_data="admin_home")]]))
     return ConversationHandler.END
 
 def setup_admin_bot(application):
-    application.add_handler(CommandHandler("start", admin_start))
-    application.add_handler(CallbackQueryHandler(admin_start, pattern="^admin_home"))
-    
+    tenant = application.bot_data.setdefault('tenant', tenants.default())
+    # Buttons (router.py); callbacks of non-admins are dropped
+    routes = router.Router(tenant.label("admin"), guard=lambda update: is_admin(update.effective_user.id))
+    routes.add("admin_home", admin_start)
+
     # Pendings
-    application.add_handler(CallbackQueryHandler(list_pending_orders, pattern="^admin_pending"))
-    application.add_handler(CallbackQueryHandler(view_order, pattern="^ord_view_"))
-    application.add_handler(CallbackQueryHandler(order_action, pattern="^ord_act_"))
-    
+    routes.add("admin_pending", list_pending_orders)
+    routes.add("ord_view", view_order, int)
+    routes.add("ord_act", order_action, router.choice("complete", "refund"), int)
+    routes.add("ord_next", next_order)
+    routes.add("ord_rel", release_order, int)
+    routes.add("ord_stats", admin_stats)
+    routes.add("ord_page", pending_page, int)
+    routes.add("ord_sel", toggle_order_select, int)
+    routes.add("ord_sel_clear", toggle_order_select)
+    routes.add("ord_svcs", pending_by_service)
+    routes.add("ord_svc", pending_service_actions, int)
+    routes.add("ord_batch", batch_order_action, router.choice("complete", "refund"), router.choice("sel", "svc"), int)
+
     # Services
-    application.add_handler(CallbackQueryHandler(list_services_btn, pattern="^admin_list_svc"))
-    application.add_handler(CallbackQueryHandler(service_options, pattern="^svc_opt_"))
-    application.add_handler(CallbackQueryHandler(delete_service_btn, pattern="^svc_del_"))
-    
-    # Settings & Codes
-    application.add_handler(CallbackQueryHandler(settings_menu, pattern="^admin_settings"))
-    application.add_handler(CallbackQueryHandler(codes_menu, pattern="^admin_codes"))
-    application.add_handler(CallbackQueryHandler(list_codes, pattern="^code_list"))
-    application.add_handler(CallbackQueryHandler(delete_code_btn, pattern="^del_code_"))
+    routes.add("admin_list_svc", list_services_btn)
+    routes.add("svc_opt", service_options, int)
+    routes.add("svc_del", delete_service_btn, int)
+    routes.add("svc_cat", service_category_menu, int)
+    routes.add("svc_setcat", set_service_category_btn, int, int)
+    routes.add("admin_cats", categories_menu)
+    routes.add("acat_del", delete_category_btn, int)
 
-    application.add_handler(CallbackQueryHandler(stats_btn, pattern="^admin_stats"))
-    application.add_handler(CallbackQueryHandler(start_pay, pattern="^admin_pay"))
+    # Settings & Codes
+    routes.add("admin_settings", settings_menu)
+    routes.add("admin_codes", codes_menu)
+    routes.add("code_list", list_codes)
+    routes.add("del_code", delete_code_btn, str)
+
+    routes.add("admin_stats", stats_btn)
+    routes.add("admin_pay", start_pay)
+    routes.add("bulk", bulk_action, router.choice("apply", "notify", "cancel"))
+    routes.add("admin_backup", backup_cmd)
+    routes.add("admin_export", export_menu)
+    routes.add("export", export_cmd, str)
+
+    application.add_handler(TypeHandler(Update, tenants.bind_handler), group=-100)
+    application.add_handler(CommandHandler("start", admin_start))
+    application.add_handler(routes.handler())
+    application.add_handler(CommandHandler("addcat", add_category_cmd))
+    application.add_handler(CommandHandler("lowstock", low_stock_cmd))
     application.add_handler(CommandHandler("pay", manage_balance_cmd))
+    application.add_handler(MessageHandler(filters.Document.FileExtension("csv"), bulk_upload))
+    application.add_handler(CommandHandler("reconcile", reconcile_cmd))
+    application.add_handler(CommandHandler("ledger", ledger_cmd))
+    application.add_handler(CommandHandler("traces", traces_cmd))
+    application.add_handler(CommandHandler("routes", routes_cmd))
+    application.add_handler(CommandHandler("backup", backup_cmd))
+    application.add_handler(CommandHandler("export", export_cmd))
     
     cancel_handlers = [CommandHandler("cancel", cancel), CommandHandler("start", admin_start)]
     
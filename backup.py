@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import datetime
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from config import DB_PATH, BACKUP_DIR, BACKUP_KEEP, BACKUP_PAGES_PER_STEP, BACKUP_STEP_PAUSE, BACKUP_MAX_RESTARTS
+from database import Database
+
+# Online snapshots of the live database with SQLite's backup API. Pages are copied
+# in small steps from a worker thread with a short pause between steps, so the bot
+# keeps reading and writing (WAL) while a snapshot is taken. Every write made meanwhile
+# restarts the copy, so under steady writes it falls back to one step after
+# BACKUP_MAX_RESTARTS restarts (a single read transaction; WAL writers aren't blocked).
+#
+# A shop is two files: the database and, once orders have been archived, its
+# <db>_archive.db. Both are snapshotted together; a snapshot restores onto the file
+# its name belongs to.
+#
+#   python backup.py create                    snapshot the database (and archive) now
+#   python backup.py list                      list snapshots
+#   python backup.py verify FILE [FILE]        integrity-check snapshots
+#   python backup.py restore FILE [FILE]       replace the database / archive (stop the bot first!)
+
+SUFFIX = ".db.gz"
+
+
+def _prefix(db_path):
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+
+def list_snapshots(db_path=DB_PATH, dest=BACKUP_DIR):
+    return sorted(glob.glob(os.path.join(dest, f"{_prefix(db_path)}-*{SUFFIX}")))
+
+
+def databases(db_path=DB_PATH):
+    # Files making up a shop: the database, plus the archive once there is one
+    archive = Database(db_path).archive_path
+    return [db_path] + ([archive] if os.path.exists(archive) else [])
+
+
+def target_for(path, db_path=DB_PATH):
+    # The file a snapshot restores onto, from its name; foreign names go to the database
+    name = os.path.basename(path)
+    archive = Database(db_path).archive_path
+    return archive if name.startswith(f"{_prefix(archive)}-") else db_path
+
+
+class _Restarting(Exception):
+    pass
+
+
+def _backup(db_path, target, pages, pause, max_restarts):
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(target)
+    left, restarts = None, 0
+    try:
+        def progress(status, remaining, total):
+            nonlocal left, restarts
+            # More pages left than after the previous step: the copy started over
+            if left is not None and remaining > left:
+                restarts += 1
+                if restarts > max_restarts: raise _Restarting()
+            left = remaining
+            if pause: time.sleep(pause)
+        with dst:
+            src.backup(dst, pages=pages, progress=progress)
+        ok = dst.execute("PRAGMA quick_check").fetchone()[0]
+        if ok != "ok": raise RuntimeError(f"snapshot check failed: {ok}")
+    finally:
+        dst.close()
+        src.close()
+
+
+def _copy(db_path, target, pages, pause, max_restarts=BACKUP_MAX_RESTARTS):
+    # A failed copy never leaves a partial target behind
+    try:
+        try: _backup(db_path, target, pages, pause, max_restarts)
+        except _Restarting:
+            print(f"⚠️ Backup of {db_path} restarted {max_restarts} times, copying in one step")
+            os.remove(target)
+            _backup(db_path, target, -1, 0, max_restarts)
+    except BaseException:
+        if os.path.exists(target): os.remove(target)
+        raise
+
+
+def create_snapshot(db_path=DB_PATH, dest=BACKUP_DIR, keep=BACKUP_KEEP, pages=BACKUP_PAGES_PER_STEP, pause=BACKUP_STEP_PAUSE):
+    # Blocking; call through snapshot() from async code
+    os.makedirs(dest, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    raw = os.path.join(dest, f".{_prefix(db_path)}-{stamp}.tmp")
+    final = os.path.join(dest, f"{_prefix(db_path)}-{stamp}{SUFFIX}")
+    start = time.perf_counter()
+    try:
+        _copy(db_path, raw, pages, pause)
+        with open(raw, "rb") as fin, gzip.open(final + ".part", "wb", compresslevel=6) as fout:
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+        os.replace(final + ".part", final)
+        size = os.path.getsize(raw)
+    finally:
+        for leftover in (raw, final + ".part"):
+            if os.path.exists(leftover): os.remove(leftover)
+
+    for old in list_snapshots(db_path, dest)[:-keep] if keep > 0 else []:
+        os.remove(old)
+    return {'path': final, 'db_bytes': size, 'gz_bytes': os.path.getsize(final),
+            'seconds': round(time.perf_counter() - start, 2)}
+
+
+async def snapshot(db_path=DB_PATH, dest=BACKUP_DIR):
+    return await asyncio.to_thread(create_snapshot, db_path, dest)
+
+
+def _unpack(path, target):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as fin, open(target, "wb") as fout:
+        shutil.copyfileobj(fin, fout, 1024 * 1024)
+
+
+def verify_snapshot(path):
+    raw = path + ".verify.tmp"
+    try:
+        _unpack(path, raw)
+        conn = sqlite3.connect(raw)
+        try:
+            result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+            counts = {t: conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables}
+        finally:
+            conn.close()
+        return {'ok': result == "ok", 'integrity': result, 'rows': counts}
+    finally:
+        if os.path.exists(raw): os.remove(raw)
+
+
+def restore_snapshot(path, db_path=DB_PATH):
+    report = verify_snapshot(path)
+    if not report['ok']:
+        raise RuntimeError(f"refusing to restore, integrity check: {report['integrity']}")
+    tmp = db_path + ".restore.tmp"
+    _unpack(path, tmp)
+    if os.path.exists(db_path):
+        shutil.copy2(db_path, db_path + ".pre-restore")
+    os.replace(tmp, db_path)
+    # Stale WAL/shared-memory files belong to the old database
+    for ext in ("-wal", "-shm"):
+        if os.path.exists(db_path + ext): os.remove(db_path + ext)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database snapshots")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("create")
+    sub.add_parser("list")
+    p = sub.add_parser("verify"); p.add_argument("files", nargs="+")
+    p = sub.add_parser("restore"); p.add_argument("files", nargs="+"); p.add_argument("--yes", action="store_true")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--dir", default=BACKUP_DIR)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "create":
+        for db_path in databases(args.db):
+            info = create_snapshot(db_path, args.dir)
+            print(f"✅ {info['path']} ({info['db_bytes']} -> {info['gz_bytes']} bytes, {info['seconds']}s)")
+    elif args.cmd == "list":
+        for db_path in databases(args.db):
+            for path in list_snapshots(db_path, args.dir):
+                print(f"{path}  {os.path.getsize(path)} bytes")
+    elif args.cmd == "verify":
+        failed = 0
+        for path in args.files:
+            report = verify_snapshot(path)
+            failed += not report['ok']
+            print(("✅" if report['ok'] else "❌") + f" {path} integrity: {report['integrity']}")
+            for table, count in report['rows'].items():
+                print(f"  {table}: {count}")
+        return 1 if failed else 0
+    elif args.cmd == "restore":
+        targets = {path: target_for(path, args.db) for path in args.files}
+        if len(set(targets.values())) < len(targets):
+            print("Pass at most one snapshot of the database and one of its archive.")
+            return 1
+        if not args.yes:
+            print(f"This replaces {', '.join(targets.values())} (copies are kept as .pre-restore). "
+                  "Stop the bot first, then re-run with --yes.")
+            return 1
+        # Check everything first so a bad file doesn't leave a half-restored shop
+        for path in targets:
+            report = verify_snapshot(path)
+            if not report['ok']:
+                print(f"❌ {path} integrity: {report['integrity']}")
+                return 1
+        for path, db_path in targets.items():
+            report = restore_snapshot(path, db_path)
+            print(f"✅ Restored {path} -> {db_path} ({sum(report['rows'].values())} rows)")
+        archive = Database(args.db).archive_path
+        if archive not in targets.values() and os.path.exists(archive):
+            print(f"ℹ️ {archive} was left as it is; restore its snapshot from the same time too.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
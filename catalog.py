@@ -0,0 +1,180 @@
+import collections
+import time
+import unicodedata
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from database import Database
+from config import CATALOG_PAGE_SIZE, CATALOG_CACHE_SECONDS, CATALOG_CACHE_SIZE, SEARCH_CACHE_SIZE, INLINE_RESULTS
+import i18n
+
+# Paginated shop screens: categories -> services of a category (sortable).
+# Rendered pages (text + markup) are cached per database/language/category/sort/page for
+# CATALOG_CACHE_SECONDS and dropped right away when an admin edits the catalog
+# in this process (Database 'catalog' event). At most CATALOG_CACHE_SIZE pages are kept,
+# least recently used first out; inline search results have a cache of their own, so
+# a burst of queries can't push the pages out.
+#
+# Callback data:  cats_{page}                     category list
+#                 cat_{category}_{sort}_{page}    services (category 0 = "Other")
+#                 buy_{service}                   handled by user_bot.buy_confirm
+
+SORTS = ('pop', 'asc', 'desc')
+
+
+class PageCache:
+    def __init__(self, ttl=CATALOG_CACHE_SECONDS, size=CATALOG_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._pages = collections.OrderedDict()
+        self.hits = self.misses = 0
+
+    def _entry(self, key):
+        entry = self._pages.get(key)
+        if entry is None: return None
+        if entry[0] <= time.monotonic():
+            del self._pages[key]
+            return None
+        return entry
+
+    def get(self, key):
+        entry = self._entry(key)
+        if entry:
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def peek(self, key):
+        # Like get() without counting or refreshing the entry's place
+        entry = self._entry(key)
+        return entry[1] if entry else None
+
+    def put(self, key, page):
+        self._pages[key] = (time.monotonic() + self.ttl, page)
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.size: self._pages.popitem(last=False)
+        return page
+
+    def on_event(self, event, user_id, *args):
+        if event == 'catalog': self._pages.clear()
+
+
+cache = PageCache()
+searches = PageCache(size=SEARCH_CACHE_SIZE)
+
+
+def attach():
+    for c in (cache, searches):
+        if c.on_event not in Database.listeners:
+            Database.listeners.append(c.on_event)
+
+
+def _nav(s, prefix, page, pages):
+    row = []
+    if page > 0: row.append(InlineKeyboardButton(s['btn_prev'], callback_data=f"{prefix}_{page - 1}"))
+    if pages > 1: row.append(InlineKeyboardButton(s.fmt('page_label', page + 1, pages), callback_data=f"{prefix}_{page}"))
+    if page < pages - 1: row.append(InlineKeyboardButton(s['btn_next'], callback_data=f"{prefix}_{page + 1}"))
+    return [row] if row else []
+
+
+async def categories_page(db, lang, page=0):
+    # None when there is nothing to choose between (no categories defined)
+    key = (db.db_path, 'cats', lang, page)
+    cached = cache.get(key)
+    if cached: return cached
+    s = i18n.get(lang)
+    cats = [c for c in await db.get_categories() if c[2]]
+    if not cats or (len(cats) == 1 and cats[0][0] == 0):
+        return None
+    pages = (len(cats) - 1) // CATALOG_PAGE_SIZE + 1
+    page = max(0, min(page, pages - 1))
+    rows = [[InlineKeyboardButton(f"{name or s['category_other']} ({count})", callback_data=f"cat_{cid}_pop_0")]
+            for cid, name, count in cats[page * CATALOG_PAGE_SIZE:(page + 1) * CATALOG_PAGE_SIZE]]
+    rows += _nav(s, "cats", page, pages)
+    rows.append([InlineKeyboardButton(s['btn_back'], callback_data="menu_main")])
+    return cache.put(key, (s['shop_categories'], InlineKeyboardMarkup(rows)))
+
+
+async def services_page(db, lang, category_id, sort='pop', page=0):
+    # None when the category has no services
+    if sort not in SORTS: sort = 'pop'
+    key = (db.db_path, 'svcs', lang, category_id, sort, page)
+    cached = cache.get(key)
+    if cached: return cached
+    s = i18n.get(lang)
+    # category None = every service (shop without categories)
+    services, total = await db.get_services_page(category_id, sort, CATALOG_PAGE_SIZE, page * CATALOG_PAGE_SIZE)
+    if not total: return None
+    pages = (total - 1) // CATALOG_PAGE_SIZE + 1
+    if not services:
+        return await services_page(db, lang, category_id, sort, pages - 1)
+
+    rows = []
+    for svc in services:
+        stock_msg = ""
+        if svc['type'] == 'auto':
+            stock_msg = s.fmt('stock_count', svc['stock_count']) if svc['stock_count'] > 0 else s['stock_out']
+        # Format: Name | Price TK (Stock)
+        rows.append([InlineKeyboardButton(s.fmt('shop_item', svc['name'], svc['price'], stock_msg), callback_data=f"buy_{svc['id']}")])
+
+    cat = "all" if category_id is None else category_id
+    rows += _nav(s, f"cat_{cat}_{sort}", page, pages)
+    rows.append([InlineKeyboardButton(("✅ " if sort == o else "") + s[f'btn_sort_{o}'], callback_data=f"cat_{cat}_{o}_0") for o in SORTS])
+    rows.append([InlineKeyboardButton(s['btn_back'], callback_data="menu_main" if category_id is None else "cats_0")])
+    return cache.put(key, (s['btn_shop'], InlineKeyboardMarkup(rows)))
+
+
+def parse_category(value):
+    return None if value == "all" else int(value)
+
+
+# --- Inline Search ---
+# Results are cached per normalized query. While a user types, each query extends
+# the previous one, and its matches are a subset of the shorter query's matches; when
+# that list was complete (fewer than INLINE_RESULTS rows), it is filtered locally
+# instead of querying again. Only FTS5 results are narrowed this way, with FTS5's own
+# word rules (_words); LIKE results (no FTS5) match substrings and are always queried.
+
+def _words(text, fold=False):
+    # Split like FTS5's unicode61 tokenizer: letters, digits and marks (Bengali and
+    # Arabic vowel signs) are word characters, everything else separates words.
+    # fold: also drop Latin diacritics, as unicode61 does when matching ("cafe" ~ "café").
+    text = text.lower()
+    if fold:
+        text = unicodedata.normalize("NFC", "".join(ch for ch in unicodedata.normalize("NFD", text)
+                                                    if not "\u0300" <= ch <= "\u036f"))
+    words, word = [], []
+    for ch in text:
+        cat = unicodedata.category(ch)
+        if cat[0] in "LNM" or cat == "Co":
+            word.append(ch)
+        elif word:
+            words.append("".join(word))
+            word = []
+    if word: words.append("".join(word))
+    return words
+
+
+def search_terms(text):
+    return tuple(_words(text))[:8]
+
+
+def _matches(row, terms):
+    words = _words(f"{row[1]} {row[5] or ''}", fold=True)
+    return all(any(w.startswith(t) for w in words) for t in _words(" ".join(terms), fold=True))
+
+
+async def search(db, text):
+    terms = search_terms(text)
+    key = (db.db_path, 'q') + terms
+    cached = searches.get(key)
+    if cached is not None: return cached[0]
+    norm = " ".join(terms)
+    for cut in range(len(norm) - 1, 0, -1):
+        shorter = searches.peek((db.db_path, 'q') + search_terms(norm[:cut]))
+        if shorter is not None and shorter[1]:
+            rows = [r for r in shorter[0] if _matches(r, terms)]
+            return searches.put(key, (rows, True))[0]
+    rows, fts = await db.search_services(terms, INLINE_RESULTS)
+    # Complete and narrowable: FTS5 served every match there is
+    return searches.put(key, (rows, fts and len(rows) < INLINE_RESULTS))[0]
@@ -12,3 +12,137 @@ ADMIN_IDS = [
 
 # Database Path
 DB_PATH = "bot_database.db"
+
+# Localization: one JSON language pack per file (locales/<code>.json)
+LOCALES_DIR = os.getenv("LOCALES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales"))
+DEFAULT_LANG = "en"
+
+# Leaderboard
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", 10))
+LEADERBOARD_RECONCILE_SECONDS = int(os.getenv("LEADERBOARD_RECONCILE_SECONDS", 300))
+LEADERBOARD_REBUILD_SECONDS = int(os.getenv("LEADERBOARD_REBUILD_SECONDS", 3600))
+
+# Notification outbox
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", 8))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 50))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", 5))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 10))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", 2))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", 600))
+
+# Process model: 1 = both bots in this process; N > 1 = supervisor + N user-bot workers + admin process
+WORKERS = int(os.getenv("WORKERS", 1))
+# A worker being stopped (restart, shutdown) first gets WORKER_STOP_SECONDS to handle its
+# queue, then is told to stop at once and given WORKER_EXIT_SECONDS to exit
+WORKER_STOP_SECONDS = float(os.getenv("WORKER_STOP_SECONDS", 30))
+WORKER_EXIT_SECONDS = float(os.getenv("WORKER_EXIT_SECONDS", 5))
+
+# Max updates processed at once per bot (updates of one user stay sequential); 1 = sequential
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", 32))
+
+# Background maintenance jobs: run interval in seconds (0 disables a job)
+JOB_INTERVALS = {
+    'pending_orders': int(os.getenv("JOB_PENDING_ORDERS_SECONDS", 600)),
+    'db_checkpoint': int(os.getenv("JOB_DB_CHECKPOINT_SECONDS", 3600)),
+    'db_vacuum': int(os.getenv("JOB_DB_VACUUM_SECONDS", 6 * 3600)),
+    'purge_codes': int(os.getenv("JOB_PURGE_CODES_SECONDS", 24 * 3600)),
+    'rollups': int(os.getenv("JOB_ROLLUPS_SECONDS", LEADERBOARD_RECONCILE_SECONDS)),
+}
+JOB_JITTER_SECONDS = int(os.getenv("JOB_JITTER_SECONDS", 30))
+ORDER_ESCALATE_HOURS = float(os.getenv("ORDER_ESCALATE_HOURS", 6))      # notify admins (0 = off)
+ORDER_AUTO_REFUND_HOURS = float(os.getenv("ORDER_AUTO_REFUND_HOURS", 48))  # refund automatically (0 = off)
+CODE_RETENTION_DAYS = int(os.getenv("CODE_RETENTION_DAYS", 30))
+VACUUM_PAGES = int(os.getenv("VACUUM_PAGES", 1000))
+
+# Online database snapshots (backup.py)
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", 7))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", 256))
+BACKUP_STEP_PAUSE = float(os.getenv("BACKUP_STEP_PAUSE", 0.005))
+# A write from another connection makes a stepwise copy start over; after this many
+# restarts the snapshot is taken in a single step instead
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", 3))
+JOB_INTERVALS['backup'] = int(os.getenv("JOB_BACKUP_SECONDS", 24 * 3600))
+
+# Order archive: finished orders older than this move to <db>_archive.db (minimum 8 days)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 30))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 500))
+JOB_INTERVALS['archive_orders'] = int(os.getenv("JOB_ARCHIVE_ORDERS_SECONDS", 6 * 3600))
+
+# Balance ledger: how often per-user snapshots absorb new ledger entries
+JOB_INTERVALS['balance_snapshot'] = int(os.getenv("JOB_BALANCE_SNAPSHOT_SECONDS", 3600))
+
+# CSV exports: rows fetched per chunk, and size before the temp file spills to disk
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 2000))
+EXPORT_SPOOL_BYTES = int(os.getenv("EXPORT_SPOOL_BYTES", 8 * 1024 * 1024))
+
+# Bulk balance adjustments (CSV upload): rows per transaction, and the largest file accepted
+BULK_CHUNK_ROWS = int(os.getenv("BULK_CHUNK_ROWS", 1000))
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", 200000))
+
+# Shop catalog: buttons per page, and how long a rendered page is reused (stock counts may lag by this much)
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", 8))
+CATALOG_CACHE_SECONDS = float(os.getenv("CATALOG_CACHE_SECONDS", 30))
+# Most rendered pages / inline search results kept (least recently used go first)
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", 2000))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 5000))
+
+# Inline search (@bot query): results per answer, and how long Telegram may cache an answer
+INLINE_RESULTS = int(os.getenv("INLINE_RESULTS", 20))
+INLINE_CACHE_SECONDS = int(os.getenv("INLINE_CACHE_SECONDS", 60))
+
+# Readiness (/ready) and shutdown: a bot is unready when getUpdates hasn't succeeded for
+# READY_MAX_POLL_AGE seconds or more than READY_MAX_QUEUE updates wait; SIGTERM drains
+# in-flight updates and notifications for up to DRAIN_SECONDS
+READY_MAX_POLL_AGE = float(os.getenv("READY_MAX_POLL_AGE", 90))
+READY_MAX_QUEUE = int(os.getenv("READY_MAX_QUEUE", 500))
+DRAIN_SECONDS = float(os.getenv("DRAIN_SECONDS", 25))
+
+# Tracing (see tracing.py): share of updates traced, traces at least this slow are always
+# kept, JSON-lines file and/or UDP collector (host:port) they go to, traces kept in memory
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", 1500))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_COLLECTOR = os.getenv("TRACE_COLLECTOR", "")
+TRACE_KEEP = int(os.getenv("TRACE_KEEP", 200))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", 200))
+
+# Screen rendering (render.py): messages whose last rendered screen is remembered
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", 10000))
+
+# Outbound rate limits per bot token (ratelimit.py): messages per second overall, per
+# private chat (with bursts), per group per minute; retries after a flood wait
+RATE_GLOBAL_PER_SECOND = float(os.getenv("RATE_GLOBAL_PER_SECOND", 28))
+RATE_CHAT_PER_SECOND = float(os.getenv("RATE_CHAT_PER_SECOND", 1))
+RATE_CHAT_BURST = int(os.getenv("RATE_CHAT_BURST", 3))
+RATE_GROUP_PER_MINUTE = float(os.getenv("RATE_GROUP_PER_MINUTE", 20))
+RATE_MAX_RETRIES = int(os.getenv("RATE_MAX_RETRIES", 2))
+
+# Fulfillment queue: how long an admin's claim on a manual order lasts before others can take it
+ORDER_CLAIM_SECONDS = int(os.getenv("ORDER_CLAIM_SECONDS", 600))
+
+# Multi-tenant mode (tenants.py): JSON file listing the shops this process serves (empty =
+# the single shop configured above), how often it is checked for changes, where tenant
+# databases go unless a db_path is given; API calls of all bots share HTTP_POOL_SIZE connections
+TENANTS_FILE = os.getenv("TENANTS_FILE", "")
+TENANTS_RELOAD_SECONDS = float(os.getenv("TENANTS_RELOAD_SECONDS", 30))
+TENANTS_DIR = os.getenv("TENANTS_DIR", "tenants")
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 32))
+
+# Balance top-ups (topup.py): HMAC secret shared with the payment provider (empty = off, the
+# Add Balance button says "coming soon"), checkout link with {invoice} and {amount}, amounts
+# offered, invoice lifetime, callbacks queued at most / applied per transaction, and how long
+# a callback waits for its batch before the provider is told to retry
+TOPUP_SECRET = os.getenv("TOPUP_SECRET", "")
+TOPUP_PAY_URL = os.getenv("TOPUP_PAY_URL", "")
+TOPUP_AMOUNTS = [int(a) for a in os.getenv("TOPUP_AMOUNTS", "50,100,200,500,1000").split(",") if a.strip()]
+TOPUP_INVOICE_MINUTES = int(os.getenv("TOPUP_INVOICE_MINUTES", 60))
+TOPUP_QUEUE_SIZE = int(os.getenv("TOPUP_QUEUE_SIZE", 5000))
+TOPUP_BATCH_SIZE = int(os.getenv("TOPUP_BATCH_SIZE", 200))
+TOPUP_REPLY_SECONDS = float(os.getenv("TOPUP_REPLY_SECONDS", 10))
+
+# Multi-level referrals: TK for the referrer's upline on each signup, level 2 first
+# (e.g. "3,1"; level 1 is the ref_bonus setting). Default for the admin-editable
+# 'ref_upline' setting; the referral tree is kept REFERRAL_TREE_DEPTH levels deep.
+REFERRAL_UPLINE_BONUSES = os.getenv("REFERRAL_UPLINE_BONUSES", "")
+REFERRAL_TREE_DEPTH = int(os.getenv("REFERRAL_TREE_DEPTH", 10))
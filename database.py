@@ -1,14 +1,72 @@
 
 import aiosqlite
+import contextlib
 import datetime
-from config import DB_PATH
+import os
+import secrets
+import time
+import zlib
+from config import DB_PATH, REFERRAL_TREE_DEPTH
+from tracing import trace_methods
 
+@trace_methods("db.")
 class Database:
-    def __init__(self, db_path=DB_PATH):
+    # Callbacks fn(event, user_id, *args) fired after a change is committed:
+    #   ('user', uid)                  new user registered
+    #   ('balance', uid, old, new)     balance changed
+    #   ('referrals', uid, old, new)   total_referrals changed
+    #   ('spent', uid, amount)         order placed
+    #   ('refund', uid, amount, purchased_at)  order refunded
+    #   ('outbox', None)               notifications queued
+    #   ('catalog', None)              services, categories or stock edited by an admin
+    # Database.listeners hear every instance; db.local_listeners only that one (per tenant
+    # state such as its leaderboard and outbox, see tenants.py)
+    listeners = []
+
+    def __init__(self, db_path=DB_PATH, archive_path=None):
         self.db_path = db_path
+        # Archived (cold) orders live in a sibling file, e.g. bot_database_archive.db
+        self.archive_path = archive_path or os.path.splitext(db_path)[0] + "_archive.db"
+        self.local_listeners = []
+        self.has_fts = None  # services_fts exists (FTS5 build); checked once, see _check_fts
+
+    def _emit(self, event, user_id, *args):
+        for fn in Database.listeners + self.local_listeners:
+            try: fn(event, user_id, *args)
+            except Exception as e: print(f"⚠️ Listener error ({event}): {e}")
+
+    # Bump whenever the schema or a migration in _migrate changes: a database already
+    # at this version (PRAGMA user_version) skips all of it on startup
+    SCHEMA_VERSION = 4
 
     async def init_db(self):
+        # Returns True when the schema had to be created or migrated
         async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute("PRAGMA user_version") as cursor:
+                version = (await cursor.fetchone())[0]
+        if version == self.SCHEMA_VERSION and os.path.exists(self.archive_path):
+            await self._check_fts()
+            return False
+        await self._migrate()
+        await self._check_fts()
+        return True
+
+    async def _check_fts(self, db=None):
+        # _migrate only creates services_fts where SQLite has FTS5
+        if db is None:
+            async with aiosqlite.connect(self.db_path) as db:
+                return await self._check_fts(db)
+        async with db.execute("SELECT 1 FROM sqlite_master WHERE name = 'services_fts'") as cursor:
+            self.has_fts = await cursor.fetchone() is not None
+        return self.has_fts
+
+    async def _migrate(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            # Only takes effect on a new database file (so it must come first); lets
+            # maintenance reclaim free pages gradually
+            await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # WAL lets readers run alongside the writer (and other processes, see supervisor.py)
+            await db.execute("PRAGMA journal_mode=WAL")
             # Users Table
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -52,6 +110,72 @@ class Database:
                     FOREIGN KEY(service_id) REFERENCES services(id) ON DELETE CASCADE
                 )
             ''')
+            # Migration: stock counter kept by the triggers below, and low-stock alert level (0 = off)
+            try:
+                await db.execute("ALTER TABLE services ADD COLUMN stock_count INTEGER DEFAULT 0")
+                await db.execute("UPDATE services SET stock_count = (SELECT COUNT(*) FROM stock WHERE stock.service_id = services.id)")
+                await db.commit()
+            except: pass # Already exists
+            try:
+                await db.execute("ALTER TABLE services ADD COLUMN low_stock INTEGER DEFAULT 0")
+                await db.commit()
+            except: pass # Already exists
+            # Counters change in the same transaction as the stock row, so they stay exact
+            await db.execute('''
+                CREATE TRIGGER IF NOT EXISTS stock_count_insert AFTER INSERT ON stock BEGIN
+                    UPDATE services SET stock_count = stock_count + 1 WHERE id = NEW.service_id;
+                END
+            ''')
+            await db.execute('''
+                CREATE TRIGGER IF NOT EXISTS stock_count_delete AFTER DELETE ON stock BEGIN
+                    UPDATE services SET stock_count = stock_count - 1 WHERE id = OLD.service_id;
+                END
+            ''')
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_stock_service ON stock (service_id, id)")
+
+            # Categories; services without one are listed under "Other"
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS categories (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT UNIQUE,
+                    position INTEGER DEFAULT 0
+                )
+            ''')
+            try:
+                await db.execute("ALTER TABLE services ADD COLUMN category_id INTEGER")
+                await db.commit()
+            except: pass # Already exists
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_services_category ON services (category_id)")
+
+            # Full-text index over service name/description for inline search. External
+            # content table kept in sync by triggers; needs SQLite built with FTS5.
+            try:
+                async with db.execute("SELECT 1 FROM sqlite_master WHERE name = 'services_fts'") as cursor:
+                    new_fts = await cursor.fetchone() is None
+                await db.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS services_fts USING fts5(
+                        name, description, content='services', content_rowid='id', prefix='2 3'
+                    )
+                ''')
+                await db.execute('''
+                    CREATE TRIGGER IF NOT EXISTS services_fts_insert AFTER INSERT ON services BEGIN
+                        INSERT INTO services_fts (rowid, name, description) VALUES (NEW.id, NEW.name, NEW.description);
+                    END
+                ''')
+                await db.execute('''
+                    CREATE TRIGGER IF NOT EXISTS services_fts_delete AFTER DELETE ON services BEGIN
+                        INSERT INTO services_fts (services_fts, rowid, name, description) VALUES ('delete', OLD.id, OLD.name, OLD.description);
+                    END
+                ''')
+                await db.execute('''
+                    CREATE TRIGGER IF NOT EXISTS services_fts_update AFTER UPDATE OF name, description ON services BEGIN
+                        INSERT INTO services_fts (services_fts, rowid, name, description) VALUES ('delete', OLD.id, OLD.name, OLD.description);
+                        INSERT INTO services_fts (rowid, name, description) VALUES (NEW.id, NEW.name, NEW.description);
+                    END
+                ''')
+                if new_fts: await db.execute("INSERT INTO services_fts (services_fts) VALUES ('rebuild')")
+            except aiosqlite.OperationalError as e:
+                print(f"⚠️ FTS5 unavailable, inline search falls back to LIKE: {e}")
             # Orders Table
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS orders (
@@ -65,6 +189,32 @@ class Database:
                     purchased_at TIMESTAMP
                 )
             ''')
+            # Migration: SLA escalation marker for pending orders
+            try:
+                await db.execute("ALTER TABLE orders ADD COLUMN escalated_at TIMESTAMP")
+                await db.commit()
+            except: pass # Already exists
+            # Migration: fulfillment claims (unix times) and who handled the order
+            for column in ("claimed_by INTEGER", "claimed_at REAL", "claimed_until REAL", "handled_by INTEGER", "handled_at REAL"):
+                try:
+                    await db.execute(f"ALTER TABLE orders ADD COLUMN {column}")
+                    await db.commit()
+                except: pass # Already exists
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, purchased_at)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_handled ON orders (handled_at) WHERE handled_by IS NOT NULL")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id, purchased_at)")
+            # Migration: purchase counter for "popular" sorting, kept by a trigger on orders
+            try:
+                await db.execute("ALTER TABLE services ADD COLUMN sold_count INTEGER DEFAULT 0")
+                await db.execute("UPDATE services SET sold_count = (SELECT COUNT(*) FROM orders WHERE orders.service_id = services.id)")
+                await db.commit()
+            except: pass # Already exists
+            await db.execute('''
+                CREATE TRIGGER IF NOT EXISTS sold_count_insert AFTER INSERT ON orders BEGIN
+                    UPDATE services SET sold_count = sold_count + 1 WHERE id = NEW.service_id;
+                END
+            ''')
+
             # Settings Table (Key-Value)
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS settings (
@@ -92,11 +242,160 @@ class Database:
                 )
             ''')
 
+            # Outbox: notifications written in the same transaction as the change they report,
+            # delivered later by outbox.OutboxWorker (rows are deleted once sent)
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    bot TEXT,
+                    chat_id INTEGER,
+                    text TEXT,
+                    parse_mode TEXT,
+                    status TEXT DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at REAL,
+                    last_error TEXT,
+                    created_at TIMESTAMP
+                )
+            ''')
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)")
+
+            # Job Locks (one runner per maintenance job across processes/instances)
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS job_locks (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT,
+                    expires_at REAL,
+                    last_run_at REAL
+                )
+            ''')
+
+            # Referral tree as a closure table: one row per (ancestor, descendant) up to
+            # REFERRAL_TREE_DEPTH levels apart, so uplines and network sizes need no recursion
+            async with db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'referral_paths'") as cursor:
+                new_paths = await cursor.fetchone() is None
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS referral_paths (
+                    ancestor_id INTEGER,
+                    descendant_id INTEGER,
+                    depth INTEGER,
+                    PRIMARY KEY (ancestor_id, descendant_id)
+                ) WITHOUT ROWID
+            ''')
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_referral_descendant ON referral_paths (descendant_id, depth)")
+            if new_paths:
+                # Built once from users.referrer_id; signups extend it (add_user)
+                await db.execute('''
+                    WITH RECURSIVE paths (ancestor_id, descendant_id, depth) AS (
+                        SELECT u.referrer_id, u.user_id, 1 FROM users u JOIN users r ON r.user_id = u.referrer_id
+                        WHERE u.referrer_id != u.user_id
+                        UNION ALL
+                        SELECT u.referrer_id, p.descendant_id, p.depth + 1
+                        FROM paths p JOIN users u ON u.user_id = p.ancestor_id JOIN users r ON r.user_id = u.referrer_id
+                        WHERE p.depth < ? AND u.referrer_id != p.descendant_id
+                    )
+                    INSERT OR IGNORE INTO referral_paths (ancestor_id, descendant_id, depth)
+                    SELECT ancestor_id, descendant_id, MIN(depth) FROM paths GROUP BY ancestor_id, descendant_id
+                ''', (REFERRAL_TREE_DEPTH,))
+
+            # Top-ups (see topup.py): invoices handed to users, and every payment callback by
+            # its idempotency key so a retried callback is recognised
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS invoices (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    amount INTEGER,
+                    lang TEXT,
+                    status TEXT DEFAULT 'pending',
+                    created_at REAL,
+                    expires_at REAL,
+                    paid_at REAL,
+                    paid_amount INTEGER,
+                    payment_id TEXT
+                )
+            ''')
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_invoices_user ON invoices (user_id, status)")
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS payments (
+                    id TEXT PRIMARY KEY,
+                    invoice_id TEXT,
+                    amount INTEGER,
+                    status TEXT,
+                    result TEXT,
+                    received_at REAL
+                )
+            ''')
+
+            # Balance ledger: every change to users.balance, written in the same transaction
+            # (see _apply_balance). Rows are never updated or deleted.
+            async with db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ledger'") as cursor:
+                new_ledger = await cursor.fetchone() is None
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS ledger (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    delta INTEGER,
+                    type TEXT,
+                    ref TEXT,
+                    created_at TIMESTAMP
+                )
+            ''')
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger (user_id, id)")
+            await db.execute("CREATE TRIGGER IF NOT EXISTS ledger_no_update BEFORE UPDATE ON ledger BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END")
+            await db.execute("CREATE TRIGGER IF NOT EXISTS ledger_no_delete BEFORE DELETE ON ledger BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END")
+            # Per-user balance as of ledger entry `ledger_id` (settings 'ledger_snapshot_id');
+            # reconciliation replays only the entries after it
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS balance_snapshots (
+                    user_id INTEGER PRIMARY KEY,
+                    balance INTEGER,
+                    ledger_id INTEGER,
+                    taken_at TIMESTAMP
+                )
+            ''')
+            if new_ledger:
+                # Existing balances have no history: take them as the opening snapshot
+                await db.execute('''
+                    INSERT OR REPLACE INTO balance_snapshots (user_id, balance, ledger_id, taken_at)
+                    SELECT user_id, balance, 0, ? FROM users WHERE balance != 0
+                ''', (datetime.datetime.now(),))
+                await db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('ledger_snapshot_id', '0')")
+
+            # Indexes for leaderboards
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_balance ON users (balance)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_referrals ON users (total_referrals)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_purchased ON orders (purchased_at)")
+
             # Initialize default Refer Bonus if not exists
             await db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('ref_bonus', '10')")
 
             await db.commit()
 
+        # Archive file for old orders (content is zlib-compressed, service name kept
+        # in case the service is deleted later)
+        async with aiosqlite.connect(self.archive_path) as arc:
+            await arc.execute("PRAGMA journal_mode=WAL")
+            await arc.execute('''
+                CREATE TABLE IF NOT EXISTS orders_archive (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER,
+                    service_id INTEGER,
+                    service_name TEXT,
+                    content_z BLOB,
+                    price INTEGER,
+                    status TEXT,
+                    user_input TEXT,
+                    purchased_at TIMESTAMP,
+                    archived_at TIMESTAMP
+                )
+            ''')
+            await arc.execute("CREATE INDEX IF NOT EXISTS idx_archive_user ON orders_archive (user_id, purchased_at)")
+            await arc.commit()
+
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            await db.commit()
+
     # --- Settings Methods ---
     async def get_setting(self, key):
         async with aiosqlite.connect(self.db_path) as db:
@@ -147,8 +446,9 @@ class Database:
             
             await db.execute("UPDATE redeem_codes SET used_count = used_count + 1 WHERE code = ?", (code,))
             await db.execute("INSERT INTO redeem_history (user_id, code, used_at) VALUES (?, ?, ?)", (user_id, code, used_at))
-            await db.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, user_id))
+            balance = await self._apply_balance(db, user_id, amount, 'redeem', code)
             await db.commit()
+            if balance is not None: self._emit('balance', user_id, balance - amount, balance)
             return amount
 
     async def get_all_codes(self):
@@ -170,7 +470,12 @@ class Database:
             async with db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)) as cursor:
                 return await cursor.fetchone()
 
-    async def add_user(self, user_id, first_name, username, referrer_id=None):
+    async def add_user(self, user_id, first_name, username, referrer_id=None, notify=None, rewards=(), reward_notices=None):
+        # With a known referrer the signup also joins the referral tree and pays the upline in
+        # the same transaction: rewards[0] TK to the referrer, rewards[1] to its referrer, ...
+        # reward_notices(rewarded) -> outbox rows for [(user_id, level, amount, lang)].
+        # False when the user already exists.
+        rewarded, changes, referrals = [], [], None
         async with aiosqlite.connect(self.db_path) as db:
             users_check = await db.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
             if await users_check.fetchone():
@@ -180,18 +485,65 @@ class Database:
                 INSERT INTO users (user_id, first_name, username, referrer_id, joined_at)
                 VALUES (?, ?, ?, ?, ?)
             ''', (user_id, first_name, username, referrer_id, joined_at))
-            
+            if referrer_id is not None and referrer_id != user_id:
+                await db.execute('''
+                    INSERT OR IGNORE INTO referral_paths (ancestor_id, descendant_id, depth)
+                    SELECT ancestor_id, ?, depth + 1 FROM referral_paths WHERE descendant_id = ? AND depth < ?
+                    UNION ALL
+                    SELECT user_id, ?, 1 FROM users WHERE user_id = ?
+                ''', (user_id, referrer_id, REFERRAL_TREE_DEPTH, user_id, referrer_id))
+                query = '''
+                    SELECT p.ancestor_id, p.depth, u.language FROM referral_paths p JOIN users u ON u.user_id = p.ancestor_id
+                    WHERE p.descendant_id = ? AND p.depth <= ? ORDER BY p.depth
+                '''
+                async with db.execute(query, (user_id, max(1, len(rewards)))) as cursor:
+                    upline = await cursor.fetchall()
+                for ancestor, depth, lang in upline:
+                    amount = max(0, rewards[depth - 1]) if depth <= len(rewards) else 0
+                    async with db.execute('''
+                        UPDATE users SET total_referrals = total_referrals + ?, total_earned = total_earned + ?
+                        WHERE user_id = ? RETURNING total_referrals
+                    ''', (int(depth == 1), amount, ancestor)) as cursor:
+                        row = await cursor.fetchone()
+                    if depth == 1: referrals = (ancestor, row[0])
+                    if not amount: continue
+                    balance = await self._apply_balance(db, ancestor, amount, 'referral', user_id if depth == 1 else f"{user_id} L{depth}")
+                    rewarded.append((ancestor, depth, amount, lang))
+                    changes.append((ancestor, balance - amount, balance))
+            if rewarded and reward_notices: notify = list(notify or []) + reward_notices(rewarded)
+            await self._enqueue(db, notify)
             await db.commit()
-            return True
+        self._emit('user', user_id)
+        for uid, old, new in changes:
+            self._emit('balance', uid, old, new)
+        if referrals: self._emit('referrals', referrals[0], referrals[1] - 1, referrals[1])
+        if notify: self._emit('outbox', None)
+        return True
 
-    async def update_balance(self, user_id, amount, add=True):
+    async def update_balance(self, user_id, amount, add=True, type='admin', ref=None, check_funds=False):
+        delta = amount if add else -amount
         async with aiosqlite.connect(self.db_path) as db:
-            if add:
-                await db.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, user_id))
-            else:
-                await db.execute("UPDATE users SET balance = balance - ? WHERE user_id = ?", (amount, user_id))
+            balance = await self._apply_balance(db, user_id, delta, type, ref, check_funds)
             await db.commit()
+        if balance is not None: self._emit('balance', user_id, balance - delta, balance)
+        return balance
     
+    async def _apply_balance(self, db, user_id, delta, type, ref=None, check_funds=False):
+        # How users.balance changes (apart from the set-based apply_adjustments): updates it
+        # and appends the ledger entry inside the caller's transaction. Returns the new balance, or None when the user
+        # doesn't exist (or, with check_funds, the balance would go negative).
+        query = "UPDATE users SET balance = balance + ? WHERE user_id = ?"
+        args = [delta, user_id]
+        if check_funds:
+            query += " AND balance + ? >= 0"
+            args.append(delta)
+        async with db.execute(query + " RETURNING balance", args) as cursor:
+            row = await cursor.fetchone()
+        if not row: return None
+        await db.execute("INSERT INTO ledger (user_id, delta, type, ref, created_at) VALUES (?, ?, ?, ?, ?)",
+                         (user_id, delta, type, None if ref is None else str(ref), datetime.datetime.now()))
+        return row[0]
+
     async def set_language(self, user_id, lang):
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute("UPDATE users SET language = ? WHERE user_id = ?", (lang, user_id))
@@ -204,21 +556,48 @@ class Database:
             await db.commit()
 
     # --- Referral Methods ---
-    async def add_referral_reward(self, referrer_id, amount):
+    async def get_referral_network(self, user_id):
+        # {level: users} below user_id, from the closure table (level 1 = invited directly)
         async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                UPDATE users 
-                SET balance = balance + ?, 
-                    total_referrals = total_referrals + 1, 
-                    total_earned = total_earned + ? 
-                WHERE user_id = ?
-            ''', (amount, amount, referrer_id))
-            await db.commit()
-            
+            query = "SELECT depth, COUNT(*) FROM referral_paths WHERE ancestor_id = ? GROUP BY depth ORDER BY depth"
+            async with db.execute(query, (user_id,)) as cursor:
+                return dict(await cursor.fetchall())
+
+    # --- Leaderboard Queries (served by idx_users_balance / idx_users_referrals / idx_orders_purchased) ---
     async def get_top_users(self, limit=10):
         async with aiosqlite.connect(self.db_path) as db:
             async with db.execute("SELECT user_id, first_name, balance FROM users ORDER BY balance DESC LIMIT ?", (limit,)) as cursor:
                 return await cursor.fetchall()
+
+    async def get_top_referrers(self, limit=10):
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute("SELECT user_id, first_name, total_referrals FROM users ORDER BY total_referrals DESC LIMIT ?", (limit,)) as cursor:
+                return await cursor.fetchall()
+
+    async def get_buyer_totals(self, since):
+        # Hot table only: orders are archived after ARCHIVE_AFTER_DAYS (>= 8), so a weekly window never reaches the archive
+        async with aiosqlite.connect(self.db_path) as db:
+            query = '''
+                SELECT user_id, SUM(price) FROM orders
+                WHERE purchased_at >= ? AND status != 'refunded'
+                GROUP BY user_id
+            '''
+            async with db.execute(query, (since,)) as cursor:
+                return await cursor.fetchall()
+
+    async def get_sorted_scores(self, column):
+        # Every user's score in ascending order (index scan), used to build rank indexes
+        assert column in ('balance', 'total_referrals')
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(f"SELECT {column} FROM users ORDER BY {column}") as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    async def get_user_names(self, user_ids):
+        if not user_ids: return {}
+        async with aiosqlite.connect(self.db_path) as db:
+            marks = ",".join("?" * len(user_ids))
+            async with db.execute(f"SELECT user_id, first_name FROM users WHERE user_id IN ({marks})", list(user_ids)) as cursor:
+                return {row[0]: row[1] for row in await cursor.fetchall()}
                 
     async def get_all_users_count(self):
         async with aiosqlite.connect(self.db_path) as db:
@@ -227,11 +606,12 @@ class Database:
                 return res[0] if res else 0
 
     # --- Service Methods ---
-    async def add_service(self, name, price, type, description="", question=None):
+    async def add_service(self, name, price, type, description="", question=None, category_id=None):
         async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("INSERT INTO services (name, price, type, description, question) VALUES (?, ?, ?, ?, ?)", 
-                             (name, price, type, description, question))
+            await db.execute("INSERT INTO services (name, price, type, description, question, category_id) VALUES (?, ?, ?, ?, ?, ?)", 
+                             (name, price, type, description, question, category_id))
             await db.commit()
+        self._emit('catalog', None)
 
     async def get_services(self):
         async with aiosqlite.connect(self.db_path) as db:
@@ -251,11 +631,99 @@ class Database:
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute("DELETE FROM services WHERE id = ?", (service_id,))
             await db.commit()
+        self._emit('catalog', None)
 
     async def update_service_price(self, service_id, new_price):
         async with aiosqlite.connect(self.db_path) as db:
              await db.execute("UPDATE services SET price = ? WHERE id = ?", (new_price, service_id))
              await db.commit()
+        self._emit('catalog', None)
+
+    async def set_service_category(self, service_id, category_id):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("UPDATE services SET category_id = ? WHERE id = ?", (category_id, service_id))
+            await db.commit()
+        self._emit('catalog', None)
+
+    # Sort keys for catalog pages (id breaks ties so paging is stable)
+    SERVICE_SORTS = {
+        'pop': "sold_count DESC, id",
+        'asc': "price ASC, id",
+        'desc': "price DESC, id",
+    }
+
+    async def get_services_page(self, category_id, sort='pop', limit=10, offset=0):
+        # One page of a category (0 = uncategorized, None = all) plus the total count
+        where, args = "1", []
+        if category_id == 0: where = "category_id IS NULL OR category_id NOT IN (SELECT id FROM categories)"
+        elif category_id is not None: where, args = "category_id = ?", [category_id]
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(f"SELECT COUNT(*) FROM services WHERE {where}", args) as cursor:
+                total = (await cursor.fetchone())[0]
+            query = f"SELECT * FROM services WHERE {where} ORDER BY {self.SERVICE_SORTS[sort]} LIMIT ? OFFSET ?"
+            async with db.execute(query, args + [limit, offset]) as cursor:
+                return [dict(row) for row in await cursor.fetchall()], total
+
+    async def search_services(self, terms, limit=20):
+        # Services matching every term (as a word prefix) in name or description, best
+        # first: bm25 with name weighted over description, then popularity. No terms =
+        # most popular services. Without FTS5, terms match as substrings (LIKE).
+        # Returns (rows, whether FTS5 matched them).
+        columns = "s.id, s.name, s.price, s.type, s.stock_count, s.description"
+        async with aiosqlite.connect(self.db_path) as db:
+            if self.has_fts is None: await self._check_fts(db)  # init_db not run by this process
+            if not terms:
+                query, args = f"SELECT {columns} FROM services s ORDER BY s.sold_count DESC, s.id LIMIT ?", [limit]
+                fts = False
+            elif self.has_fts:
+                match = " ".join('"' + t.replace('"', '""') + '"*' for t in terms)
+                query = f'''
+                    SELECT {columns} FROM services_fts f JOIN services s ON s.id = f.rowid
+                    WHERE services_fts MATCH ?
+                    ORDER BY bm25(services_fts, 10.0, 1.0), s.sold_count DESC LIMIT ?
+                '''
+                args, fts = [match, limit], True
+            else:
+                where = " AND ".join("(s.name LIKE ? OR s.description LIKE ?)" for _ in terms)
+                query = f"SELECT {columns} FROM services s WHERE {where} ORDER BY s.sold_count DESC LIMIT ?"
+                args = [p for t in terms for p in (f"%{t}%", f"%{t}%")] + [limit]
+                fts = False
+            async with db.execute(query, args) as cursor:
+                return await cursor.fetchall(), fts
+
+    # --- Category Methods ---
+    async def get_categories(self):
+        # [(id, name, service count)] in display order, then uncategorized services as id 0
+        async with aiosqlite.connect(self.db_path) as db:
+            query = '''
+                SELECT c.id, c.name, COUNT(s.id) FROM categories c
+                LEFT JOIN services s ON s.category_id = c.id
+                GROUP BY c.id ORDER BY c.position, c.name
+            '''
+            async with db.execute(query) as cursor:
+                rows = await cursor.fetchall()
+            async with db.execute("SELECT COUNT(*) FROM services WHERE category_id IS NULL OR category_id NOT IN (SELECT id FROM categories)") as cursor:
+                other = (await cursor.fetchone())[0]
+        return rows + ([(0, None, other)] if other else [])
+
+    async def add_category(self, name, position=0):
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                async with db.execute("INSERT INTO categories (name, position) VALUES (?, ?)", (name, position)) as cursor:
+                    cid = cursor.lastrowid
+                await db.commit()
+            except aiosqlite.IntegrityError: return None
+        self._emit('catalog', None)
+        return cid
+
+    async def delete_category(self, category_id):
+        # Its services become uncategorized
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("UPDATE services SET category_id = NULL WHERE category_id = ?", (category_id,))
+            await db.execute("DELETE FROM categories WHERE id = ?", (category_id,))
+            await db.commit()
+        self._emit('catalog', None)
 
     # --- Stock Methods ---
     async def add_stock(self, service_id, content):
@@ -264,43 +732,69 @@ class Database:
             await db.execute("INSERT INTO stock (service_id, content, added_at) VALUES (?, ?, ?)", 
                              (service_id, content, added_at))
             await db.commit()
+        self._emit('catalog', None)
 
     async def get_stock_count(self, service_id):
         async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT COUNT(*) FROM stock WHERE service_id = ?", (service_id,)) as cursor:
+            async with db.execute("SELECT stock_count FROM services WHERE id = ?", (service_id,)) as cursor:
                 res = await cursor.fetchone()
-                return res[0]
+                return res[0] if res else 0
 
-    async def fetch_stock_item(self, service_id):
+    async def set_low_stock(self, service_id, level):
         async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            # Get the oldest item
-            async with db.execute("SELECT * FROM stock WHERE service_id = ? ORDER BY id ASC LIMIT 1", (service_id,)) as cursor:
-                item = await cursor.fetchone()
-            
-            if item:
-                # Delete it
-                await db.execute("DELETE FROM stock WHERE id = ?", (item['id'],))
-                await db.commit()
-                return item['content']
-            return None
+            cursor = await db.execute("UPDATE services SET low_stock = ? WHERE id = ?", (level, service_id))
+            await db.commit()
+            return cursor.rowcount > 0
 
     # --- Order Methods ---
-    async def log_order(self, user_id, service_id, content, price, status='completed', user_input=None):
+    async def place_order(self, user_id, service, user_input=None, notify=None, low_stock_for=None):
+        # Charge, claim stock, log the order and queue notifications in one transaction.
+        # low_stock_for(name, left, level) -> outbox rows, queued when this purchase takes
+        # the stock below the service's low_stock level.
+        # Returns {'id', 'status', 'content'} or "insufficient" / "out_of_stock".
+        price = service['price']
         async with aiosqlite.connect(self.db_path) as db:
-            purchased_at = datetime.datetime.now()
-            await db.execute('''
+            # Take the write lock up front so the stock claim and the charge can't race
+            await db.execute("BEGIN IMMEDIATE")
+            if service['type'] == 'auto':
+                async with db.execute("SELECT id, content FROM stock WHERE service_id = ? ORDER BY id ASC LIMIT 1", (service['id'],)) as cursor:
+                    item = await cursor.fetchone()
+                if not item:
+                    await db.rollback()
+                    return "out_of_stock"
+                content, status = item[1], 'completed'
+            else:
+                content, status = "Manual Delivery Pending", 'pending'
+
+            async with db.execute('''
                 INSERT INTO orders (user_id, service_id, content, price, status, user_input, purchased_at)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, service_id, content, price, status, user_input, purchased_at))
+            ''', (user_id, service['id'], content, price, status, user_input, datetime.datetime.now())) as cursor:
+                order_id = cursor.lastrowid
+            new_balance = await self._apply_balance(db, user_id, -price, 'purchase', order_id, check_funds=True)
+            if new_balance is None:
+                await db.rollback()
+                return "insufficient"
+            if service['type'] == 'auto':
+                await db.execute("DELETE FROM stock WHERE id = ?", (item[0],))
+                async with db.execute("SELECT name, stock_count, low_stock FROM services WHERE id = ?", (service['id'],)) as cursor:
+                    name, left, level = await cursor.fetchone()
+                # Fires once per crossing; re-arms when restocked
+                if low_stock_for and level and left == level - 1:
+                    notify = list(notify or []) + low_stock_for(name, left, level)
+            await self._enqueue(db, notify)
             await db.commit()
+        self._emit('balance', user_id, new_balance + price, new_balance)
+        self._emit('spent', user_id, price)
+        if notify: self._emit('outbox', None)
+        return {'id': order_id, 'status': status, 'content': content}
             
     async def get_all_users_ids(self):
          async with aiosqlite.connect(self.db_path) as db:
             async with db.execute("SELECT user_id FROM users") as cursor:
                 return [row[0] for row in await cursor.fetchall()]
 
-    async def get_pending_orders(self):
+    async def get_pending_orders(self, limit=-1, offset=0):
         async with aiosqlite.connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             # Join with Services to get Name
@@ -309,11 +803,29 @@ class Database:
                 FROM orders o 
                 LEFT JOIN services s ON o.service_id = s.id
                 WHERE o.status = 'pending'
+                ORDER BY o.id LIMIT ? OFFSET ?
             '''
-            async with db.execute(query) as cursor:
+            async with db.execute(query, (limit, offset)) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
+    async def count_pending_orders(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute("SELECT COUNT(*) FROM orders WHERE status = 'pending'") as cursor:
+                return (await cursor.fetchone())[0]
+
+    async def get_pending_by_service(self):
+        # [(service_id, service_name, pending count)]
+        async with aiosqlite.connect(self.db_path) as db:
+            query = '''
+                SELECT o.service_id, s.name, COUNT(*) FROM orders o
+                LEFT JOIN services s ON o.service_id = s.id
+                WHERE o.status = 'pending'
+                GROUP BY o.service_id ORDER BY COUNT(*) DESC
+            '''
+            async with db.execute(query) as cursor:
+                return await cursor.fetchall()
+
     async def get_order(self, order_id):
         async with aiosqlite.connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
@@ -328,7 +840,535 @@ class Database:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
     
-    async def update_order_status(self, order_id, status):
+    async def update_order_status(self, order_id, status, notify=None):
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute("UPDATE orders SET status = ? WHERE id = ?", (status, order_id))
+            await self._enqueue(db, notify)
+            await db.commit()
+        if notify: self._emit('outbox', None)
+
+    def _pending_filter(self, order_ids, service_id, admin_id=None, claimed=False):
+        # admin_id: skip orders another admin holds an unexpired claim on;
+        # claimed: only orders this admin has claimed (its claim may have run out, as long as nobody took it over)
+        if order_ids is not None:
+            ids = [int(i) for i in order_ids]
+            where, args = f"id IN ({','.join('?' * len(ids))})", ids
+        else: where, args = "service_id = ?", [service_id]
+        if claimed: where, args = where + " AND claimed_by = ?", args + [admin_id]
+        elif admin_id is not None:
+            where, args = where + " AND (claimed_by IS NULL OR claimed_by = ? OR claimed_until < ?)", args + [admin_id, time.time()]
+        return where, args
+
+    # --- Fulfillment claims ---
+    async def claim_order(self, admin_id, lease, order_id=None):
+        # Claim order_id, or the next pending order (the admin's own live claim first, then the
+        # oldest unclaimed or expired one). One conditional UPDATE, so two admins never get
+        # the same order. Returns the order id or None.
+        now = time.time()
+        free = "(claimed_by IS NULL OR claimed_by = :admin OR claimed_until < :now)"
+        if order_id is None:
+            target = f'''(SELECT id FROM orders WHERE status = 'pending' AND {free}
+                          ORDER BY claimed_by IS NOT :admin, id LIMIT 1)'''
+        else: target = ":oid"
+        async with aiosqlite.connect(self.db_path) as db:
+            query = f'''
+                UPDATE orders SET claimed_at = CASE WHEN claimed_by IS :admin THEN claimed_at ELSE :now END,
+                                  claimed_by = :admin, claimed_until = :until
+                WHERE id = {target} AND status = 'pending' AND {free}
+                RETURNING id
+            '''
+            async with db.execute(query, {'admin': admin_id, 'now': now, 'until': now + lease, 'oid': order_id}) as cursor:
+                row = await cursor.fetchone()
+            await db.commit()
+        return row[0] if row else None
+
+    async def release_order(self, order_id, admin_id):
+        async with aiosqlite.connect(self.db_path) as db:
+            query = '''
+                UPDATE orders SET claimed_by = NULL, claimed_at = NULL, claimed_until = NULL
+                WHERE id = ? AND claimed_by = ? AND status = 'pending'
+            '''
+            cursor = await db.execute(query, (order_id, admin_id))
+            await db.commit()
+            return cursor.rowcount > 0
+
+    async def get_admin_stats(self, since):
+        # [(admin_id, completed, refunded, average seconds from claim to done)] for orders handled since `since` (unix time)
+        async with aiosqlite.connect(self.db_path) as db:
+            query = '''
+                SELECT handled_by, SUM(status = 'completed'), SUM(status = 'refunded'), AVG(handled_at - claimed_at)
+                FROM orders WHERE handled_at >= ? AND handled_by IS NOT NULL
+                GROUP BY handled_by ORDER BY COUNT(*) DESC
+            '''
+            async with db.execute(query, (since,)) as cursor:
+                return await cursor.fetchall()
+
+    async def complete_orders(self, order_ids=None, service_id=None, notify_for=None, admin_id=None, claimed=False):
+        # Complete the given orders (or every pending order of a service) in one transaction.
+        # Only orders still pending change, so an order handled meanwhile is skipped; with
+        # admin_id, so are orders claimed by another admin (claimed=True: only this admin's claims).
+        # notify_for(rows) -> outbox rows; returns rows of (id, user_id, price, service_name).
+        where, args = self._pending_filter(order_ids, service_id, admin_id, claimed)
+        if order_ids is not None and not order_ids: return []
+        async with aiosqlite.connect(self.db_path) as db:
+            query = f'''
+                UPDATE orders SET status = 'completed', handled_by = ?, handled_at = ?
+                WHERE status = 'pending' AND {where}
+                RETURNING id, user_id, price, (SELECT name FROM services WHERE services.id = orders.service_id)
+            '''
+            async with db.execute(query, [admin_id, time.time()] + args) as cursor:
+                rows = await cursor.fetchall()
+            notify = notify_for(rows) if rows and notify_for else None
+            await self._enqueue(db, notify)
+            await db.commit()
+        if notify: self._emit('outbox', None)
+        return rows
+
+    async def refund_orders(self, order_ids=None, service_id=None, notify_for=None, admin_id=None, claimed=False):
+        # Same as complete_orders, crediting each price back (ledger type 'refund')
+        where, args = self._pending_filter(order_ids, service_id, admin_id, claimed)
+        if order_ids is not None and not order_ids: return []
+        async with aiosqlite.connect(self.db_path) as db:
+            query = f'''
+                UPDATE orders SET status = 'refunded', handled_by = ?, handled_at = ?
+                WHERE status = 'pending' AND {where}
+                RETURNING id, user_id, price, (SELECT name FROM services WHERE services.id = orders.service_id), purchased_at
+            '''
+            async with db.execute(query, [admin_id, time.time()] + args) as cursor:
+                refunded = await cursor.fetchall()
+            rows = [r[:4] for r in refunded]
+            changes = []
+            for oid, user_id, price, _, purchased_at in refunded:
+                balance = await self._apply_balance(db, user_id, price, 'refund', oid)
+                if balance is not None: changes.append((user_id, balance - price, balance, price, purchased_at))
+            notify = notify_for(rows) if rows and notify_for else None
+            await self._enqueue(db, notify)
+            await db.commit()
+        for user_id, old, new, price, purchased_at in changes:
+            self._emit('balance', user_id, old, new)
+            self._emit('refund', user_id, price, purchased_at)
+        if notify: self._emit('outbox', None)
+        return rows
+
+    async def escalate_stale_orders(self, cutoff, notify_for=None):
+        # Flag pending orders older than cutoff once; notify_for(rows) -> outbox rows
+        async with aiosqlite.connect(self.db_path) as db:
+            query = '''
+                UPDATE orders SET escalated_at = ?
+                WHERE status = 'pending' AND escalated_at IS NULL AND purchased_at < ?
+                RETURNING id, user_id, price, purchased_at
+            '''
+            async with db.execute(query, (datetime.datetime.now(), cutoff)) as cursor:
+                rows = await cursor.fetchall()
+            notify = notify_for(rows) if rows and notify_for else None
+            await self._enqueue(db, notify)
+            await db.commit()
+        if notify: self._emit('outbox', None)
+        return rows
+
+    async def refund_stale_orders(self, cutoff, notify_for=None):
+        # Refund every order still pending since before cutoff, in one transaction
+        async with aiosqlite.connect(self.db_path) as db:
+            # Orders an admin is working on right now are left to them
+            query = '''UPDATE orders SET status = 'refunded', handled_at = ?
+                       WHERE status = 'pending' AND purchased_at < ? AND (claimed_until IS NULL OR claimed_until < ?)
+                       RETURNING id, user_id, price, purchased_at'''
+            now = time.time()
+            async with db.execute(query, (now, cutoff, now)) as cursor:
+                refunded = await cursor.fetchall()
+            rows = [r[:3] for r in refunded]
+            changes = []
+            for oid, user_id, price, purchased_at in refunded:
+                balance = await self._apply_balance(db, user_id, price, 'auto_refund', oid)
+                if balance is not None: changes.append((user_id, balance - price, balance, price, purchased_at))
+            notify = notify_for(rows) if rows and notify_for else None
+            await self._enqueue(db, notify)
+            await db.commit()
+        for user_id, old, new, price, purchased_at in changes:
+            self._emit('balance', user_id, old, new)
+            self._emit('refund', user_id, price, purchased_at)
+        if notify: self._emit('outbox', None)
+        return rows
+
+    async def apply_adjustments(self, rows, ref=None, notify_for=None):
+        # One chunk of bulk balance adjustments [(user_id, delta, reason)] in one transaction.
+        # Rows are loaded with executemany into a temp table and applied set-based; a user's
+        # rows are skipped together if the user is unknown or the total would make the
+        # balance negative. Returns {'applied': [(user_id, delta, reason)], 'unknown': [ids],
+        # 'insufficient': [ids]}.
+        async with aiosqlite.connect(self.db_path) as db:
+            # Write lock up front: the funds check and the update must see the same balances
+            await db.execute("BEGIN IMMEDIATE")
+            await db.execute("CREATE TEMP TABLE bulk (user_id INTEGER, delta INTEGER, reason TEXT)")
+            await db.executemany("INSERT INTO bulk (user_id, delta, reason) VALUES (?, ?, ?)", rows)
+            async with db.execute("SELECT DISTINCT user_id FROM bulk WHERE user_id NOT IN (SELECT user_id FROM users)") as cursor:
+                unknown = [r[0] for r in await cursor.fetchall()]
+            query = '''
+                SELECT b.user_id FROM bulk b JOIN users u ON u.user_id = b.user_id
+                GROUP BY b.user_id HAVING MAX(u.balance) + SUM(b.delta) < 0
+            '''
+            async with db.execute(query) as cursor:
+                insufficient = [r[0] for r in await cursor.fetchall()]
+            await db.execute("DELETE FROM bulk WHERE user_id NOT IN (SELECT user_id FROM users)")
+            await db.executemany("DELETE FROM bulk WHERE user_id = ?", [(uid,) for uid in insufficient])
+
+            query = '''
+                UPDATE users SET balance = balance + t.delta
+                FROM (SELECT user_id, SUM(delta) AS delta FROM bulk GROUP BY user_id) AS t
+                WHERE users.user_id = t.user_id
+                RETURNING users.user_id, users.balance
+            '''
+            async with db.execute(query) as cursor:
+                balances = dict(await cursor.fetchall())
+            async with db.execute("SELECT user_id, delta, reason FROM bulk ORDER BY rowid") as cursor:
+                applied = await cursor.fetchall()
+            now = datetime.datetime.now()
+            label = lambda reason: ": ".join(str(p) for p in (ref, reason) if p) or None
+            await db.executemany("INSERT INTO ledger (user_id, delta, type, ref, created_at) VALUES (?, ?, 'bulk', ?, ?)",
+                                 [(uid, delta, label(reason), now) for uid, delta, reason in applied])
+            notify = notify_for(applied) if applied and notify_for else None
+            await self._enqueue(db, notify)
+            await db.commit()
+        totals = {}
+        for uid, delta, _ in applied: totals[uid] = totals.get(uid, 0) + delta
+        for uid, new in balances.items():
+            self._emit('balance', uid, new - totals[uid], new)
+        if notify: self._emit('outbox', None)
+        return {'applied': applied, 'unknown': unknown, 'insufficient': insufficient}
+
+    # --- Top-up Methods ---
+    async def create_invoice(self, user_id, amount, lang, ttl):
+        # Invoice id for a top-up of `amount`; an open invoice of the same user and amount is reused
+        now = time.time()
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            query = "SELECT id FROM invoices WHERE user_id = ? AND amount = ? AND status = 'pending' AND expires_at > ? ORDER BY expires_at DESC LIMIT 1"
+            async with db.execute(query, (user_id, amount, now + ttl / 2)) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                await db.rollback()
+                return row[0]
+            invoice_id = secrets.token_hex(8)
+            await db.execute("INSERT INTO invoices (id, user_id, amount, lang, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                             (invoice_id, user_id, amount, lang, now, now + ttl))
+            await db.commit()
+        return invoice_id
+
+    async def get_invoice(self, invoice_id):
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("SELECT * FROM invoices WHERE id = ?", (invoice_id,)) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+
+    async def apply_payments(self, payments, notify_for=None):
+        # A batch of payment callbacks [(payment_id, invoice_id, amount, status)] in one
+        # transaction. A payment id is taken once (later ones are 'duplicate'), an invoice is
+        # credited once ('already_paid'); a paid invoice credits the amount actually paid,
+        # also after it expired. Returns one result per payment: 'credited', 'duplicate',
+        # 'already_paid', 'unknown_invoice', 'unknown_user' or 'ignored' (not a successful payment).
+        now = time.time()
+        results, outcomes, credited, changes = [], [], [], []
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            for payment_id, invoice_id, amount, status in payments:
+                async with db.execute("INSERT OR IGNORE INTO payments (id, invoice_id, amount, status, received_at) VALUES (?, ?, ?, ?, ?)",
+                                      (payment_id, invoice_id, amount, status, now)) as cursor:
+                    if not cursor.rowcount:
+                        results.append('duplicate')
+                        continue
+                result = 'ignored'
+                if status == 'paid' and amount > 0:
+                    query = '''
+                        UPDATE invoices SET status = 'paid', paid_at = ?, paid_amount = ?, payment_id = ?
+                        WHERE id = ? AND status != 'paid'
+                        RETURNING user_id, lang
+                    '''
+                    async with db.execute(query, (now, amount, payment_id, invoice_id)) as cursor:
+                        row = await cursor.fetchone()
+                    if row:
+                        user_id, lang = row
+                        balance = await self._apply_balance(db, user_id, amount, 'topup', invoice_id)
+                        if balance is None:
+                            result = 'unknown_user'
+                        else:
+                            result = 'credited'
+                            credited.append((user_id, amount, invoice_id, balance, lang))
+                            changes.append((user_id, balance - amount, balance))
+                    else:
+                        async with db.execute("SELECT 1 FROM invoices WHERE id = ?", (invoice_id,)) as cursor:
+                            result = 'already_paid' if await cursor.fetchone() else 'unknown_invoice'
+                results.append(result)
+                outcomes.append((result, payment_id))
+            await db.executemany("UPDATE payments SET result = ? WHERE id = ?", outcomes)
+            notify = notify_for(credited) if credited and notify_for else None
+            await self._enqueue(db, notify)
+            await db.commit()
+        for user_id, old, new in changes:
+            self._emit('balance', user_id, old, new)
+        if notify: self._emit('outbox', None)
+        return results
+
+    # --- Ledger Methods ---
+    async def get_ledger(self, user_id, limit=20):
+        async with aiosqlite.connect(self.db_path) as db:
+            query = "SELECT id, delta, type, ref, created_at FROM ledger WHERE user_id = ? ORDER BY id DESC LIMIT ?"
+            async with db.execute(query, (user_id, limit)) as cursor:
+                return await cursor.fetchall()
+
+    async def snapshot_balances(self):
+        # Fold ledger entries since the last snapshot into balance_snapshots; only users
+        # with new entries are touched. Returns (users updated, new watermark).
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            async with db.execute("SELECT CAST(value AS INTEGER) FROM settings WHERE key = 'ledger_snapshot_id'") as cursor:
+                row = await cursor.fetchone()
+            since = row[0] if row else 0
+            async with db.execute("SELECT COALESCE(MAX(id), 0) FROM ledger") as cursor:
+                upto = (await cursor.fetchone())[0]
+            if upto <= since:
+                await db.rollback()
+                return 0, since
+            cursor = await db.execute('''
+                INSERT INTO balance_snapshots (user_id, balance, ledger_id, taken_at)
+                SELECT l.user_id, COALESCE(s.balance, 0) + SUM(l.delta), ?, ?
+                FROM ledger l LEFT JOIN balance_snapshots s ON s.user_id = l.user_id
+                WHERE l.id > ? AND l.id <= ?
+                GROUP BY l.user_id
+                ON CONFLICT(user_id) DO UPDATE SET balance = excluded.balance, ledger_id = excluded.ledger_id, taken_at = excluded.taken_at
+            ''', (upto, datetime.datetime.now(), since, upto))
+            updated = cursor.rowcount
+            await db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('ledger_snapshot_id', ?)", (str(upto),))
+            await db.commit()
+            return updated, upto
+
+    async def reconcile_balances(self, limit=20):
+        # users.balance must equal its snapshot plus the ledger entries after the watermark.
+        # Returns (users checked, mismatch count, [(user_id, balance, expected), ...]).
+        checked_sql = '''
+            WITH recent AS (
+                SELECT user_id, SUM(delta) AS delta FROM ledger
+                WHERE id > COALESCE((SELECT CAST(value AS INTEGER) FROM settings WHERE key = 'ledger_snapshot_id'), 0)
+                GROUP BY user_id
+            )
+            SELECT u.user_id, u.balance, COALESCE(s.balance, 0) + COALESCE(r.delta, 0) AS expected
+            FROM users u
+            LEFT JOIN balance_snapshots s ON s.user_id = u.user_id
+            LEFT JOIN recent r ON r.user_id = u.user_id
+        '''
+        async with aiosqlite.connect(self.db_path) as db:
+            # One read transaction, so both queries see the same state while the bot keeps writing
+            await db.execute("BEGIN")
+            async with db.execute(f"SELECT COUNT(*), COALESCE(SUM(balance != expected), 0) FROM ({checked_sql})") as cursor:
+                checked, bad = await cursor.fetchone()
+            mismatches = []
+            if bad:
+                async with db.execute(f"SELECT * FROM ({checked_sql}) WHERE balance != expected LIMIT ?", (limit,)) as cursor:
+                    mismatches = await cursor.fetchall()
+            await db.rollback()
+            return checked, bad, mismatches
+
+    # --- Exports (async generators yielding lists of rows, see exports.py) ---
+    async def _iter_chunks(self, db, query, args=(), chunk=1000):
+        async with db.execute(query, args) as cursor:
+            while True:
+                rows = await cursor.fetchmany(chunk)
+                if not rows: break
+                yield rows
+
+    async def iter_users(self, chunk=1000):
+        async with aiosqlite.connect(self.db_path) as db:
+            query = "SELECT user_id, first_name, username, balance, referrer_id, total_referrals, total_earned, language, joined_at FROM users ORDER BY user_id"
+            async for rows in self._iter_chunks(db, query, (), chunk):
+                yield rows
+
+    async def iter_orders(self, since=None, until=None, chunk=1000):
+        # Hot and archived orders purchased in [since, until), oldest first; content is left out
+        async with self._with_archive() as db:
+            query = '''
+                SELECT * FROM (
+                    SELECT o.id, o.user_id, o.service_id, s.name, o.price, o.status, o.user_input, o.purchased_at
+                    FROM orders o LEFT JOIN services s ON o.service_id = s.id
+                    UNION ALL
+                    SELECT id, user_id, service_id, service_name, price, status, user_input, purchased_at
+                    FROM arc.orders_archive WHERE id NOT IN (SELECT id FROM orders)
+                )
+                WHERE (? IS NULL OR purchased_at >= ?) AND (? IS NULL OR purchased_at < ?)
+                ORDER BY id
+            '''
+            async for rows in self._iter_chunks(db, query, (since, since, until, until), chunk):
+                yield rows
+
+    async def iter_stock(self, chunk=1000):
+        async with aiosqlite.connect(self.db_path) as db:
+            query = '''
+                SELECT st.id, st.service_id, s.name, st.content, st.added_at
+                FROM stock st LEFT JOIN services s ON st.service_id = s.id
+                ORDER BY st.service_id, st.id
+            '''
+            async for rows in self._iter_chunks(db, query, (), chunk):
+                yield rows
+
+    # --- Order Archive (cold partition in a separate file, see maintenance.archive_orders) ---
+    @contextlib.asynccontextmanager
+    async def _with_archive(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("ATTACH DATABASE ? AS arc", (self.archive_path,))
+            yield db
+
+    async def archive_orders(self, cutoff, batch_size=500):
+        # Moves one batch of finished orders older than cutoff; returns how many moved.
+        # Rows are copied with INSERT OR IGNORE before being deleted, so a crash between
+        # the two files' commits only leaves a duplicate that the next run cleans up.
+        async with self._with_archive() as db:
+            query = '''
+                SELECT o.id, o.user_id, o.service_id, s.name, o.content, o.price, o.status, o.user_input, o.purchased_at
+                FROM orders o LEFT JOIN services s ON o.service_id = s.id
+                WHERE o.status IN ('completed', 'refunded') AND o.purchased_at < ?
+                ORDER BY o.id LIMIT ?
+            '''
+            async with db.execute(query, (cutoff, batch_size)) as cursor:
+                rows = await cursor.fetchall()
+            if not rows: return 0
+            now = datetime.datetime.now()
+            await db.executemany('''
+                INSERT OR IGNORE INTO arc.orders_archive
+                (id, user_id, service_id, service_name, content_z, price, status, user_input, purchased_at, archived_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(r[0], r[1], r[2], r[3], zlib.compress((r[4] or "").encode()), r[5], r[6], r[7], r[8], now) for r in rows])
+            marks = ",".join("?" * len(rows))
+            await db.execute(f"DELETE FROM orders WHERE id IN ({marks})", [r[0] for r in rows])
+            await db.commit()
+            return len(rows)
+
+    async def get_user_orders(self, user_id, limit=10):
+        # Latest orders of a user across the hot table and the archive
+        async with self._with_archive() as db:
+            db.row_factory = aiosqlite.Row
+            query = '''
+                SELECT o.id, s.name AS service_name, o.price, o.status, o.purchased_at
+                FROM orders o LEFT JOIN services s ON o.service_id = s.id
+                WHERE o.user_id = ?
+                UNION ALL
+                SELECT id, service_name, price, status, purchased_at
+                FROM arc.orders_archive
+                WHERE user_id = ? AND id NOT IN (SELECT id FROM orders WHERE user_id = ?)
+                ORDER BY id DESC LIMIT ?
+            '''
+            async with db.execute(query, (user_id, user_id, user_id, limit)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def get_order_totals(self):
+        # (orders, revenue) of completed orders, hot + archive
+        async with self._with_archive() as db:
+            query = '''
+                SELECT COUNT(*), COALESCE(SUM(price), 0) FROM (
+                    SELECT id, price FROM orders WHERE status = 'completed'
+                    UNION
+                    SELECT id, price FROM arc.orders_archive WHERE status = 'completed'
+                )
+            '''
+            async with db.execute(query) as cursor:
+                return await cursor.fetchone()
+
+    # --- Outbox Methods ---
+    async def _enqueue(self, db, notify):
+        # notify: iterable of (bot, chat_id, text) or (bot, chat_id, text, parse_mode); bot is 'user' or 'admin'
+        if not notify: return
+        now = datetime.datetime.now()
+        rows = [(n[0], n[1], n[2], n[3] if len(n) > 3 else None, time.time(), now) for n in notify]
+        await db.executemany("INSERT INTO outbox (bot, chat_id, text, parse_mode, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    async def enqueue_notifications(self, notify):
+        async with aiosqlite.connect(self.db_path) as db:
+            await self._enqueue(db, notify)
+            await db.commit()
+        if notify: self._emit('outbox', None)
+
+    async def fetch_due_outbox(self, limit):
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            query = "SELECT * FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?"
+            async with db.execute(query, (time.time(), limit)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def next_outbox_due(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'") as cursor:
+                res = await cursor.fetchone()
+                return res[0] if res else None
+
+    async def outbox_depth(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'") as cursor:
+                return (await cursor.fetchone())[0]
+
+    async def ack_outbox(self, sent_ids, retries=(), failures=()):
+        # Batch acknowledgement: delete sent rows, reschedule retries [(id, next_at, error)],
+        # park permanent failures [(id, error)] -- all in one transaction
+        async with aiosqlite.connect(self.db_path) as db:
+            if sent_ids:
+                marks = ",".join("?" * len(sent_ids))
+                await db.execute(f"DELETE FROM outbox WHERE id IN ({marks})", list(sent_ids))
+            if retries:
+                await db.executemany("UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                                     [(at, err, oid) for oid, at, err in retries])
+            if failures:
+                await db.executemany("UPDATE outbox SET attempts = attempts + 1, status = 'failed', last_error = ? WHERE id = ?",
+                                     [(err, oid) for oid, err in failures])
+            await db.commit()
+
+    # --- Maintenance Methods ---
+    async def acquire_job_lock(self, name, owner, lease, min_gap=0):
+        # Take the lease unless another owner holds it or the job ran less than min_gap ago
+        now = time.time()
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("INSERT OR IGNORE INTO job_locks (name, owner, expires_at, last_run_at) VALUES (?, NULL, 0, 0)", (name,))
+            cursor = await db.execute('''
+                UPDATE job_locks SET owner = ?, expires_at = ?
+                WHERE name = ? AND expires_at < ? AND last_run_at <= ?
+            ''', (owner, now + lease, name, now, now - min_gap))
+            acquired = cursor.rowcount == 1
+            await db.commit()
+            return acquired
+
+    async def release_job_lock(self, name, owner):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("UPDATE job_locks SET expires_at = 0, last_run_at = ? WHERE name = ? AND owner = ?", (time.time(), name, owner))
+            await db.commit()
+
+    async def ping(self, timeout=1.0):
+        # Raises unless the write lock can be taken within timeout (missing file, locked, read-only)
+        async with aiosqlite.connect(self.db_path, timeout=timeout) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            await db.rollback()
+
+    async def checkpoint(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute("PRAGMA wal_checkpoint(TRUNCATE)") as cursor:
+                busy, log_pages, done = await cursor.fetchone()
+            await db.execute("PRAGMA optimize")
+            return {'busy': busy, 'wal_pages': log_pages, 'checkpointed': done}
+
+    async def incremental_vacuum(self, pages):
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute("PRAGMA auto_vacuum") as cursor:
+                mode = (await cursor.fetchone())[0]
+            async with db.execute("PRAGMA freelist_count") as cursor:
+                free = (await cursor.fetchone())[0]
+            if mode != 2 or not free:
+                return {'auto_vacuum': mode, 'free_pages': free, 'reclaimed': 0}
+            async with db.execute(f"PRAGMA incremental_vacuum({int(pages)})") as cursor:
+                await cursor.fetchall()
+            await db.commit()
+            return {'auto_vacuum': mode, 'free_pages': free, 'reclaimed': min(free, int(pages))}
+
+    async def purge_redeem_codes(self, cutoff):
+        # Exhausted codes older than cutoff, plus history rows of codes that no longer exist
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute("DELETE FROM redeem_codes WHERE used_count >= max_uses AND created_at < ?", (cutoff,))
+            codes = cursor.rowcount
+            cursor = await db.execute("DELETE FROM redeem_history WHERE code NOT IN (SELECT code FROM redeem_codes)")
+            history = cursor.rowcount
             await db.commit()
+            return {'codes': codes, 'history': history}
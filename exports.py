@@ -0,0 +1,57 @@
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import tempfile
+from config import EXPORT_CHUNK_ROWS, EXPORT_SPOOL_BYTES
+
+# CSV exports for the admin bot. Rows are streamed from a database cursor in chunks
+# and written (gzip-compressed) to a spooled temp file on a worker thread, so memory
+# stays flat however many rows there are and the event loop keeps serving users.
+
+EXPORTS = {
+    'users': ("user_id", "first_name", "username", "balance", "referrer_id", "total_referrals",
+              "total_earned", "language", "joined_at"),
+    'orders': ("id", "user_id", "service_id", "service_name", "price", "status", "user_input", "purchased_at"),
+    'stock': ("id", "service_id", "service_name", "content", "added_at"),
+}
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%d") if value else None
+
+
+def _rows(db, kind, since=None, until=None):
+    if kind == 'users': return db.iter_users(EXPORT_CHUNK_ROWS)
+    if kind == 'orders': return db.iter_orders(since, until, EXPORT_CHUNK_ROWS)
+    if kind == 'stock': return db.iter_stock(EXPORT_CHUNK_ROWS)
+    raise ValueError(f"unknown export '{kind}'")
+
+
+async def export_csv(db, kind, since=None, until=None):
+    # Returns (open spooled file positioned at 0, row count); the caller closes it
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    gz = gzip.GzipFile(fileobj=spool, mode="wb", compresslevel=6)
+    text = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    count = 0
+    try:
+        writer.writerow(EXPORTS[kind])
+        async for chunk in _rows(db, kind, since, until):
+            await asyncio.to_thread(writer.writerows, chunk)
+            count += len(chunk)
+        text.flush()
+        text.detach()  # closing the wrapper would close the spool too
+        gz.close()
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, count
+
+
+def filename(kind, since=None, until=None):
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M")
+    span = (f"_from{since:%Y%m%d}" if since else "") + (f"_to{until:%Y%m%d}" if until else "")
+    return f"{kind}{span}-{stamp}.csv.gz"
@@ -0,0 +1,121 @@
+import glob
+import json
+import os
+import string
+from telegram import InlineKeyboardMarkup
+from config import LOCALES_DIR, DEFAULT_LANG
+
+# Language packs are loaded from LOCALES_DIR once at import time.
+# Every pack is checked against the default (English) pack: missing keys,
+# wrong types or mismatched placeholders fall back to English, so handlers
+# never hit a KeyError and adding a language is just dropping in a JSON file.
+
+_formatter = string.Formatter()
+
+
+def _fields(template):
+    return [f for _, f, _, _ in _formatter.parse(template) if f is not None]
+
+
+class Bundle:
+    def __init__(self, code, name, order, texts):
+        self.code = code
+        self.name = name
+        self.order = order
+        self.texts = texts
+        # Precompiled templates: bound str.format for keys with placeholders
+        self.templates = {k: v.format for k, v in texts.items() if _fields(v)}
+
+    def __getitem__(self, key):
+        return self.texts[key]
+
+    def fmt(self, key, *args):
+        fn = self.templates.get(key)
+        return fn(*args) if fn else self.texts[key]
+
+
+def _read_packs(path):
+    packs = {}
+    for file in sorted(glob.glob(os.path.join(path, "*.json"))):
+        code = os.path.splitext(os.path.basename(file))[0]
+        try:
+            with open(file, encoding="utf-8") as f:
+                packs[code] = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Skipping language pack {file}: {e}")
+    return packs
+
+
+def _compile(packs):
+    if DEFAULT_LANG not in packs:
+        raise RuntimeError(f"Default language pack '{DEFAULT_LANG}.json' missing in {LOCALES_DIR}")
+    base = {k: v for k, v in packs[DEFAULT_LANG].items() if not k.startswith("_")}
+    bundles = {}
+    for code, pack in packs.items():
+        meta = pack.get("_meta", {})
+        texts = {}
+        missing, mismatched = [], []
+        for key, default in base.items():
+            value = pack.get(key)
+            if not isinstance(value, str):
+                missing.append(key)
+                value = default
+            elif sorted(_fields(value)) != sorted(_fields(default)):
+                mismatched.append(key)
+                value = default
+            texts[key] = value
+        extra = [k for k in pack if not k.startswith("_") and k not in base]
+        problems = [f"{label} {keys}" for label, keys in
+                    (("missing", missing), ("placeholders differ in", mismatched), ("unknown keys", extra)) if keys]
+        if problems and code != DEFAULT_LANG:
+            print(f"⚠️ Language '{code}': {', '.join(problems)} (using English)")
+        bundles[code] = Bundle(code, meta.get("name", code), meta.get("order", 99), texts)
+    return bundles
+
+
+BUNDLES = _compile(_read_packs(LOCALES_DIR))
+DEFAULT = BUNDLES[DEFAULT_LANG]
+
+
+def resolve(lang):
+    return lang if lang in BUNDLES else DEFAULT_LANG
+
+
+def get(lang):
+    return BUNDLES.get(lang, DEFAULT)
+
+
+def t(lang, key, *args):
+    return get(lang).fmt(key, *args)
+
+
+def languages():
+    return sorted(BUNDLES.values(), key=lambda b: (b.order, b.code))
+
+
+# --- Static Keyboard Cache ---
+# Screens whose layout only depends on the language register a builder once;
+# the built (immutable) markup is cached per language on first use.
+_builders = {}
+_keyboards = {}
+
+
+def keyboard(name):
+    def register(builder):
+        _builders[name] = builder
+        return builder
+    return register
+
+
+def markup(name, lang):
+    key = (name, resolve(lang))
+    kb = _keyboards.get(key)
+    if kb is None:
+        kb = _keyboards[key] = InlineKeyboardMarkup(_builders[name](get(key[1])))
+    return kb
+
+
+def warm():
+    for b in BUNDLES:
+        for name in _builders:
+            markup(name, b)
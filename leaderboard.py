@@ -0,0 +1,232 @@
+import asyncio
+import bisect
+import datetime
+import time
+from itertools import islice
+from database import Database
+from config import LEADERBOARD_SIZE, LEADERBOARD_REBUILD_SECONDS
+
+# In-memory leaderboards kept current from Database events.
+# TopK answers "top N" and RankIndex answers "your rank" without touching the DB;
+# both are periodically reconciled against indexed queries to repair any drift
+# (e.g. changes made by another process).
+
+
+class RankIndex:
+    # Sorted multiset of scores split into buckets of ~LOAD items (sqrt decomposition):
+    # add/remove/rank are O(log n + n/LOAD).
+    LOAD = 1000
+
+    def __init__(self, values=()):
+        self.load(values)
+
+    def load(self, values):
+        values = sorted(values)
+        self.buckets = [values[i:i + self.LOAD] for i in range(0, len(values), self.LOAD)]
+        self.maxes = [b[-1] for b in self.buckets]
+        self.size = len(values)
+        self.drift = 0  # replaces whose old score wasn't indexed; refresh() rebuilds early
+
+    def add(self, value):
+        self.size += 1
+        if not self.buckets:
+            self.buckets, self.maxes = [[value]], [value]
+            return
+        i = min(bisect.bisect_left(self.maxes, value), len(self.maxes) - 1)
+        b = self.buckets[i]
+        bisect.insort(b, value)
+        self.maxes[i] = b[-1]
+        if len(b) > 2 * self.LOAD:
+            self.buckets[i:i + 1] = [b[:self.LOAD], b[self.LOAD:]]
+            self.maxes[i:i + 1] = [b[self.LOAD - 1], b[-1]]
+
+    def remove(self, value):
+        i = bisect.bisect_left(self.maxes, value)
+        if i == len(self.maxes): return False
+        b = self.buckets[i]
+        j = bisect.bisect_left(b, value)
+        if j == len(b) or b[j] != value: return False
+        del b[j]
+        if b: self.maxes[i] = b[-1]
+        else:
+            del self.buckets[i]
+            del self.maxes[i]
+        self.size -= 1
+        return True
+
+    def replace(self, old, new):
+        # One score changed: the number of scores stays the same. If old isn't indexed the
+        # index has drifted from the DB; new is still inserted, without growing size.
+        if not self.remove(old):
+            self.size -= 1
+            self.drift += 1
+        self.add(new)
+
+    def rank(self, value):
+        # 1 + number of scores strictly greater than value
+        i = bisect.bisect_right(self.maxes, value)
+        if i == len(self.maxes): return 1
+        greater = len(self.buckets[i]) - bisect.bisect_right(self.buckets[i], value)
+        return 1 + greater + sum(map(len, islice(self.buckets, i + 1, None)))
+
+
+class TopK:
+    # The best `capacity` (user_id -> score) entries. `floor` is an upper bound on the
+    # score of every user outside the set (None = nobody is outside), so top(k) is
+    # exact as long as its k-th score is still >= floor.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.scores = {}
+        self.floor = None
+        self._sorted = None
+
+    def load(self, rows):
+        self.scores = {uid: score for uid, score in rows}
+        self.floor = rows[-1][1] if len(rows) >= self.capacity else None
+        self._sorted = None
+
+    def update(self, user_id, score):
+        self._sorted = None
+        if user_id in self.scores or len(self.scores) < self.capacity and self.floor is None:
+            self.scores[user_id] = score
+            return
+        low = min(self.scores, key=self.scores.get) if self.scores else None
+        if low is not None and score > self.scores[low]:
+            self.floor = max(self.floor or 0, self.scores.pop(low))
+            self.scores[user_id] = score
+        else:
+            self.floor = max(self.floor or 0, score)
+
+    def discard(self, user_id):
+        # Leaving the set keeps floor a valid bound for everyone outside it
+        if self.scores.pop(user_id, None) is not None: self._sorted = None
+
+    def top(self, k):
+        if self._sorted is None:
+            self._sorted = sorted(self.scores.items(), key=lambda x: (-x[1], x[0]))
+        rows = self._sorted[:k]
+        valid = self.floor is None or (len(rows) == k and rows[-1][1] >= self.floor)
+        return rows, valid
+
+
+def week_start(now=None):
+    now = now or datetime.datetime.now()
+    return datetime.datetime.combine(now.date() - datetime.timedelta(days=now.weekday()), datetime.time())
+
+
+class Leaderboard:
+    BOARDS = ('balance', 'referrals', 'weekly')
+
+    def __init__(self, size=LEADERBOARD_SIZE):
+        self.size = size
+        self.tops = {'balance': TopK(size * 5), 'referrals': TopK(size * 5), 'weekly': TopK(size * 5)}
+        self.ranks = {'balance': RankIndex(), 'referrals': RankIndex(), 'weekly': RankIndex()}
+        self.ranks_ready = False
+        self.week = week_start()
+        self.weekly = {}
+        self.names = {}
+        self.reconciled_at = 0
+        self.rebuilt_at = 0
+        self._lock = asyncio.Lock()
+
+    # --- Incremental Updates ---
+    def on_event(self, event, user_id, *args):
+        if event == 'user':
+            self.tops['balance'].update(user_id, 0)
+            self.tops['referrals'].update(user_id, 0)
+            if self.ranks_ready:
+                self.ranks['balance'].add(0)
+                self.ranks['referrals'].add(0)
+        elif event in ('balance', 'referrals'):
+            old, new = args
+            self.tops[event].update(user_id, new)
+            if self.ranks_ready: self.ranks[event].replace(old, new)
+        elif event == 'spent':
+            self._roll_week()
+            old = self.weekly.get(user_id, 0)
+            new = self.weekly[user_id] = old + args[0]
+            self.tops['weekly'].update(user_id, new)
+            if old: self.ranks['weekly'].replace(old, new)
+            else: self.ranks['weekly'].add(new)
+        elif event == 'refund':
+            # Only orders bought this week count towards the weekly board
+            amount, purchased_at = args
+            self._roll_week()
+            old = self.weekly.get(user_id, 0)
+            if not old or datetime.datetime.fromisoformat(str(purchased_at)) < self.week: return
+            new = old - amount
+            if new > 0:
+                self.weekly[user_id] = new
+                self.tops['weekly'].update(user_id, new)
+                self.ranks['weekly'].replace(old, new)
+            else:
+                del self.weekly[user_id]
+                self.tops['weekly'].discard(user_id)
+                self.ranks['weekly'].remove(old)
+
+    def _roll_week(self):
+        start = week_start()
+        if start != self.week:
+            self.week, self.weekly = start, {}
+            self.tops['weekly'].load([])
+            self.ranks['weekly'].load([])
+
+    # --- Reads ---
+    def top(self, board):
+        if board == 'weekly': self._roll_week()
+        return self.tops[board].top(self.size)
+
+    def rank(self, board, score):
+        if board == 'weekly':
+            return self.ranks['weekly'].rank(score) if score else None
+        return self.ranks[board].rank(score) if self.ranks_ready else None
+
+    def total(self, board):
+        return self.ranks[board].size
+
+    async def names_for(self, db, user_ids):
+        missing = [uid for uid in user_ids if uid not in self.names]
+        if missing: self.names.update(await db.get_user_names(missing))
+        return {uid: self.names.get(uid) or str(uid) for uid in user_ids}
+
+    # --- Reconciliation ---
+    async def reconcile(self, db):
+        async with self._lock:
+            capacity = self.tops['balance'].capacity
+            bal = await db.get_top_users(capacity)
+            refs = await db.get_top_referrers(capacity)
+            self.tops['balance'].load([(r[0], r[2]) for r in bal])
+            self.tops['referrals'].load([(r[0], r[2]) for r in refs])
+            self.names.update({r[0]: r[1] for r in bal + refs})
+
+            self.week = week_start()
+            self.weekly = dict(await db.get_buyer_totals(self.week))
+            weekly = sorted(self.weekly.items(), key=lambda x: -x[1])[:capacity]
+            self.tops['weekly'].load(weekly)
+            self.ranks['weekly'].load(self.weekly.values())
+            self.reconciled_at = time.monotonic()
+
+    async def rebuild_ranks(self, db):
+        balances = await db.get_sorted_scores('balance')
+        referrals = await db.get_sorted_scores('total_referrals')
+        self.ranks['balance'].load(balances)
+        self.ranks['referrals'].load(referrals)
+        self.ranks_ready = True
+        self.rebuilt_at = time.monotonic()
+
+    def attach(self, db=None):
+        # db: follow only that database (one board per tenant); None: every database
+        listeners = Database.listeners if db is None else db.local_listeners
+        if self.on_event not in listeners:
+            listeners.append(self.on_event)
+
+    async def refresh(self, db, rebuild_every=LEADERBOARD_REBUILD_SECONDS):
+        # Scheduled by maintenance.py: top lists every run, rank indexes less often
+        await self.reconcile(db)
+        drifted = self.ranks['balance'].drift or self.ranks['referrals'].drift
+        if not self.ranks_ready or drifted or time.monotonic() - self.rebuilt_at >= rebuild_every:
+            await self.rebuild_ranks(db)
+        return f"top={len(self.tops['balance'].scores)} ranked={self.ranks['balance'].size}"
+
+
+board = Leaderboard()
@@ -1,82 +1,280 @@
 
 import asyncio
-import nest_asyncio
+import importlib
 import os
-from aiohttp import web
+import signal
+import time
+_T0 = time.perf_counter()  # startup breakdown includes imports
+import nest_asyncio
 from telegram.ext import ApplicationBuilder
-from telegram.request import HTTPXRequest
-from config import USER_BOT_TOKEN, ADMIN_BOT_TOKEN
-from database import Database
+from config import WORKERS, DRAIN_SECONDS, TENANTS_FILE, TENANTS_RELOAD_SECONDS, HTTP_POOL_SIZE
 from user_bot import setup_user_bot
 from admin_bot import setup_admin_bot
+import i18n
+import maintenance
+import ratelimit
+import render
+import tenants
+import topup
+from outbox import OutboxWorker
+from update_processor import build_processor
+from readiness import Readiness, PollRequest, backlog
 
 nest_asyncio.apply()
 
+
+def _request():
+    # Increasing timeout to avoid "TimedOut" errors on slow connections. API calls of every
+    # bot share this pool (it closes with the last bot); long polling gets a PollRequest each.
+    return tenants.SharedRequest(connection_pool_size=HTTP_POOL_SIZE, connect_timeout=60, read_timeout=60, write_timeout=60)
+
+
+class StartupTimer:
+    def __init__(self):
+        self.steps = {'imports': time.perf_counter() - _T0}
+
+    async def step(self, name, aw):
+        start = time.perf_counter()
+        try: return await aw
+        finally: self.steps[name] = time.perf_counter() - start
+
+    def report(self):
+        total = time.perf_counter() - _T0
+        return f"⏱️ Ready in {total:.2f}s: " + ", ".join(f"{k} {v:.2f}s" for k, v in self.steps.items())
+
+
+async def _warm_up(shops):
+    # Not needed to answer the first update; runs once the bots are polling
+    start = time.perf_counter()
+    i18n.warm()
+    for tenant in shops:
+        try: await tenant.board.refresh(tenant.db)
+        except Exception as e: print(f"⚠️ Leaderboard warm-up failed ({tenant.name}): {e}")
+    print(f"🔥 Caches warmed in {time.perf_counter() - start:.2f}s")
+
+
+# --- Tenants ---
+def build_tenant(tenant, pool, readiness):
+    # Different users are processed concurrently, one user's updates in order (see update_processor.py)
+    for kind, token, setup in (("user", tenant.user_token, setup_user_bot), ("admin", tenant.admin_token, setup_admin_bot)):
+        poll_request = PollRequest()
+        app = ApplicationBuilder().token(token).request(pool).get_updates_request(poll_request) \
+            .rate_limiter(ratelimit.for_token(token)).concurrent_updates(build_processor(tenant.label(kind))).build()
+        app.bot_data['tenant'] = tenant
+        setup(app)
+        tenant.apps[kind] = app
+        readiness.add_bot(tenant.label(kind), app, poll_request)
+    readiness.add_db(tenant.label("db"), tenant.db)
+
+    # Periodic jobs: DB maintenance once (admin app), in-memory rollups per process (user app)
+    maintenance.schedule(tenant.apps["admin"].job_queue, tenant.db)
+    maintenance.schedule(tenant.apps["user"].job_queue, tenant.db, maintenance.LOCAL_JOBS)
+
+
+async def start_bot(app):
+    await app.start()
+    await app.updater.start_polling(allowed_updates=True)
+
+
+async def start_tenant(tenant, pool, readiness):
+    # Schema check (one PRAGMA read unless a migration is due) and both bots' getMe at once,
+    # then polling (handlers need the schema, so only now) and the outbox
+    build_tenant(tenant, pool, readiness)
+    apps = list(tenant.apps.values())
+    try:
+        migrated = (await asyncio.gather(tenant.db.init_db(), *(app.initialize() for app in apps)))[0]
+        await asyncio.gather(*(start_bot(app) for app in apps))
+    except Exception:
+        readiness.remove(tenant.label("db"), *(tenant.label(kind) for kind in tenant.apps))
+        for app in apps:
+            try: await app.shutdown()
+            except Exception: pass
+        raise
+    tenant.outbox = OutboxWorker(tenant.db, {'user': tenant.apps['user'].bot, 'admin': tenant.apps['admin'].bot})
+    tenant.outbox_task = asyncio.create_task(tenant.outbox.run())
+    tenants.registry[tenant.name] = tenant
+    return migrated
+
+
+async def apply_tenants(specs, pool, readiness):
+    # Start, stop or restart tenants so the running ones match specs (see tenants.load)
+    running = tenants.registry
+    gone = [t for name, t in running.items() if name not in specs or t.spec() != specs[name]]
+    if gone:
+        await drain(gone)
+        for t in gone:
+            readiness.remove(t.label("db"), *(t.label(kind) for kind in t.apps))
+            running.pop(t.name, None)
+            print(f"🏪 Tenant {t.name} stopped")
+    new = [tenants.create(name, spec) for name, spec in specs.items() if name not in running]
+    results = await asyncio.gather(*(start_tenant(t, pool, readiness) for t in new), return_exceptions=True)
+    for t, result in zip(new, results):
+        if isinstance(result, Exception): print(f"⚠️ Tenant {t.name} failed to start: {result!r}")
+        else: print(f"🏪 Tenant {t.name} started" + (" (database migrated)" if result else ""))
+    started = [t for t, result in zip(new, results) if not isinstance(result, Exception)]
+    if started: asyncio.create_task(_warm_up(started))
+    return started, results
+
+
+def _mtime(path):
+    try: return os.stat(path).st_mtime_ns
+    except OSError: return None
+
+
+async def watch_tenants(pool, readiness, reload_now):
+    # Re-reads TENANTS_FILE when it changes, or right away on SIGHUP
+    seen = _mtime(TENANTS_FILE)
+    while True:
+        try: await asyncio.wait_for(reload_now.wait(), TENANTS_RELOAD_SECONDS)
+        except asyncio.TimeoutError: pass
+        forced = reload_now.is_set()
+        reload_now.clear()
+        mtime = _mtime(TENANTS_FILE)
+        if mtime == seen and not forced: continue
+        seen = mtime
+        try: specs = tenants.load()
+        except (OSError, ValueError, TypeError) as e:
+            print(f"⚠️ Tenants file not applied, keeping the running tenants: {e}")
+            continue
+        try: await apply_tenants(specs, pool, readiness)
+        except Exception as e: print(f"⚠️ Tenant reload failed: {e!r}")
+
+
 async def main():
-    # 1. Initialize Database
-    db = Database()
-    await db.init_db()
-    print("✅ Database Initialized.")
-
-    # 2. Build Apps with custom request timeouts
-    # Increasing timeout to avoid "TimedOut" errors on slow connections
-    trequest = HTTPXRequest(connection_pool_size=8, connect_timeout=60, read_timeout=60, write_timeout=60)
-    
-    print("🤖 Building Bots... (Version 2.1 - Notification Fix Verified)")
-    user_app = ApplicationBuilder().token(USER_BOT_TOKEN).request(trequest).build()
-    setup_user_bot(user_app)
-
-    admin_app = ApplicationBuilder().token(ADMIN_BOT_TOKEN).request(trequest).build()
-    setup_admin_bot(admin_app)
-
-    # 3. Initialize & Start User Bot
-    print("🚀 Starting User Bot...")
-    await user_app.initialize()
-    await user_app.start()
-    await user_app.updater.start_polling(allowed_updates=True)
-
-    # 4. Initialize & Start Admin Bot
-    print("🚀 Starting Admin Bot...")
-    await admin_app.initialize()
-    await admin_app.start()
-    await admin_app.updater.start_polling(allowed_updates=True)
-
-    # 5. Start Keep-Alive Web Server
+    timer = StartupTimer()
+    readiness = Readiness()
+    pool = _request()
+    specs = tenants.load()
+    print(f"🤖 Building Bots for {len(specs)} shop(s)... (Version 2.1 - Notification Fix Verified)")
+
     async def health_check(request):
-        return web.Response(text="Bot is alive!")
-
-    app = web.Application()
-    app.add_routes([web.get('/', health_check)])
-    
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', int(os.environ.get("PORT", 8080)))
-    await site.start()
+        text = "Bot is alive!"
+        for tenant in list(tenants.registry.values()):
+            for kind, app in tenant.apps.items():
+                stats = getattr(app.update_processor, "stats", None)
+                text += f"\n{tenant.label(kind)}: queued={app.update_queue.qsize()}"
+                if stats: text += " " + " ".join(f"{k}={v}" for k, v in stats().items())
+        for name, st in maintenance.stats.items():
+            text += f"\njob {name}: runs={st['runs']} failures={st['failures']} skipped={st['skipped']} last={st['last_seconds']}s"
+        text += "\nrender: " + " ".join(f"{k}={v}" for k, v in render.stats.items())
+        for bot_id, st in ratelimit.report().items():
+            text += f"\nsend {bot_id}: " + " ".join(f"{k}={v}" for k, v in st.items())
+        for tenant in list(tenants.registry.values()):
+            if tenant.topup_secret:
+                text += f"\n{tenant.label('topup')}: queued={tenant.topup.depth()} " + " ".join(f"{k}={v}" for k, v in tenant.topup.stats.items())
+        return web.Response(text=text)
+
+    async def topup_callback(request):
+        # Payment provider callbacks (topup.py): /topup for the config.py shop, /topup/<tenant>
+        tenant = tenants.registry.get(request.match_info.get('tenant', 'default'))
+        if tenant is None: return web.Response(text="unknown shop", status=404)
+        status, text = await topup.handle(tenant, await request.read(), request.headers.get('X-Signature'))
+        return web.Response(text=text, status=status)
+
+    async def ready_check(request):
+        ok, lines = await readiness.check()
+        return web.Response(text="\n".join(lines), status=200 if ok else 503)
+
+    async def start_web_server():
+        nonlocal web
+        # aiohttp takes a noticeable time to import; do it on a thread while getMe is in flight
+        web = await asyncio.to_thread(importlib.import_module, "aiohttp.web")
+        app = web.Application()
+        app.add_routes([web.get('/', health_check), web.get('/ready', ready_check),
+                        web.post('/topup', topup_callback), web.post('/topup/{tenant}', topup_callback)])
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '0.0.0.0', int(os.environ.get("PORT", 8080))).start()
+        return runner
+
+    # 1. Every tenant (schema, getMe, polling, outbox) and the web server, all at once
+    web = None
+    print("🚀 Starting...")
+    (started, results), runner = await asyncio.gather(
+        timer.step("tenants", apply_tenants(specs, pool, readiness)),
+        timer.step("web", start_web_server()),
+    )
+    if not started and results:
+        await runner.cleanup()
+        raise next(r for r in results if isinstance(r, Exception))
+    readiness.state = 'ready'
+
     print(f"🌍 Web Server started on port {os.environ.get('PORT', 8080)}")
+    print(timer.report())
+    print(f"✅ Bots of {len(started)} shop(s) are Running! (Press Ctrl+C to stop)")
 
-    print("✅ Both Bots are Running! (Press Ctrl+C to stop)")
-    
-    # 5. Keep alive
+    # 2. Keep alive until SIGTERM (deploys) or Ctrl+C; SIGHUP re-reads the tenants file
+    stop = asyncio.Event()
+    reload_now = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    watcher = None
+    if TENANTS_FILE:
+        loop.add_signal_handler(signal.SIGHUP, reload_now.set)
+        watcher = asyncio.create_task(watch_tenants(pool, readiness, reload_now))
     try:
-        await asyncio.Event().wait()
+        await stop.wait()
     except asyncio.CancelledError:
         pass
     finally:
-        print("🛑 Stopping Bots...")
-        if user_app.updater.running:
-             await user_app.updater.stop()
-        if user_app.running:
-             await user_app.stop()
-             await user_app.shutdown()
-        
-        if admin_app.updater.running:
-             await admin_app.updater.stop()
-        if admin_app.running:
-             await admin_app.stop()
-             await admin_app.shutdown()
+        if watcher: watcher.cancel()
+        readiness.state = 'draining'
+        await drain(list(tenants.registry.values()))
+        await runner.cleanup()
+
+
+async def drain(shops, seconds=DRAIN_SECONDS):
+    # Graceful shutdown of tenants within `seconds`: stop fetching, finish what was fetched,
+    # send what is due in the outbox, checkpoint the WAL
+    deadline = time.monotonic() + seconds
+    remaining = lambda: max(0.0, deadline - time.monotonic())
+    apps = [app for t in shops for app in t.apps.values()]
+    print(f"🛑 Draining {len(shops)} shop(s) (up to {seconds:g}s)...")
+
+    # 1. No new updates. Updater.stop confirms the offset of everything already fetched.
+    await asyncio.gather(*(app.updater.stop() for app in apps if app.updater.running), return_exceptions=True)
+
+    # 2. Application.stop handles every queued update and waits for in-flight handlers
+    running = [app for app in apps if app.running]
+    try:
+        await asyncio.wait_for(asyncio.gather(*(app.stop() for app in running)), remaining())
+        print("✅ In-flight updates finished")
+    except asyncio.TimeoutError:
+        print(f"⚠️ Drain deadline hit, {sum(backlog(app) for app in apps)} update(s) left unhandled")
+
+    # 3. Deliver notifications that are due (the rest stays in the outbox for the next start)
+    for t in shops:
+        if t.outbox_task: t.outbox_task.cancel()
+    for t in shops:
+        if t.outbox is None: continue
+        try:
+            while remaining() > 0 and await asyncio.wait_for(t.outbox.drain_once(), remaining()):
+                pass
+        except (asyncio.TimeoutError, Exception) as e:
+            print(f"⚠️ Outbox flush stopped ({t.name}): {e!r}")
+        try: depth = await t.db.outbox_depth()
+        except Exception: depth = "?"
+        print(f"📤 Outbox {t.name}: {t.outbox.stats['sent']} sent this run, {depth} still queued")
+
+    for app in apps:
+        try: await app.shutdown()
+        except Exception as e: print(f"⚠️ Shutdown: {e}")
+    for t in shops:
+        try: await t.db.checkpoint()
+        except Exception as e: print(f"⚠️ Final checkpoint failed ({t.name}): {e}")
+    print(f"🛑 Stopped ({seconds - remaining():.1f}s)")
+
+async def run_supervisor():
+    import supervisor
+    if TENANTS_FILE:
+        print("⚠️ WORKERS > 1 serves the single shop from config.py; TENANTS_FILE is ignored")
+    await tenants.default().db.init_db()
+    await supervisor.Supervisor(WORKERS).run()
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        # WORKERS > 1: one process per user-bot shard plus an admin process (see supervisor.py)
+        asyncio.run(run_supervisor() if WORKERS > 1 else main())
     except KeyboardInterrupt:
         print("Exited by User.")
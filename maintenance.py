@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import os
+import random
+import socket
+import time
+from config import (JOB_INTERVALS, JOB_JITTER_SECONDS, ORDER_ESCALATE_HOURS, ORDER_AUTO_REFUND_HOURS,
+                    CODE_RETENTION_DAYS, VACUUM_PAGES, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE)
+import backup
+import tenants
+
+# Periodic jobs on PTB's JobQueue. DB jobs take a lease in `job_locks` first, so with
+# several processes or overlapping deploys each run happens once; per-process jobs
+# (in-memory rollups) run everywhere without a lock.
+
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+# name (tenant prefix + job) -> {'runs', 'failures', 'skipped', 'last_seconds', 'total_seconds', 'last_result', 'last_run'}
+stats = {}
+
+
+# --- Jobs ---
+async def pending_orders(db):
+    now = datetime.datetime.now()
+    escalated = refunded = ()
+    if ORDER_ESCALATE_HOURS > 0:
+        escalated = await db.escalate_stale_orders(now - datetime.timedelta(hours=ORDER_ESCALATE_HOURS), _escalation_notices)
+    if ORDER_AUTO_REFUND_HOURS > 0:
+        refunded = await db.refund_stale_orders(now - datetime.timedelta(hours=ORDER_AUTO_REFUND_HOURS), _refund_notices)
+    return f"escalated={len(escalated)} refunded={len(refunded)}"
+
+
+def _escalation_notices(rows):
+    ids = ", ".join(f"#{r[0]}" for r in rows)
+    text = f"⏰ **{len(rows)} order(s) pending over {ORDER_ESCALATE_HOURS:g}h**\n{ids}"
+    return [('admin', admin_id, text) for admin_id in tenants.current().admin_ids]
+
+
+def _refund_notices(rows):
+    notices = [('user', uid, f"↩️ Order #{oid} Refunded.") for oid, uid, _ in rows]
+    text = f"↩️ **Auto-refunded {len(rows)} order(s)** pending over {ORDER_AUTO_REFUND_HOURS:g}h\n" + ", ".join(f"#{r[0]}" for r in rows)
+    return notices + [('admin', admin_id, text) for admin_id in tenants.current().admin_ids]
+
+
+async def db_checkpoint(db):
+    return await db.checkpoint()
+
+
+async def db_vacuum(db):
+    return await db.incremental_vacuum(VACUUM_PAGES)
+
+
+async def purge_codes(db):
+    return await db.purge_redeem_codes(datetime.datetime.now() - datetime.timedelta(days=CODE_RETENTION_DAYS))
+
+
+async def archive_orders(db):
+    # Never closer than 8 days, so weekly rollups only ever need the hot table
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=max(8, ARCHIVE_AFTER_DAYS))
+    moved = 0
+    while True:
+        n = await db.archive_orders(cutoff, ARCHIVE_BATCH_SIZE)
+        moved += n
+        if n < ARCHIVE_BATCH_SIZE: return f"archived={moved}"
+        await asyncio.sleep(0.05)  # let purchases in between batches
+
+
+async def balance_snapshot(db):
+    updated, upto = await db.snapshot_balances()
+    return f"users={updated} ledger_id={upto}"
+
+
+async def snapshot(db):
+    results = []
+    for db_path in backup.databases(db.db_path):
+        info = await backup.snapshot(db_path)
+        results.append(f"{os.path.basename(info['path'])} {info['gz_bytes']}B {info['seconds']}s")
+    return ", ".join(results)
+
+
+async def rollups(db):
+    return await tenants.current().board.refresh(db)
+
+
+# name -> (coroutine function, needs cross-process lock)
+DB_JOBS = {
+    'pending_orders': (pending_orders, True),
+    'db_checkpoint': (db_checkpoint, True),
+    'db_vacuum': (db_vacuum, True),
+    'purge_codes': (purge_codes, True),
+    'archive_orders': (archive_orders, True),
+    'balance_snapshot': (balance_snapshot, True),
+    'backup': (snapshot, True),
+}
+LOCAL_JOBS = {
+    'rollups': (rollups, False),
+}
+
+
+def _wrap(name, fn, interval, locked):
+    async def callback(context):
+        db = context.job.data
+        tenant = tenants.bind(context) or tenants.current()
+        st = stats.setdefault(tenant.label(name), {'runs': 0, 'failures': 0, 'skipped': 0, 'last_seconds': 0.0,
+                                     'total_seconds': 0.0, 'last_result': None, 'last_run': None})
+        # The lease outlives a slow run; min_gap stops a second instance re-running it right away
+        if locked and not await db.acquire_job_lock(name, OWNER, lease=max(60, interval), min_gap=interval / 2):
+            st['skipped'] += 1
+            return
+        start = time.perf_counter()
+        try:
+            st['last_result'] = await fn(db)
+            st['runs'] += 1
+        except Exception as e:
+            st['failures'] += 1
+            st['last_result'] = f"error: {e}"
+            print(f"⚠️ Job {name} failed: {e}")
+        finally:
+            elapsed = time.perf_counter() - start
+            st['last_seconds'] = round(elapsed, 3)
+            st['total_seconds'] += elapsed
+            st['last_run'] = datetime.datetime.now().isoformat(timespec='seconds')
+            if locked: await db.release_job_lock(name, OWNER)
+    return callback
+
+
+def schedule(job_queue, db, jobs=DB_JOBS):
+    if job_queue is None:
+        print("⚠️ JobQueue unavailable (install python-telegram-bot[job-queue]); maintenance disabled")
+        return
+    for name, (fn, locked) in jobs.items():
+        interval = JOB_INTERVALS.get(name, 0)
+        if interval <= 0: continue
+        job_queue.run_repeating(_wrap(name, fn, interval, locked), interval=interval, data=db, name=name,
+                                first=random.uniform(1, 1 + JOB_JITTER_SECONDS),
+                                job_kwargs={'jitter': JOB_JITTER_SECONDS})
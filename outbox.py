@@ -0,0 +1,97 @@
+import asyncio
+import random
+import time
+from telegram.error import RetryAfter, Forbidden, BadRequest
+from config import (OUTBOX_CONCURRENCY, OUTBOX_BATCH_SIZE, OUTBOX_POLL_SECONDS, OUTBOX_MAX_ATTEMPTS,
+                    OUTBOX_BACKOFF_SECONDS, OUTBOX_MAX_BACKOFF_SECONDS)
+
+# Delivers rows from the `outbox` table (see Database._enqueue). Delivery is
+# at-least-once: a row is only deleted after Telegram accepted the message.
+
+
+def _seconds(value):
+    # RetryAfter.retry_after is an int or a timedelta depending on the PTB version
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+class OutboxWorker:
+    def __init__(self, db, bots, concurrency=OUTBOX_CONCURRENCY, batch_size=OUTBOX_BATCH_SIZE):
+        self.db = db
+        self.bots = bots  # {'user': Bot, 'admin': Bot}
+        self.batch_size = batch_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self.paused_until = 0
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0}
+
+    def on_event(self, event, user_id, *args):
+        if event == 'outbox': self._wakeup.set()
+
+    def _backoff(self, attempts):
+        delay = min(OUTBOX_MAX_BACKOFF_SECONDS, OUTBOX_BACKOFF_SECONDS * 2 ** attempts)
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _send(self, row):
+        bot = self.bots.get(row['bot'])
+        if bot is None:
+            return 'failed', f"unknown bot '{row['bot']}'"
+        async with self._semaphore:
+            # A flood-wait hit by one send pauses every send
+            pause = self.paused_until - time.monotonic()
+            if pause > 0: await asyncio.sleep(pause)
+            try:
+                await bot.send_message(chat_id=row['chat_id'], text=row['text'], parse_mode=row['parse_mode'],
+                                       rate_limit_args={'priority': 'transactional'})
+                return 'sent', None
+            except RetryAfter as e:
+                wait = _seconds(e.retry_after)
+                self.paused_until = max(self.paused_until, time.monotonic() + wait)
+                return 'retry', f"RetryAfter {wait}s", wait
+            except (Forbidden, BadRequest) as e:
+                # Blocked bot / chat not found: retrying will not help
+                return 'failed', str(e)
+            except Exception as e:
+                return 'retry', str(e), None
+
+    async def drain_once(self):
+        rows = await self.db.fetch_due_outbox(self.batch_size)
+        if not rows: return 0
+        results = await asyncio.gather(*(self._send(r) for r in rows))
+
+        sent, retries, failures = [], [], []
+        now = time.time()
+        for row, res in zip(rows, results):
+            if res[0] == 'sent':
+                sent.append(row['id'])
+            elif res[0] == 'failed' or row['attempts'] + 1 >= OUTBOX_MAX_ATTEMPTS:
+                failures.append((row['id'], res[1]))
+            else:
+                delay = res[2] if res[2] is not None else self._backoff(row['attempts'])
+                retries.append((row['id'], now + delay, res[1]))
+        await self.db.ack_outbox(sent, retries, failures)
+
+        self.stats['sent'] += len(sent)
+        self.stats['retried'] += len(retries)
+        self.stats['failed'] += len(failures)
+        for oid, err in failures:
+            print(f"⚠️ Outbox #{oid} dropped: {err}")
+        return len(rows)
+
+    async def run(self, poll=OUTBOX_POLL_SECONDS):
+        # Only this database's events: other tenants' notifications are not ours to send
+        if self.on_event not in self.db.local_listeners:
+            self.db.local_listeners.append(self.on_event)
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.drain_once() >= self.batch_size:
+                    continue  # more work waiting
+                next_due = await self.db.next_outbox_due()
+            except Exception as e:
+                print(f"⚠️ Outbox drain failed: {e}")
+                next_due = None
+            timeout = poll if next_due is None else min(poll, max(0.0, next_due - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
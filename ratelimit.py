@@ -0,0 +1,151 @@
+import asyncio
+import collections
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter, ExtBot
+from config import (RATE_GLOBAL_PER_SECOND, RATE_CHAT_PER_SECOND, RATE_CHAT_BURST, RATE_GROUP_PER_MINUTE,
+                    RATE_MAX_RETRIES)
+
+# Outbound scheduler for Bot API calls. Every bot token gets one limiter (for_token), shared
+# by everything in the process that sends with that token: the Application's bot, the
+# outbox and broadcasts. It enforces
+#   - a global rate per token (RATE_GLOBAL_PER_SECOND)
+#   - a per-chat token bucket (RATE_CHAT_PER_SECOND, bursts of RATE_CHAT_BURST; groups
+#     RATE_GROUP_PER_MINUTE)
+#   - priority when calls have to wait: interactive (handler replies, the default) before
+#     transactional (outbox notices) before bulk (broadcasts)
+#   - RetryAfter from any call pauses every call with that token, then the call is retried
+# Pass the class per call: bot.send_message(..., rate_limit_args={'priority': 'bulk'}).
+# answerCallbackQuery / answerInlineQuery and get* calls are not limited.
+
+CLASSES = ('interactive', 'transactional', 'bulk')
+
+_limiters = {}  # token -> PriorityRateLimiter
+
+
+def _seconds(value):
+    # RetryAfter.retry_after is an int or a timedelta depending on the PTB version
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+def _unlimited(endpoint):
+    return endpoint.startswith(("answerCallbackQuery", "answerInlineQuery", "get"))
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    def __init__(self, per_second=RATE_GLOBAL_PER_SECOND, chat_per_second=RATE_CHAT_PER_SECOND,
+                 chat_burst=RATE_CHAT_BURST, group_per_minute=RATE_GROUP_PER_MINUTE, max_retries=RATE_MAX_RETRIES):
+        self.rate = per_second
+        self.chat_rate = chat_per_second
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_minute / 60
+        self.max_retries = max_retries
+        self._tokens = float(per_second)
+        self._refilled = time.monotonic()
+        self._chats = {}  # chat_id -> [tokens, refilled at]
+        self._waiting = {c: collections.deque() for c in CLASSES}
+        self._pump_task = None
+        self.paused_until = 0.0
+        self.stats = {'sent': 0, 'retry_after': 0, 'waited': 0}
+
+    # Shared by several bots; each calls these, so they keep no per-bot state
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def depth(self):
+        return {c: sum(not f.done() for f in q) for c, q in self._waiting.items()}
+
+    # --- Global bucket, handed out by priority ---
+    def _refill(self, now):
+        self._tokens = min(float(self.rate), self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    async def _global_slot(self, cls):
+        now = time.monotonic()
+        if now >= self.paused_until and not any(self._waiting.values()):
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+        self.stats['waited'] += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._waiting[cls].append(fut)
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await fut
+
+    async def _pump(self):
+        # Grants waiting calls one token at a time, highest class first; exits when idle
+        while True:
+            queue = next((q for q in (self._waiting[c] for c in CLASSES) if q), None)
+            if queue is None: return
+            if queue[0].done():  # caller cancelled
+                queue.popleft()
+                continue
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            self._tokens -= 1
+            queue.popleft().set_result(None)
+
+    # --- Per-chat bucket ---
+    async def _chat_slot(self, chat_id):
+        group = isinstance(chat_id, str) or chat_id < 0
+        rate, burst = (self.group_rate, 1) if group else (self.chat_rate, self.chat_burst)
+        now = time.monotonic()
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 50000: self._prune(now)
+            bucket = self._chats[chat_id] = [float(burst), now]
+        bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        bucket[0] -= 1  # reserve now, so concurrent calls queue up behind each other
+        if bucket[0] < 0: await asyncio.sleep(-bucket[0] / rate)
+
+    def _prune(self, now):
+        # Drop chats whose bucket has refilled anyway
+        for chat_id, (tokens, at) in list(self._chats.items()):
+            if now - at > 60: del self._chats[chat_id]
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if _unlimited(endpoint): return await callback(*args, **kwargs)
+        cls = (rate_limit_args or {}).get('priority', 'interactive')
+        if cls not in self._waiting: cls = 'interactive'
+        chat_id = data.get('chat_id')
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None: await self._chat_slot(chat_id)
+            await self._global_slot(cls)
+            try:
+                result = await callback(*args, **kwargs)
+                self.stats['sent'] += 1
+                return result
+            except RetryAfter as e:
+                self.stats['retry_after'] += 1
+                self.paused_until = max(self.paused_until, time.monotonic() + _seconds(e.retry_after))
+                print(f"⚠️ Flood wait {_seconds(e.retry_after):g}s on {endpoint}, all sends paused")
+                if attempt == self.max_retries: raise
+
+
+def for_token(token, processes=1):
+    # processes: how many processes send with this token (multi-process mode splits the rate)
+    if token not in _limiters:
+        _limiters[token] = PriorityRateLimiter(per_second=max(1.0, RATE_GLOBAL_PER_SECOND / processes))
+    return _limiters[token]
+
+
+def bot(token, processes=1, **kwargs):
+    # An extra ExtBot (e.g. the admin side sending as the user bot) on the token's shared limiter
+    return ExtBot(token, rate_limiter=for_token(token, processes), **kwargs)
+
+
+def report():
+    # bot id -> queue depth per class and counters
+    return {token.split(":")[0]: {'depth': lim.depth(), **lim.stats} for token, lim in _limiters.items()}
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from telegram.request import HTTPXRequest
+from config import READY_MAX_POLL_AGE, READY_MAX_QUEUE
+
+# Readiness for load balancers / deploy tooling (GET /ready): 200 only while the
+# database takes writes, every bot's getUpdates succeeded recently and the update
+# backlog is small; 503 while starting up or draining.
+
+
+class PollRequest(HTTPXRequest):
+    # Used as get_updates_request: remembers when Telegram last answered getUpdates
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_ok = None
+
+    async def do_request(self, *args, **kwargs):
+        result = await super().do_request(*args, **kwargs)
+        if result[0] == 200: self.last_ok = time.monotonic()
+        return result
+
+
+def backlog(app):
+    # Updates fetched but not yet being handled
+    stats = getattr(app.update_processor, "stats", None)
+    if stats is None: return app.update_queue.qsize()
+    st = stats()
+    return app.update_queue.qsize() + st['waiting_user'] + st['waiting_slot']
+
+
+class Readiness:
+    def __init__(self):
+        self.state = 'starting'  # -> 'ready' -> 'draining'
+        self.dbs = {}  # name -> Database
+        self.bots = {}  # name -> (Application, PollRequest)
+        self.checks = {}  # name -> fn() -> (ok, detail line), e.g. supervisor.py's workers
+
+    def add_db(self, name, db):
+        self.dbs[name] = db
+
+    def add_bot(self, name, app, poll_request):
+        self.bots[name] = (app, poll_request)
+
+    def add_check(self, name, fn):
+        self.checks[name] = fn
+
+    def remove(self, *names):
+        # A tenant's database and bots when it is stopped at runtime
+        for name in names:
+            self.dbs.pop(name, None)
+            self.bots.pop(name, None)
+            self.checks.pop(name, None)
+
+    async def check(self):
+        # (ready, [detail lines])
+        problems, lines = [], [f"state: {self.state}"]
+        if self.state != 'ready': problems.append(self.state)
+        for name, db in list(self.dbs.items()):
+            try:
+                start = time.perf_counter()
+                await asyncio.wait_for(db.ping(), 2)
+                lines.append(f"{name}: ok {1000 * (time.perf_counter() - start):.1f}ms, outbox {await db.outbox_depth()} pending")
+            except Exception as e:
+                problems.append(name)
+                lines.append(f"{name}: {type(e).__name__} {e}")
+        now = time.monotonic()
+        for name, (app, req) in list(self.bots.items()):
+            age = None if req.last_ok is None else now - req.last_ok
+            queued = backlog(app)
+            if age is None or age > READY_MAX_POLL_AGE: problems.append(f"{name} polling")
+            if queued > READY_MAX_QUEUE: problems.append(f"{name} backlog")
+            lines.append(f"{name}: last getUpdates {'never' if age is None else f'{age:.0f}s ago'}, backlog {queued}")
+        for name, fn in list(self.checks.items()):
+            ok, line = fn()
+            if not ok: problems.append(name)
+            lines.append(f"{name}: {line}")
+        if problems: lines.insert(0, "not ready: " + ", ".join(problems))
+        else: lines.insert(0, "ready")
+        return not problems, lines
@@ -0,0 +1,73 @@
+import collections
+import hashlib
+from telegram.error import BadRequest
+from config import RENDER_CACHE_SIZE
+
+# Screen edits for callback buttons. Tapping a button that leads to the screen already
+# shown (a menu, the current page, a list that hasn't changed) would cost an
+# editMessageText call that Telegram rejects with "message is not modified". edit()
+# remembers a hash of the last text/markup it rendered into each message and, when the
+# new render is identical, only answers the callback query. Handlers answer through
+# answer() so edit() knows not to answer a second time; answer_once() is for a handler
+# that may run after another one already answered the same query.
+#
+# The message attached to the callback is what the user currently sees, so a message
+# changed by anything else (a plain edit, another screen) never matches and gets edited.
+
+stats = {'edits': 0, 'skipped': 0, 'not_modified': 0}
+
+# (bot id, chat id, message id) -> (hash of text + parse mode, plain text Telegram stored)
+_last = collections.OrderedDict()
+_answered = collections.OrderedDict()  # ids of callback queries answered via answer()
+
+
+def _digest(text, parse_mode):
+    return hashlib.blake2b(f"{parse_mode}\0{text}".encode(), digest_size=8).digest()
+
+
+def _unchanged(query, key, digest, text, parse_mode, reply_markup):
+    msg = query.message
+    if msg is None or getattr(msg, "text", None) is None: return False  # inaccessible or media message
+    if msg.reply_markup != reply_markup: return False
+    if parse_mode is None and msg.text == text: return True
+    last = _last.get(key)
+    return last is not None and last[0] == digest and last[1] == msg.text
+
+
+def _remember(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > RENDER_CACHE_SIZE: cache.popitem(last=False)
+
+
+async def answer(query, *args, **kwargs):
+    await query.answer(*args, **kwargs)
+    _remember(_answered, query.id, None)
+
+
+async def answer_once(query, *args, **kwargs):
+    # Answer unless already answered through answer(); True if this call answered
+    if query.id in _answered: return False
+    await answer(query, *args, **kwargs)
+    return True
+
+
+async def edit(query, text, reply_markup=None, parse_mode=None):
+    # Edit the callback's message to text/reply_markup unless it already shows exactly that
+    msg = query.message
+    key = (query.get_bot().id, msg.chat_id, msg.message_id) if msg is not None else None
+    digest = _digest(text, parse_mode)
+    if key and _unchanged(query, key, digest, text, parse_mode, reply_markup):
+        stats['skipped'] += 1
+        await answer_once(query)
+        return False
+    try:
+        sent = await query.edit_message_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+        stats['edits'] += 1
+    except BadRequest as e:
+        if "not modified" not in str(e): raise
+        stats['not_modified'] += 1
+        await answer_once(query)
+        return False
+    if key and hasattr(sent, "text"): _remember(_last, key, (digest, sent.text))
+    return True
@@ -0,0 +1,119 @@
+import time
+from telegram.ext import CallbackQueryHandler
+import tracing
+
+# Callback-query routing. One CallbackQueryHandler per bot looks the route up in a
+# prefix trie instead of PTB trying a regex per handler. Payloads look like
+#
+#   <route>[~<version>][_<arg>[_<arg>...]]      e.g. ord_act_complete_42, del_code_A_B
+#
+# The route is the longest registered name followed by "_", "~" or the end of the data,
+# so "cats_2" finds "cats" and not "cat". Arguments are converted once with the route's
+# types and handed to the callback as context.args; the last one takes the rest of the
+# data, so strings containing "_" arrive whole. Missing trailing arguments are None.
+# A route registered with version=N only accepts payloads built with the same version
+# (see data()), so buttons left in old messages get a "button expired" answer instead of
+# being misread after their layout changed.
+
+SEP = "_"
+VER = "~"
+MAX_BYTES = 64  # Telegram's callback_data limit
+
+routers = {}  # name -> Router, for /routes
+
+
+def choice(*values):
+    # Argument type accepting only the given strings
+    def convert(raw):
+        if raw not in values: raise ValueError(raw)
+        return raw
+    return convert
+
+
+def data(name, *args, version=1):
+    payload = name + (f"{VER}{version}" if version != 1 else "") + "".join(f"{SEP}{a}" for a in args)
+    if len(payload.encode()) > MAX_BYTES: raise ValueError(f"callback data over {MAX_BYTES} bytes: {payload!r}")
+    return payload
+
+
+class Route:
+    __slots__ = ('name', 'fn', 'types', 'version', 'count', 'seconds', 'max', 'errors')
+
+    def __init__(self, name, fn, types, version):
+        self.name, self.fn, self.types, self.version = name, fn, types, version
+        self.count = self.errors = 0
+        self.seconds = self.max = 0.0
+
+    def parse(self, rest):
+        # rest: what follows the route name
+        version = 1
+        if rest.startswith(VER):
+            raw, _, tail = rest[1:].partition(SEP)
+            version, rest = int(raw), SEP + tail if tail else ""
+        if version != self.version: raise ValueError(f"version {version}")
+        if not self.types: return []
+        raw = rest[1:].split(SEP, len(self.types) - 1) if rest else []
+        return [t(r) for t, r in zip(self.types, raw)] + [None] * (len(self.types) - len(raw))
+
+
+class Router:
+    def __init__(self, name, guard=None, expired=None):
+        self.name = name
+        self.guard = guard  # fn(update) -> bool; False drops the callback
+        self.expired = expired  # async fn(update) -> answer text for unreadable payloads
+        self._trie = {}
+        self.routes = {}
+        self.stats = {'expired': 0, 'denied': 0}
+        routers[name] = self
+
+    def add(self, name, fn, *types, version=1):
+        node = self._trie
+        for ch in name: node = node.setdefault(ch, {})
+        node[None] = self.routes[name] = Route(name, fn, types, version)
+
+    def match(self, payload):
+        # (Route, index after its name) or None
+        if not isinstance(payload, str): return None
+        node, found = self._trie, None
+        for i, ch in enumerate(payload):
+            if (ch == SEP or ch == VER) and None in node: found = (node[None], i)
+            node = node.get(ch)
+            if node is None: return found
+        return (node[None], len(payload)) if None in node else found
+
+    def handler(self):
+        return CallbackQueryHandler(self.dispatch, pattern=lambda payload: self.match(payload) is not None)
+
+    async def dispatch(self, update, context):
+        query = update.callback_query
+        route, end = self.match(query.data)
+        if self.guard and not self.guard(update):
+            self.stats['denied'] += 1
+            await query.answer()
+            return
+        try: context.args = route.parse(query.data[end:])
+        except ValueError:
+            self.stats['expired'] += 1
+            await query.answer(await self.expired(update) if self.expired else "⌛ Button expired", show_alert=True)
+            return
+        start = time.perf_counter()
+        try:
+            with tracing.span("route." + route.name):
+                return await route.fn(update, context)
+        except Exception:
+            route.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            route.count += 1
+            route.seconds += elapsed
+            route.max = max(route.max, elapsed)
+
+    def report(self):
+        # Busiest routes first
+        lines = [f"{self.name}: expired {self.stats['expired']}, denied {self.stats['denied']}"]
+        for r in sorted(self.routes.values(), key=lambda r: r.count, reverse=True):
+            if not r.count: continue
+            lines.append(f"  {r.name} ×{r.count} avg {1000 * r.seconds / r.count:.0f}ms max {1000 * r.max:.0f}ms"
+                         + (f" errors {r.errors}" if r.errors else ""))
+        return "\n".join(lines)
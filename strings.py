@@ -1,116 +0,0 @@
-# Language Strings
-
-STRINGS = {
-    'en': {
-        'choose_lang': "Please choose your language / ভাষা দেখুন / لغة / زبان",
-        'welcome': "Welcome to the Bot! \nRefer friends and earn 10 TK each.",
-        'main_menu': "Main Menu",
-        'btn_shop': "🛍️ Shop",
-        'btn_profile': "👤 Profile",
-        'btn_add_balance': "💰 Add Balance",
-        'btn_refer': "👥 Refer",
-        'btn_support': "📞 Support",
-        'balance': "Your Balance: {} TK",
-        'referral_link': "Invite friends and earn 10 TK!\nYour Link: {}",
-        'profile_stats': "👤 **User Profile**\n\n🆔 ID: {}\n💰 Balance: {} TK\n👥 Total Referrals: {}\n💵 Total Earned: {} TK",
-        'new_referral': "✅ You invited a new user! +10 TK added to your wallet.",
-        'ref_bonus': 10,  # Configurable Amount
-        'insufficient_balance': "⚠️ Insufficient Balance. Please add funds or refer friends.",
-        'confirm_buy': "Are you sure you want to buy:\n**{}**\nPrice: {} TK?",
-        'btn_confirm': "✅ Confirm",
-        'btn_cancel': "❌ Cancel",
-        'order_success': "✅ Purchase Successful!\n\n{}",
-        'order_manual': "✅ Order Received! Admin will send delivery shortly.",
-        'shop_empty': "No services available right now.",
-        'out_of_stock': "❌ Out of Stock",
-        'btn_daily': "📅 Daily Check",
-        'daily_success': "✅ +10 TK Added! Come back tomorrow.",
-        'daily_fail': "⏳ Already claimed today.",
-        'coming_soon': "🚧 Coming Soon!",
-        'btn_redeem_main': "🎁 Redeem Code"
-    },
-    'bn': {
-        'choose_lang': "দয়া করে ভাষা নির্বাচন করুন:",
-        'welcome': "বটে আপনাকে স্বাগতম! \nবন্ধু রেফার করুন এবং ১০ টাকা আয় করুন।",
-        'main_menu': "প্রধান মেনু",
-        'btn_shop': "🛍️ দোকান",
-        'btn_profile': "👤 প্রোফাইল",
-        'btn_add_balance': "💰 ব্যালেন্স অ্যাড",
-        'btn_refer': "👥 রেফার",
-        'btn_support': "📞 সাপোর্ট",
-        'balance': "আপনার ব্যালেন্স: {} টাকা",
-        'referral_link': "বন্ধু রেফার করুন আর ১০ টাকা নিন!\nআপনার লিংক: {}",
-        'profile_stats': "👤 **ইউজার প্রোফাইল**\n\n🆔 আইডি: {}\n💰 ব্যালেন্স: {} টাকা\n👥 মোট রেফারেন্স: {}\n💵 মোট আয়: {} টাকা",
-        'new_referral': "✅ আপনি নতুন একজনকে ইনভাইট করেছেন! ১০ টাকা যোগ হয়েছে।",
-        'ref_bonus': 10,
-        'insufficient_balance': "⚠️ পর্যাপ্ত ব্যালেন্স নেই। দয়া করে রিচার্জ করুন অথবা রেফার করুন।",
-        'confirm_buy': "আপনি কি কিনতে নিশ্চিত:\n**{}**\nদাম: {} টাকা?",
-        'btn_confirm': "✅ নিশ্চিত",
-        'btn_cancel': "❌ বাতিল",
-        'order_success': "✅ ক্রয় সফল হয়েছে!\n\n{}",
-        'order_manual': "✅ অর্ডার গ্রহণ করা হয়েছে! এডমিন শীঘ্রই ডেলিভারি দিবে।",
-        'shop_empty': "কোনো সার্ভিস বর্তমানে নেই।",
-        'out_of_stock': "❌ স্টক নেই",
-        'btn_daily': "📅 ডেইলি চেক",
-        'daily_success': "✅ ১০ টাকা যোগ হয়েছে! আগামীকাল আবার আসুন।",
-        'daily_fail': "⏳ আজকের বোনাস নিয়ে ফেলেছেন।",
-        'coming_soon': "🚧 শীঘ্রই আসছে!",
-        'btn_redeem_main': "🎁 রেডিম কোড"
-    },
-    'ar': {
-        'choose_lang': "يرجى اختيار اللغة:",
-        'welcome': "أهلاً بك في البوت! \nقم بدعوة الأصدقاء واكسب 10 TK لكل شخص.",
-        'main_menu': "القائمة الرئيسية",
-        'btn_shop': "🛍️ المتجر",
-        'btn_profile': "👤 الملف الشخصي",
-        'btn_add_balance': "💰 إضافة رصيد",
-        'btn_refer': "👥 دعوة الأصدقاء",
-        'btn_support': "📞 الدعم",
-        'balance': "رصيدك: {} TK",
-        'referral_link': "قم بدعوة الأصدقاء واكسب 10 TK!\nرابطك: {}",
-        'profile_stats': "👤 **الملف الشخصي**\n\n🆔 المعرف: {}\n💰 الرصيد: {} TK\n👥 عدد الدعوات: {}\n💵 إجمالي الربح: {} TK",
-        'new_referral': "✅ لقد دعوت مستخدمًا جديدًا! تمت إضافة 10 TK إلى محفظتك.",
-        'ref_bonus': 10,
-        'insufficient_balance': "⚠️ رصيد غير كافٍ. يرجى إضافة رصيد أو دعوة الأصدقاء.",
-        'confirm_buy': "هل أنت متأكد أنك تريد شراء:\n**{}**\nالسعر: {} TK؟",
-        'btn_confirm': "✅ تأكيد",
-        'btn_cancel': "❌ إلغاء",
-        'order_success': "✅ تم الشراء بنجاح!\n\n{}",
-        'order_manual': "✅ تم استلام الطلب! سيرسل المسؤول التسليم قريبًا.",
-        'shop_empty': "لا توجد خدمات متاحة حاليًا.",
-        'out_of_stock': "❌ نفذت الكمية",
-        'btn_daily': "📅 تسجيل يومي",
-        'daily_success': "✅ تمت إضافة 10 TK! عد غدا.",
-        'daily_fail': "⏳ لقد حصلت على المكافأة اليوم.",
-        'coming_soon': "🚧 قريبا!",
-        'btn_redeem_main': "🎁 استرداد الرمز"
-    },
-    'ur': {
-        'choose_lang': "براہ کرم اپنی زبان منتخب کریں:",
-        'welcome': "بوٹ میں خوش آمدید! \nدوستوں کو ریفر کریں اور 10 TK کمائیں۔",
-        'main_menu': "مین مینو",
-        'btn_shop': "🛍️ دکان",
-        'btn_profile': "👤 پروفائل",
-        'btn_add_balance': "💰 بیلنس شامل کریں",
-        'btn_refer': "👥 ریفر کریں",
-        'btn_support': "📞 سپورٹ",
-        'balance': "آپ کا بیلنس: {} TK",
-        'referral_link': "دوستوں کو مدعو کریں اور 10 TK کمائیں!\nآپ کا لنک: {}",
-        'profile_stats': "👤 **صارف پروفائل**\n\n🆔 آئی ڈی: {}\n💰 بیلنس: {} TK\n👥 کل ریفرل: {}\n💵 کل کمائی: {} TK",
-        'new_referral': "✅ آپ نے ایک نئے صارف کو مدعو کیا! آپ کے بٹوے میں 10 TK شامل کر دیئے گئے۔",
-        'ref_bonus': 10,
-        'insufficient_balance': "⚠️ بیلنس ناکافی ہے۔ براہ کرم فنڈز شامل کریں یا دوستوں کو ریفر کریں۔",
-        'confirm_buy': "کیا آپ واقعی خریدنا چاہتے ہیں:\n**{}**\nقیمت: {} TK؟",
-        'btn_confirm': "✅ تصدیق کریں",
-        'btn_cancel': "❌ منسوخ کریں",
-        'order_success': "✅ خریداری کامیاب!\n\n{}",
-        'order_manual': "✅ آرڈر موصول ہوگیا! ایڈمن جلد ہی ڈیلیوری بھیجے گا۔",
-        'shop_empty': "فی الحال کوئی خدمات دستیاب نہیں ہیں۔",
-        'out_of_stock': "❌ اسٹاک ختم",
-        'btn_daily': "📅 روزانہ چیک",
-        'daily_success': "✅ 10 TK شامل کر دیا گیا! کل واپس آنا.",
-        'daily_fail': "⏳ آپ آج کلیم کر چکے ہیں۔",
-        'coming_soon': "🚧 جلد آرہا ہے!",
-        'btn_redeem_main': "🎁 کوڈ استعمال کریں"
-    }
-}
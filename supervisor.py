@@ -0,0 +1,317 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+from queue import Empty
+from aiohttp import web
+from telegram import Bot, Update
+from telegram.ext import ApplicationBuilder
+from telegram.request import HTTPXRequest
+from config import USER_BOT_TOKEN, ADMIN_BOT_TOKEN, WORKERS, WORKER_STOP_SECONDS, WORKER_EXIT_SECONDS, READY_MAX_POLL_AGE, READY_MAX_QUEUE
+from update_processor import build_processor
+from readiness import Readiness, backlog
+import ratelimit
+import tenants
+import topup
+from tracing import TracingRequest
+
+# Multi-process mode (WORKERS > 1):
+#   supervisor  - polls the user bot, routes every update to worker user_id % WORKERS,
+#                 serves the health endpoint and restarts dead workers
+#   worker N    - user-bot Application without an Updater, fed from its own queue
+#   admin       - admin-bot Application (polling) plus the notification outbox
+# All processes share the SQLite file in WAL mode. Updates of one user always land on
+# the same worker and are fed in order, so per-user ordering and ConversationHandler
+# state are preserved. Send SIGHUP to the supervisor for a rolling worker restart.
+#
+# Stopping a worker never kills it: one killed inside queue.get() would take the queue's
+# lock with it and wedge its replacement. It gets a stop marker (its pid) behind the
+# pending updates and WORKER_STOP_SECONDS to handle them; then SIGTERM, on which it stops
+# reading, logs what it drops and exits. GET /ready covers the workers (alive, queue
+# depth), the admin process, polling and the database.
+
+_ctx = multiprocessing.get_context("spawn")
+
+
+def _request():
+    return TracingRequest(connection_pool_size=8, connect_timeout=60, read_timeout=60, write_timeout=60)
+
+
+def update_user_id(data):
+    # Sender of a serialized update (message.from, callback_query.from, poll_answer.user, ...)
+    for key, payload in data.items():
+        if not isinstance(payload, dict): continue
+        user = payload.get('from') or payload.get('user')
+        if user: return user['id']
+        chat = payload.get('chat') or payload.get('message', {}).get('chat')
+        if chat: return chat['id']
+    return 0
+
+
+def shard_for(user_id, workers):
+    return user_id % workers
+
+
+# --- Child Processes ---
+async def _worker_main(index, queue):
+    from user_bot import setup_user_bot
+    import maintenance
+    import tenants
+
+    db = tenants.default().db
+    app = ApplicationBuilder().token(USER_BOT_TOKEN).request(_request()).updater(None) \
+        .rate_limiter(ratelimit.for_token(USER_BOT_TOKEN, WORKERS + 1)).concurrent_updates(build_processor("user")).build()
+    setup_user_bot(app)
+    maintenance.schedule(app.job_queue, db, maintenance.LOCAL_JOBS)
+    await app.initialize()
+    await app.start()
+    print(f"👷 Worker {index} ready (pid {os.getpid()})")
+
+    loop = asyncio.get_running_loop()
+    urgent = asyncio.Event()  # SIGTERM: the supervisor stopped waiting for the queue
+    loop.add_signal_handler(signal.SIGTERM, urgent.set)
+    try:
+        while not urgent.is_set():
+            # Short waits so the queue's lock is never held when we leave
+            try: data = await loop.run_in_executor(None, queue.get, True, 0.5)
+            except Empty: continue
+            if isinstance(data, int):
+                # Stop marker: everything queued before it has been fed. One meant for an
+                # earlier worker (which left on SIGTERM before reading it) is skipped.
+                if data == os.getpid(): break
+                continue
+            await app.update_queue.put(Update.de_json(data, app.bot))
+    finally:
+        stopping = asyncio.ensure_future(app.stop())  # drains app.update_queue first
+        told = asyncio.ensure_future(urgent.wait())
+        await asyncio.wait([stopping, told], return_when=asyncio.FIRST_COMPLETED)
+        told.cancel()
+        if not stopping.done():
+            # Nothing is reading the queue any more, so leaving now can't harm it
+            print(f"⚠️ Worker {index} stopped before finishing, {backlog(app)} update(s) dropped")
+            os._exit(1)
+        await app.shutdown()
+        print(f"👷 Worker {index} stopped")
+
+
+def run_worker(index, queue):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor coordinates shutdown
+    asyncio.run(_worker_main(index, queue))
+
+
+async def _admin_main():
+    from admin_bot import setup_admin_bot
+    from outbox import OutboxWorker
+    import maintenance
+    import tenants
+
+    db = tenants.default().db
+    admin_app = ApplicationBuilder().token(ADMIN_BOT_TOKEN).request(_request()) \
+        .rate_limiter(ratelimit.for_token(ADMIN_BOT_TOKEN)).concurrent_updates(build_processor("admin")).build()
+    setup_admin_bot(admin_app)
+    maintenance.schedule(admin_app.job_queue, db)
+    await admin_app.initialize()
+    await admin_app.start()
+    await admin_app.updater.start_polling(allowed_updates=True)
+
+    # The outbox is drained here only, so a notification is never sent by two processes.
+    # Workers and this process share the user bot's rate, each gets 1/(WORKERS + 1) of it.
+    user_bot = ratelimit.bot(USER_BOT_TOKEN, WORKERS + 1, request=_request())
+    await user_bot.initialize()
+    outbox_task = asyncio.create_task(OutboxWorker(db, {'user': user_bot, 'admin': admin_app.bot}).run())
+    print(f"👑 Admin process ready (pid {os.getpid()})")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        outbox_task.cancel()
+        await admin_app.updater.stop()
+        await admin_app.stop()
+        await admin_app.shutdown()
+        await user_bot.shutdown()
+
+
+def run_admin():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_admin_main())
+
+
+# --- Supervisor ---
+class Supervisor:
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self.queues = [_ctx.Queue() for _ in range(workers)]
+        self.procs = [None] * workers
+        self.admin = None
+        self.routed = [0] * workers
+        self.restarts = [0] * workers
+        self._restarting = set()
+        self._stopping = False
+        self.polled_at = None  # monotonic time of the last successful getUpdates
+        self.readiness = Readiness()
+
+    def _spawn(self, index):
+        proc = _ctx.Process(target=run_worker, args=(index, self.queues[index]), name=f"worker-{index}", daemon=True)
+        proc.start()
+        self.procs[index] = proc
+
+    def _spawn_admin(self):
+        self.admin = _ctx.Process(target=run_admin, name="admin", daemon=True)
+        self.admin.start()
+
+    async def _stop_worker(self, index, timeout=WORKER_STOP_SECONDS):
+        proc = self.procs[index]
+        if not proc or not proc.is_alive(): return
+        loop = asyncio.get_running_loop()
+        self.queues[index].put(proc.pid)
+        await loop.run_in_executor(None, proc.join, timeout)
+        if proc.is_alive():
+            print(f"⚠️ Worker {index} still busy after {timeout:g}s, telling it to stop now")
+            os.kill(proc.pid, signal.SIGTERM)
+            await loop.run_in_executor(None, proc.join, WORKER_EXIT_SECONDS)
+            if proc.is_alive(): print(f"⚠️ Worker {index} (pid {proc.pid}) did not exit")
+
+    def _unhandled(self, index):
+        # Update ids still queued for a worker once it is gone (shutdown only: after a
+        # restart the replacement reads them)
+        ids = []
+        while True:
+            try: data = self.queues[index].get_nowait()
+            except Empty: return ids
+            if isinstance(data, dict): ids.append(data.get('update_id'))
+
+    def _depth(self, index):
+        try: return self.queues[index].qsize()
+        except NotImplementedError: return None  # macOS
+
+    async def restart_worker(self, index, timeout=WORKER_STOP_SECONDS):
+        # The replacement only starts reading the (shared) queue after the old worker
+        # left it, so ordering holds.
+        self._restarting.add(index)
+        try:
+            await self._stop_worker(index, timeout)
+            self.restarts[index] += 1
+            self._spawn(index)
+        finally:
+            self._restarting.discard(index)
+
+    async def rolling_restart(self):
+        for i in range(self.workers):
+            await self.restart_worker(i)
+
+    async def _watch(self):
+        while not self._stopping:
+            for i, proc in enumerate(self.procs):
+                if i not in self._restarting and not proc.is_alive():
+                    print(f"⚠️ Worker {i} exited ({proc.exitcode}), restarting")
+                    self.restarts[i] += 1
+                    self._spawn(i)
+            if not self.admin.is_alive():
+                print(f"⚠️ Admin process exited ({self.admin.exitcode}), restarting")
+                self._spawn_admin()
+            await asyncio.sleep(1)
+
+    async def _poll(self):
+        bot = Bot(USER_BOT_TOKEN, get_updates_request=HTTPXRequest(read_timeout=60))
+        await bot.initialize()
+        offset = None
+        try:
+            while not self._stopping:
+                try:
+                    updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+                except Exception as e:
+                    print(f"⚠️ getUpdates failed: {e}")
+                    await asyncio.sleep(3)
+                    continue
+                self.polled_at = time.monotonic()
+                for u in updates:
+                    data = u.to_dict()
+                    i = shard_for(update_user_id(data), self.workers)
+                    self.queues[i].put(data)
+                    self.routed[i] += 1
+                    offset = u.update_id + 1
+        finally:
+            # Confirm what was already routed so a restart doesn't replay it
+            if offset is not None:
+                try: await bot.get_updates(offset=offset, timeout=0)
+                except Exception: pass
+            await bot.shutdown()
+
+    async def _health(self, request):
+        alive = [p.is_alive() for p in self.procs]
+        text = (f"Bot is alive! workers={sum(alive)}/{self.workers} admin={self.admin.is_alive()}\n"
+                f"routed={self.routed} restarts={self.restarts}")
+        for i, proc in enumerate(self.procs):
+            text += f"\nworker {i}: alive={proc.is_alive()} pid={proc.pid} queued={self._depth(i)}"
+        return web.Response(text=text)
+
+    def _worker_check(self, index):
+        def check():
+            proc, depth = self.procs[index], self._depth(index)
+            ok = proc.is_alive() and (depth or 0) <= READY_MAX_QUEUE
+            state = f"alive pid {proc.pid}" if proc.is_alive() else f"exited ({proc.exitcode})"
+            return ok, f"{state}, queued {depth}, restarts {self.restarts[index]}"
+        return check
+
+    def _poll_check(self):
+        age = None if self.polled_at is None else time.monotonic() - self.polled_at
+        return (age is not None and age <= READY_MAX_POLL_AGE,
+                f"last getUpdates {'never' if age is None else f'{age:.0f}s ago'}")
+
+    async def _ready(self, request):
+        ok, lines = await self.readiness.check()
+        return web.Response(text="\n".join(lines), status=200 if ok else 503)
+
+    async def _topup(self, request):
+        # Payment callbacks are applied here; the admin process's outbox sends the notices
+        status, text = await topup.handle(tenants.default(), await request.read(), request.headers.get('X-Signature'))
+        return web.Response(text=text, status=status)
+
+    async def run(self):
+        for i in range(self.workers): self._spawn(i)
+        self._spawn_admin()
+        self.readiness.add_db('db', tenants.default().db)
+        for i in range(self.workers): self.readiness.add_check(f"worker {i}", self._worker_check(i))
+        self.readiness.add_check('admin', lambda: (self.admin.is_alive(), "alive" if self.admin.is_alive() else f"exited ({self.admin.exitcode})"))
+        self.readiness.add_check('polling', self._poll_check)
+
+        app = web.Application()
+        app.add_routes([web.get('/', self._health), web.get('/ready', self._ready), web.post('/topup', self._topup)])
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '0.0.0.0', int(os.environ.get("PORT", 8080))).start()
+
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.rolling_restart()))
+
+        tasks = [asyncio.create_task(self._poll()), asyncio.create_task(self._watch())]
+        self.readiness.state = 'ready'
+        print(f"✅ Supervisor running {self.workers} workers + admin (pid {os.getpid()})")
+        await stop.wait()
+
+        print("🛑 Stopping workers...")
+        self.readiness.state = 'draining'
+        self._stopping = True
+        for t in tasks: t.cancel()
+        await asyncio.gather(*(self._stop_worker(i) for i in range(self.workers)))
+        for i in range(self.workers):
+            ids = self._unhandled(i)
+            if ids: print(f"⚠️ {len(ids)} update(s) routed to worker {i} were never handled: {ids[:20]}")
+        self.admin.terminate()  # SIGTERM: the admin process stops its bot and outbox itself
+        self.admin.join(10)
+        await runner.cleanup()
+
+
+def run():
+    asyncio.run(Supervisor().run())
+
+
+if __name__ == "__main__":
+    run()
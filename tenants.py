@@ -0,0 +1,147 @@
+import contextvars
+import json
+import os
+import re
+from config import USER_BOT_TOKEN, ADMIN_BOT_TOKEN, ADMIN_IDS, DB_PATH, TENANTS_FILE, TENANTS_DIR, TOPUP_SECRET
+from database import Database
+from leaderboard import Leaderboard
+from tracing import TracingRequest
+import topup
+
+# Tenants: the shops served by this process. Each one has its own user/admin bot pair,
+# database file (settings, archive and backups follow it), admin list and leaderboard;
+# the web server, HTTP connection pool and event loop are shared.
+#
+# Without TENANTS_FILE there is one tenant, "default", built from config.py. With it, the
+# file is a JSON list, re-read by main.py at runtime (tenants are started, stopped or
+# restarted to match it):
+#
+#   [{"name": "shop1", "user_token": "123:abc", "admin_token": "456:def",
+#     "admin_ids": [6787688428], "db_path": "tenants/shop1.db", "topup_secret": "..."}, ...]
+#
+# db_path defaults to TENANTS_DIR/<name>.db, topup_secret to TOPUP_SECRET. Handlers keep
+# using the module-level `db` of user_bot/admin_bot: it is a Proxy for the tenant of the
+# update being handled, which bind() takes from the Application's bot_data before any
+# other handler runs.
+
+_current = contextvars.ContextVar("tenant", default=None)
+_default = None
+
+registry = {}  # name -> Tenant served by this process
+
+
+class Tenant:
+    def __init__(self, name, user_token, admin_token, admin_ids=(), db_path=DB_PATH, topup_secret=TOPUP_SECRET):
+        self.name = name
+        self.user_token = user_token
+        self.admin_token = admin_token
+        self.admin_ids = frozenset(admin_ids)
+        self.topup_secret = topup_secret
+        self.db = Database(db_path)
+        self.board = Leaderboard()
+        self.board.attach(self.db)
+        self.topup = topup.Ingester(self.db)
+        self.apps = {}  # 'user' / 'admin' -> Application
+        self.outbox = self.outbox_task = None
+
+    @property
+    def prefix(self):
+        # Names of routers, traces and job stats; the single-shop setup keeps the plain ones
+        return "" if self.name == "default" else f"{self.name}/"
+
+    def label(self, kind):
+        return self.prefix + kind
+
+    def spec(self):
+        # What the tenants file says about it; a change means a restart
+        return {'user_token': self.user_token, 'admin_token': self.admin_token,
+                'admin_ids': sorted(self.admin_ids), 'db_path': self.db.db_path, 'topup_secret': self.topup_secret}
+
+
+def default():
+    global _default
+    if _default is None:
+        _default = Tenant("default", USER_BOT_TOKEN, ADMIN_BOT_TOKEN, ADMIN_IDS, DB_PATH)
+    return _default
+
+
+def current():
+    # Tenant of the update / job being handled; the config one outside of any
+    return _current.get() or default()
+
+
+def bind(context):
+    # Make the Application's tenant current for the rest of this update or job
+    tenant = context.application.bot_data.get('tenant')
+    if tenant is not None: _current.set(tenant)
+    return tenant
+
+
+async def bind_handler(update, context):
+    # Group -100 TypeHandler: runs before every other handler of the update
+    bind(context)
+
+
+class Proxy:
+    # Module-level stand-in for an attribute of the current tenant, e.g. user_bot.db
+    __slots__ = ('_attr',)
+
+    def __init__(self, attr):
+        self._attr = attr
+
+    def __getattr__(self, name):
+        return getattr(getattr(current(), self._attr), name)
+
+
+# --- Tenants file ---
+def load(path=TENANTS_FILE):
+    # name -> spec; ValueError when the file is unusable (the running tenants stay as they are)
+    if not path:
+        return {'default': default().spec()}
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    if not isinstance(entries, list): raise ValueError("tenants file must hold a JSON list")
+    specs, tokens, files = {}, set(), set()
+    for e in entries:
+        name = str(e.get('name', ''))
+        if not re.fullmatch(r"[A-Za-z0-9_-]{1,32}", name) or name == "default":
+            raise ValueError(f"bad tenant name {name!r}")
+        if name in specs: raise ValueError(f"tenant {name} listed twice")
+        spec = {'user_token': e.get('user_token'), 'admin_token': e.get('admin_token'),
+                'admin_ids': sorted(int(i) for i in e.get('admin_ids', [])),
+                'db_path': e.get('db_path') or os.path.join(TENANTS_DIR, f"{name}.db"),
+                'topup_secret': e.get('topup_secret', TOPUP_SECRET)}
+        if not spec['user_token'] or not spec['admin_token']: raise ValueError(f"tenant {name} needs both tokens")
+        # Backups are named after the database file, so file names must differ too
+        stem = os.path.splitext(os.path.basename(spec['db_path']))[0]
+        if {spec['user_token'], spec['admin_token']} & tokens or stem in files or spec['user_token'] == spec['admin_token']:
+            raise ValueError(f"tenant {name} shares a token or database file")
+        tokens.update((spec['user_token'], spec['admin_token']))
+        files.add(stem)
+        specs[name] = spec
+    return specs
+
+
+def create(name, spec):
+    if name == "default": return default()
+    os.makedirs(os.path.dirname(spec['db_path']) or ".", exist_ok=True)
+    return Tenant(name, spec['user_token'], spec['admin_token'], spec['admin_ids'], spec['db_path'], spec['topup_secret'])
+
+
+# --- Shared HTTP pool ---
+class SharedRequest(TracingRequest):
+    # One connection pool for the API calls of every bot in the process. Each bot
+    # initializes and shuts down its request; the pool closes with the last one.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._users = 0
+
+    async def initialize(self):
+        self._users += 1
+        await super().initialize()
+
+    async def shutdown(self):
+        self._users -= 1
+        if self._users <= 0:
+            self._users = 0
+            await super().shutdown()
@@ -0,0 +1,101 @@
+import asyncio
+import hashlib
+import hmac
+import json
+from config import TOPUP_PAY_URL, TOPUP_QUEUE_SIZE, TOPUP_BATCH_SIZE, TOPUP_REPLY_SECONDS
+import i18n
+
+# Balance top-ups. A user picks an amount and gets an invoice (Database.create_invoice),
+# pays it at the provider (TOPUP_PAY_URL), and the provider POSTs a signed callback to
+# /topup (/topup/<tenant> in multi-tenant mode, see tenants.py):
+#
+#   {"id": "evt_123", "invoice": "9f2c0a...", "amount": 100, "status": "paid"}
+#   X-Signature: hex HMAC-SHA256 of the raw body, keyed with the shop's TOPUP_SECRET
+#
+# "id" is the idempotency key: a callback whose id was seen before is acknowledged and
+# changes nothing, and an invoice is credited once whatever ids its callbacks carry.
+# Callbacks are queued and applied in batches, one transaction each
+# (Database.apply_payments); a callback is answered once its batch is committed, so a 200
+# means the credit is durable and anything else makes the provider retry. The user is
+# told through the outbox. topup_stub.py plays the provider locally.
+
+
+class Busy(Exception):
+    pass
+
+
+def sign(secret, body):
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def pay_url(invoice_id, amount):
+    return TOPUP_PAY_URL.format(invoice=invoice_id, amount=amount) if TOPUP_PAY_URL else None
+
+
+def notices(credited):
+    # Outbox rows for credited payments [(user_id, amount, invoice_id, balance, lang)]
+    return [('user', uid, i18n.t(lang, 'topup_credited', amount, balance)) for uid, amount, _, balance, lang in credited]
+
+
+def parse(body):
+    # (payment_id, invoice_id, amount, status); ValueError/KeyError/TypeError when malformed
+    data = json.loads(body)
+    payment_id, invoice_id = str(data['id']), str(data['invoice'])
+    if not payment_id or len(payment_id) > 128 or len(invoice_id) > 64: raise ValueError("bad id")
+    return payment_id, invoice_id, int(data['amount']), str(data.get('status', 'paid'))
+
+
+class Ingester:
+    # One per shop database. Callbacks wait in a bounded queue; a pump task applies what has
+    # queued up while the previous batch was being written, so batches grow with the load.
+    def __init__(self, db, queue_size=TOPUP_QUEUE_SIZE, batch_size=TOPUP_BATCH_SIZE):
+        self.db = db
+        self.batch_size = batch_size
+        self.queue = asyncio.Queue(queue_size)
+        self._pump_task = None
+        self.stats = {'received': 0, 'credited': 0, 'duplicate': 0, 'rejected': 0, 'busy': 0, 'batches': 0, 'errors': 0}
+
+    def depth(self):
+        return self.queue.qsize()
+
+    async def submit(self, payment, timeout=TOPUP_REPLY_SECONDS):
+        # Result of apply_payments for this payment, 'error' if its batch failed
+        fut = asyncio.get_running_loop().create_future()
+        try: self.queue.put_nowait((payment, fut))
+        except asyncio.QueueFull:
+            self.stats['busy'] += 1
+            raise Busy()
+        self.stats['received'] += 1
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        # A caller that gives up leaves the payment queued; the provider's retry is a duplicate
+        return await asyncio.wait_for(asyncio.shield(fut), timeout)
+
+    async def _pump(self):
+        while not self.queue.empty():
+            batch = [self.queue.get_nowait() for _ in range(min(self.batch_size, self.queue.qsize()))]
+            try:
+                results = await self.db.apply_payments([p for p, _ in batch], notices)
+                self.stats['batches'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"⚠️ Top-up batch of {len(batch)} failed: {e}")
+                results = ['error'] * len(batch)
+            for (_, fut), result in zip(batch, results):
+                key = result if result in ('credited', 'duplicate') else 'rejected'
+                if result != 'error': self.stats[key] += 1
+                if not fut.done(): fut.set_result(result)
+
+
+async def handle(tenant, body, signature):
+    # (HTTP status, text) for a provider callback to this tenant
+    if not tenant.topup_secret: return 503, "top-ups disabled"
+    if not hmac.compare_digest(sign(tenant.topup_secret, body), signature or ""): return 401, "bad signature"
+    try: payment = parse(body)
+    except (ValueError, KeyError, TypeError): return 400, "bad payload"
+    try: result = await tenant.topup.submit(payment)
+    except Busy: return 503, "busy"
+    except asyncio.TimeoutError: return 503, "timeout"
+    if result == 'error': return 500, "error"
+    # Rejections are final too: a retry would get the same answer
+    return 200, result
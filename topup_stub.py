@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import collections
+import json
+import random
+import sqlite3
+import sys
+import time
+import aiohttp
+from config import DB_PATH, TOPUP_SECRET
+from database import Database
+import topup
+
+# Stand-in for the payment provider, for local testing of the /topup callback route.
+#
+#   python topup_stub.py pay INVOICE AMOUNT [--repeat N]   "pay" an invoice (N deliveries of the same callback)
+#   python topup_stub.py burst --users 300 --dup 3         invoices for up to 300 users, each paid
+#                                                          with 3 deliveries of its callback, all at
+#                                                          once; then checks every invoice was credited once
+#
+# Run the bot with the same TOPUP_SECRET; --url points at its web server (PORT).
+
+
+def _callback(invoice_id, amount, event_id=None):
+    return json.dumps({'id': event_id or f"evt_{random.getrandbits(48):012x}", 'invoice': invoice_id,
+                       'amount': amount, 'status': 'paid'}).encode()
+
+
+async def _post(session, url, secret, body):
+    try:
+        async with session.post(url, data=body, headers={'X-Signature': topup.sign(secret, body),
+                                                         'Content-Type': 'application/json'}) as resp:
+            return resp.status, await resp.text()
+    except aiohttp.ClientError as e:
+        return None, type(e).__name__
+
+
+async def pay(args):
+    body = _callback(args.invoice, args.amount)
+    async with aiohttp.ClientSession() as session:
+        for _ in range(args.repeat):
+            print(*await _post(session, args.url, args.secret, body))
+
+
+async def burst(args):
+    db = Database(args.db)
+    users = (await db.get_all_users_ids())[:args.users]
+    if not users:
+        print("No users in the database.")
+        return 1
+    invoices = [(await db.create_invoice(uid, args.amount, 'en', 3600), uid) for uid in users]
+    # Retries repeat the same event id
+    bodies = [body for invoice_id, _ in invoices for body in [_callback(invoice_id, args.amount)] * args.dup]
+    random.shuffle(bodies)
+
+    start = time.perf_counter()
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        results = await asyncio.gather(*(_post(session, args.url, args.secret, b) for b in bodies))
+    elapsed = time.perf_counter() - start
+    counts = collections.Counter(f"{status} {text}" for status, text in results)
+    print(f"{len(bodies)} callbacks in {elapsed:.2f}s ({len(bodies) / elapsed:.0f}/s)")
+    for outcome, n in counts.most_common():
+        print(f"  {outcome}: {n}")
+
+    # Every invoice exactly one ledger credit
+    con = sqlite3.connect(args.db)
+    try:
+        marks = ",".join("?" * len(invoices))
+        credits = dict(con.execute(f"SELECT ref, COUNT(*) FROM ledger WHERE type = 'topup' AND ref IN ({marks}) GROUP BY ref",
+                                   [i for i, _ in invoices]).fetchall())
+    finally:
+        con.close()
+    wrong = {i: credits.get(i, 0) for i, _ in invoices if credits.get(i, 0) != 1}
+    print("✅ every invoice credited once" if not wrong else f"❌ {len(wrong)} invoice(s) credited != 1: {list(wrong.items())[:5]}")
+    return 1 if wrong else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local payment provider stub")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("pay"); p.add_argument("invoice"); p.add_argument("amount", type=int)
+    p.add_argument("--repeat", type=int, default=1)
+    p = sub.add_parser("burst"); p.add_argument("--users", type=int, default=100)
+    p.add_argument("--dup", type=int, default=2); p.add_argument("--amount", type=int, default=100)
+    p.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--url", default="http://127.0.0.1:8080/topup")
+    parser.add_argument("--secret", default=TOPUP_SECRET)
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args(argv)
+    if not args.secret:
+        print("Set TOPUP_SECRET (or pass --secret) to the bot's value.")
+        return 1
+    return asyncio.run(pay(args) if args.cmd == "pay" else burst(args)) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
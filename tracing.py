@@ -0,0 +1,222 @@
+import asyncio
+import collections
+import contextvars
+import functools
+import inspect
+import json
+import os
+import random
+import socket
+import time
+from telegram import Update
+from telegram.request import HTTPXRequest
+from config import TRACE_SAMPLE_RATE, TRACE_SLOW_MS, TRACE_FILE, TRACE_COLLECTOR, TRACE_KEEP, TRACE_MAX_SPANS
+
+# Per-update tracing. The update processor opens a trace around each update; Database
+# methods and Bot API requests made while handling it become child spans. The current
+# span lives in a contextvar, so spans nest correctly across awaits and gathered tasks.
+# A trace is exported when it was sampled (TRACE_SAMPLE_RATE) or ran for TRACE_SLOW_MS
+# or longer: as a JSON line to TRACE_FILE and/or a UDP datagram to TRACE_COLLECTOR.
+#
+#   {"trace": "9f..", "name": "user cb:confirm_buy_yes", "user": 42, "at": 1760000000.1, "ms": 812.4,
+#    "spans": [["db.place_order", null, 3.1, 12.7, null], ["api.sendMessage", null, 16.0, 790.2, null]]}
+#
+# Each span is [name, parent index, start offset ms, duration ms, error type].
+
+ENABLED = TRACE_SAMPLE_RATE > 0 or TRACE_SLOW_MS > 0
+
+_current = contextvars.ContextVar("trace_span", default=None)  # (Trace, span index or None)
+recent = collections.deque(maxlen=TRACE_KEEP)  # exported traces of this process
+stats = {'traces': 0, 'exported': 0, 'export_errors': 0}
+
+_collector = None
+if TRACE_COLLECTOR:
+    host, _, port = TRACE_COLLECTOR.rpartition(":")
+    _collector = (host or "127.0.0.1", int(port))
+
+
+class Trace:
+    __slots__ = ('id', 'name', 'user', 'at', 't0', 'ms', 'sampled', 'spans', 'dropped')
+
+    def __init__(self, name, user=None, sampled=False):
+        self.id = f"{random.getrandbits(64):016x}"
+        self.name = name
+        self.user = user
+        self.at = time.time()
+        self.t0 = time.perf_counter()
+        self.ms = None
+        self.sampled = sampled
+        self.spans = []
+        self.dropped = 0
+
+    def to_dict(self):
+        data = {'trace': self.id, 'name': self.name, 'user': self.user, 'at': round(self.at, 3),
+                'ms': self.ms, 'spans': self.spans}
+        if self.dropped: data['dropped'] = self.dropped
+        return data
+
+
+class span:
+    # `with span("name"):` - a child of the current span; a no-op outside a trace
+    __slots__ = ('name', 'trace', 'index', 'start', 'token')
+
+    def __init__(self, name):
+        self.name = name
+        self.token = None
+
+    def __enter__(self):
+        cur = _current.get()
+        if cur is None: return self
+        trace, parent = cur
+        if len(trace.spans) >= TRACE_MAX_SPANS:
+            trace.dropped += 1
+            return self
+        self.trace, self.index = trace, len(trace.spans)
+        self.start = time.perf_counter()
+        trace.spans.append([self.name, parent, round((self.start - trace.t0) * 1000, 2), None, None])
+        self.token = _current.set((trace, self.index))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.token is None: return False
+        _current.reset(self.token)
+        record = self.trace.spans[self.index]
+        record[3] = round((time.perf_counter() - self.start) * 1000, 2)
+        if exc_type is not None: record[4] = exc_type.__name__
+        return False
+
+
+def traced(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if _current.get() is None: return await fn(*args, **kwargs)
+            with span(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_methods(prefix):
+    # Class decorator: every coroutine method becomes a span named prefix + method
+    def decorator(cls):
+        for attr, fn in list(vars(cls).items()):
+            if attr.startswith("__") or not inspect.iscoroutinefunction(fn): continue
+            setattr(cls, attr, traced(prefix + attr)(fn))
+        return cls
+    return decorator
+
+
+class TracingRequest(HTTPXRequest):
+    # Bot API calls made while handling an update become "api.<method>" spans
+    async def do_request(self, url, *args, **kwargs):
+        if _current.get() is None: return await super().do_request(url, *args, **kwargs)
+        with span("api." + url.rsplit("/", 1)[-1]):
+            return await super().do_request(url, *args, **kwargs)
+
+
+# --- Traces per update ---
+def describe(update):
+    if not isinstance(update, Update): return type(update).__name__
+    if update.callback_query: return f"cb:{(update.callback_query.data or '')[:40]}"
+    if update.inline_query: return "inline"
+    msg = update.effective_message
+    if msg is not None:
+        if msg.text and msg.text.startswith("/"): return msg.text.split()[0][:40]
+        if msg.document: return "document"
+        return "message"
+    return "update"
+
+
+async def run_traced(bot_name, update, coroutine):
+    # Called by the update processor around PTB's process_update coroutine
+    sampled = random.random() < TRACE_SAMPLE_RATE
+    if not sampled and TRACE_SLOW_MS <= 0:
+        return await coroutine
+    user = update.effective_user.id if isinstance(update, Update) and update.effective_user else None
+    trace = Trace(f"{bot_name} {describe(update)}", user, sampled)
+    token = _current.set((trace, None))
+    try:
+        return await coroutine
+    finally:
+        _current.reset(token)
+        finish(trace)
+
+
+def finish(trace):
+    trace.ms = round((time.perf_counter() - trace.t0) * 1000, 2)
+    stats['traces'] += 1
+    if not trace.sampled and (TRACE_SLOW_MS <= 0 or trace.ms < TRACE_SLOW_MS): return
+    data = trace.to_dict()
+    recent.append(data)
+    stats['exported'] += 1
+    if not TRACE_FILE and not _collector: return
+    line = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+    if _collector: _send_udp(line)
+    if TRACE_FILE:
+        # Blocking append off the event loop; one write() per line keeps lines whole
+        asyncio.get_running_loop().run_in_executor(None, _append, line)
+
+
+def _append(line):
+    try:
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        stats['export_errors'] += 1
+        print(f"⚠️ Trace export failed: {e}")
+
+
+_udp = None
+
+def _send_udp(line):
+    global _udp
+    try:
+        if _udp is None:
+            _udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            _udp.setblocking(False)
+        _udp.sendto(line.encode()[:65000], _collector)
+    except OSError:
+        stats['export_errors'] += 1
+
+
+# --- Reading traces back ---
+def _tail(path, max_bytes=4 * 1024 * 1024):
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - max_bytes))
+        if size > max_bytes: f.readline()  # skip the partial first line
+        for raw in f:
+            try: yield json.loads(raw)
+            except ValueError: pass
+
+
+def _slowest(n, since, prefix):
+    # The file holds traces of every process (workers, admin); memory only this one
+    if TRACE_FILE and os.path.exists(TRACE_FILE): traces = _tail(TRACE_FILE)
+    else: traces = list(recent)
+    traces = [t for t in traces if (since is None or t['at'] >= since) and t['name'].startswith(prefix)]
+    traces.sort(key=lambda t: t['ms'], reverse=True)
+    return traces[:n]
+
+
+async def slowest(n=5, since=None, prefix=""):
+    # prefix: only traces of bots whose name starts with it (one tenant, see tenants.py)
+    return await asyncio.to_thread(_slowest, n, since, prefix)
+
+
+def format_trace(trace, max_spans=10):
+    when = time.strftime("%m-%d %H:%M:%S", time.localtime(trace['at']))
+    lines = [f"{trace['ms']:.0f}ms {trace['name']} (user {trace['user']}, {when}, {trace['trace'][:8]})"]
+    spans = trace['spans']
+    # The slowest spans, in the order they started, indented by nesting depth
+    for i in sorted(sorted(range(len(spans)), key=lambda i: spans[i][3] or 0, reverse=True)[:max_spans]):
+        name, parent, offset, ms, error = spans[i]
+        d = 0
+        while parent is not None:
+            d += 1
+            parent = spans[parent][1]
+        lines.append(f"{'  ' * d}└ {name} {'?' if ms is None else f'{ms:.0f}'}ms @{offset:.0f}" + (f" ❌{error}" if error else ""))
+    if len(spans) > max_spans: lines.append(f"  … {len(spans) - max_spans} more span(s)")
+    return "\n".join(lines)
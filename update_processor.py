@@ -0,0 +1,94 @@
+import asyncio
+import time
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from config import CONCURRENT_UPDATES
+import tracing
+
+# Runs updates of different users in parallel (up to max_concurrent_updates at once)
+# while updates of the same user run one after another, in arrival order, so
+# ConversationHandler state and user_data stay consistent.
+
+
+def update_key(update):
+    if isinstance(update, Update):
+        if update.effective_user: return update.effective_user.id
+        if update.effective_chat: return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates=CONCURRENT_UPDATES, name="bot"):
+        super().__init__(max_concurrent_updates)
+        self.name = name  # labels traces
+        self._users = {}  # key -> [lock, pending updates]
+        self.waiting_user = 0   # queued behind an update of the same user
+        self.waiting_slot = 0   # queued for a free concurrency slot
+        self.running = 0
+        self.peak = 0
+        self.processed = 0
+        self.busy_seconds = 0.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    # BaseUpdateProcessor.process_update takes the concurrency slot first; we take the
+    # per-user lock first instead, so a user flooding updates waits without holding
+    # slots other users could use. Both locks are FIFO, which preserves arrival order.
+    async def process_update(self, update, coroutine):
+        key = update_key(update)
+        if key is None:
+            await self._run_slot(update, coroutine)
+            return
+        entry = self._users.get(key)
+        if entry is None:
+            entry = self._users[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.waiting_user += 1
+        try:
+            async with entry[0]:
+                self.waiting_user -= 1
+                await self._run_slot(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]: self._users.pop(key, None)
+
+    async def _run_slot(self, update, coroutine):
+        self.waiting_slot += 1
+        async with self._semaphore:
+            self.waiting_slot -= 1
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            start = time.perf_counter()
+            try:
+                await self.do_process_update(update, coroutine)
+            finally:
+                self.running -= 1
+                self.processed += 1
+                self.busy_seconds += time.perf_counter() - start
+
+    async def do_process_update(self, update, coroutine):
+        if tracing.ENABLED: await tracing.run_traced(self.name, update, coroutine)
+        else: await coroutine
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'waiting_user': self.waiting_user,
+            'waiting_slot': self.waiting_slot,
+            'active_users': len(self._users),
+            'peak': self.peak,
+            'processed': self.processed,
+            'limit': self.max_concurrent_updates,
+        }
+
+
+def build_processor(name="bot"):
+    # CONCURRENT_UPDATES <= 1 keeps PTB's default sequential processing (a limit of 1
+    # is sequential too, and keeps per-update tracing)
+    if CONCURRENT_UPDATES > 1 or tracing.ENABLED:
+        return PerUserUpdateProcessor(max(1, CONCURRENT_UPDATES), name)
+    return False
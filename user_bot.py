@@ -1,13 +1,19 @@
 
 import asyncio
 import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Bot
-from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ConversationHandler
-from database import Database
-from config import ADMIN_IDS, USER_BOT_TOKEN, ADMIN_BOT_TOKEN
-from strings import STRINGS
-
-db = Database()
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler, MessageHandler, InlineQueryHandler, TypeHandler, filters, ConversationHandler
+from config import INLINE_CACHE_SECONDS, TOPUP_AMOUNTS, TOPUP_INVOICE_MINUTES, REFERRAL_UPLINE_BONUSES, REFERRAL_TREE_DEPTH
+import catalog
+import i18n
+import render
+import router
+import tenants
+import topup
+
+# The shop of the update being handled (tenants.py)
+db = tenants.Proxy('db')
+board = tenants.Proxy('board')
 
 # Conversation States
 WAIT_INPUT = range(1)
@@ -17,20 +23,33 @@ REDEEM_CODE = range(1)
 async def get_lang(user_id):
     user = await db.get_user(user_id)
     if user and user[8]: 
-        return user[8]
+        return i18n.resolve(user[8])
     return 'en' 
 
-async def notify_admins_start(app, message):
-    admin_bot = Bot(ADMIN_BOT_TOKEN)
-    for admin_id in ADMIN_IDS:
-        try: await admin_bot.send_message(chat_id=admin_id, text=message)
-        except: pass
+async def expired_text(update):
+    # Answer for buttons whose payload no longer parses (see router.py)
+    return i18n.get(await get_lang(update.effective_user.id))['btn_expired']
+
+def admin_notices(text):
+    # Outbox rows for every admin (delivered by outbox.OutboxWorker via the admin bot)
+    return [('admin', admin_id, text) for admin_id in tenants.current().admin_ids]
+
+async def referral_rewards():
+    # TK per level: the 'ref_bonus' setting for the referrer, 'ref_upline' ("3,1") for the levels above
+    bonus = await db.get_setting('ref_bonus')
+    upline = await db.get_setting('ref_upline')
+    if upline is None: upline = REFERRAL_UPLINE_BONUSES
+    levels = [int(bonus) if bonus else 10] + [int(x) for x in upline.replace("/", ",").split(",") if x.strip()]
+    return levels[:REFERRAL_TREE_DEPTH]
+
+def referral_notices(rewarded):
+    # Outbox rows for the upline paid on a signup [(user_id, level, amount, lang)]
+    return [('user', uid, i18n.t(i18n.resolve(lang), 'referral_earned', amount) if level == 1 else
+             i18n.t(i18n.resolve(lang), 'referral_earned_level', level, amount))
+            for uid, level, amount, lang in rewarded]
 
-async def notify_admin_order(app, text, order_payload=None):
-    admin_bot = Bot(ADMIN_BOT_TOKEN)
-    for admin_id in ADMIN_IDS:
-        try: await admin_bot.send_message(chat_id=admin_id, text=text)
-        except: pass
+def low_stock_notices(name, left, level):
+    return admin_notices(f"📉 **Low Stock**\nService: {name}\nLeft: {left} (alert below {level})")
 
 # --- Handlers ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -38,45 +57,148 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     args = context.args
     referrer_id = None
     
+    # t.me/<bot>?start=svc_<id> comes from an inline search result
+    service_id = int(args[0][4:]) if args and args[0].startswith("svc_") and args[0][4:].isdigit() else None
+
     if args and args[0].isdigit():
         possible_referrer = int(args[0])
         if possible_referrer != user.id:
             referrer_id = possible_referrer
 
-    is_new = await db.add_user(user.id, user.first_name, user.username, referrer_id)
+    join_text = f"🔔 **New Member Joined**\nName: {user.first_name}\nID: `{user.id}`\nUsername: @{user.username or 'None'}\nReferrer: `{referrer_id}`"
+    # Referral rewards for the whole upline are paid in the signup transaction
+    rewards = await referral_rewards() if referrer_id else ()
+    is_new = await db.add_user(user.id, user.first_name, user.username, referrer_id, notify=admin_notices(join_text),
+                               rewards=rewards, reward_notices=referral_notices)
     
     if is_new:
         await db.set_language(user.id, 'en') 
-        await notify_admins_start(context.application, f"🔔 **New Member Joined**\nName: {user.first_name}\nID: `{user.id}`\nUsername: @{user.username or 'None'}\nReferrer: `{referrer_id}`")
-        if referrer_id:
-            ref_user = await db.get_user(referrer_id)
-            if ref_user:
-                bonus = await db.get_setting('ref_bonus')
-                amount = int(bonus) if bonus else 10
-                await db.add_referral_reward(referrer_id, amount)
-                try:
-                    msg = f"🎉 New Referral! You earned {amount} TK."
-                    await context.bot.send_message(chat_id=referrer_id, text=msg)
-                except: pass
 
+    service = await db.get_service(service_id) if service_id else None
+    if service:
+        lang = await get_lang(user.id)
+        s = i18n.get(lang)
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton(s['btn_buy'], callback_data=f"buy_{service['id']}")],
+                                         [InlineKeyboardButton(s['btn_menu'], callback_data="menu_main")]])
+        await update.message.reply_text(_service_card(s, service), reply_markup=keyboard)
+        return
     await main_menu(update, context)
 
+def _stock_text(s, service):
+    if service['type'] != 'auto': return ""
+    return s.fmt('stock_count', service['stock_count']) if service['stock_count'] > 0 else s['stock_out']
+
+def _service_card(s, service):
+    return s.fmt('inline_item', service['name'], service['price'], _stock_text(s, service), service['description'] or "")
+
+# --- Inline Search (@bot query) ---
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    iq = update.inline_query
+    lang = await get_lang(iq.from_user.id)
+    s = i18n.get(lang)
+    rows = await catalog.search(db, iq.query)
+    results = []
+    for sid, name, price, kind, stock, description in rows:
+        service = {'id': sid, 'name': name, 'price': price, 'type': kind, 'stock_count': stock, 'description': description}
+        button = InlineKeyboardButton(s['btn_buy'], url=f"https://t.me/{context.bot.username}?start=svc_{sid}")
+        results.append(InlineQueryResultArticle(
+            id=str(sid),
+            title=s.fmt('shop_item', name, price, _stock_text(s, service)),
+            description=(description or "")[:100],
+            input_message_content=InputTextMessageContent(_service_card(s, service)),
+            reply_markup=InlineKeyboardMarkup([[button]]),
+        ))
+    # Texts are in the user's language, so Telegram must cache answers per user
+    await iq.answer(results, cache_time=INLINE_CACHE_SECONDS, is_personal=True)
+
+# --- Static Keyboards (built once per language, see i18n.markup) ---
+@i18n.keyboard("lang_menu")
+def _lang_menu_kb(s):
+    langs = [InlineKeyboardButton(b.name, callback_data=f"lang_{b.code}") for b in i18n.languages()]
+    keyboard = [langs[i:i + 2] for i in range(0, len(langs), 2)]
+    keyboard.append([InlineKeyboardButton(s['btn_back'], callback_data="menu_main")])
+    return keyboard
+
+@i18n.keyboard("main_menu")
+def _main_menu_kb(s):
+    # Layout:
+    # [Daily Check]
+    # [Shop] [Profile]
+    # [Redeem] [Refer]
+    # [Add Balance] [Support]
+    # [Leaderboard] [Language]
+    return [
+        [InlineKeyboardButton(s['btn_daily'], callback_data="daily_check")],
+        [InlineKeyboardButton(s['btn_shop'], callback_data="menu_shop"), 
+         InlineKeyboardButton(s['btn_profile'], callback_data="menu_profile")],
+        [InlineKeyboardButton(s['btn_redeem_main'], callback_data="redeem_start"),
+         InlineKeyboardButton(s['btn_refer'], callback_data="menu_refer")],
+        [InlineKeyboardButton(s['btn_add_balance'], callback_data="menu_balance"), 
+         InlineKeyboardButton(s['btn_support'], url="https://t.me/developermunna")],
+        [InlineKeyboardButton(s['btn_leaderboard'], callback_data="menu_top"),
+         InlineKeyboardButton(s['btn_language'], callback_data="menu_lang")]
+    ]
+
+@i18n.keyboard("back_main")
+def _back_main_kb(s):
+    return [[InlineKeyboardButton(s['btn_back'], callback_data="menu_main")]]
+
+@i18n.keyboard("profile")
+def _profile_kb(s):
+    return [[InlineKeyboardButton(s['btn_orders'], callback_data="menu_orders")],
+            [InlineKeyboardButton(s['btn_back'], callback_data="menu_main")]]
+
+@i18n.keyboard("back_profile")
+def _back_profile_kb(s):
+    return [[InlineKeyboardButton(s['btn_back'], callback_data="menu_profile")]]
+
+@i18n.keyboard("refer")
+def _refer_kb(s):
+    return [[InlineKeyboardButton(s['btn_network'], callback_data="menu_network")],
+            [InlineKeyboardButton(s['btn_back'], callback_data="menu_main")]]
+
+@i18n.keyboard("back_refer")
+def _back_refer_kb(s):
+    return [[InlineKeyboardButton(s['btn_back'], callback_data="menu_refer")]]
+
+@i18n.keyboard("home")
+def _home_kb(s):
+    return [[InlineKeyboardButton(s['btn_menu'], callback_data="menu_main")]]
+
+@i18n.keyboard("leaderboard")
+def _leaderboard_kb(s):
+    return [
+        [InlineKeyboardButton(s['btn_lb_balance'], callback_data="top_balance"),
+         InlineKeyboardButton(s['btn_lb_referrals'], callback_data="top_referrals"),
+         InlineKeyboardButton(s['btn_lb_weekly'], callback_data="top_weekly")],
+        [InlineKeyboardButton(s['btn_back'], callback_data="menu_main")]
+    ]
+
+@i18n.keyboard("topup")
+def _topup_kb(s):
+    buttons = [InlineKeyboardButton(f"{a} TK", callback_data=f"topup_{a}") for a in TOPUP_AMOUNTS]
+    rows = [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
+    rows.append([InlineKeyboardButton(s['btn_back'], callback_data="menu_main")])
+    return rows
+
+@i18n.keyboard("confirm_buy")
+def _confirm_buy_kb(s):
+    return [[InlineKeyboardButton(s['btn_confirm'], callback_data="confirm_buy_yes"),
+             InlineKeyboardButton(s['btn_cancel'], callback_data="menu_shop")]]
+
 async def set_language_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.callback_query: msg = update.callback_query.message
     else: msg = update.message
-    keyboard = [
-        [InlineKeyboardButton("🇬🇧 English", callback_data="lang_en"), InlineKeyboardButton("🇧🇩 বাংলা", callback_data="lang_bn")],
-        [InlineKeyboardButton("🇸🇦 العربية", callback_data="lang_ar"), InlineKeyboardButton("🇵🇰 اردو", callback_data="lang_ur")],
-        [InlineKeyboardButton("⬅️ Back", callback_data="menu_main")]
-    ]
-    text = STRINGS['en']['choose_lang']
-    if update.callback_query: await msg.edit_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    else: await msg.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    lang = await get_lang(update.effective_user.id)
+    # The English prompt lists every language, so it is shown to everyone
+    text = i18n.DEFAULT['choose_lang']
+    if update.callback_query: await render.edit(update.callback_query, text, i18n.markup("lang_menu", lang))
+    else: await msg.reply_text(text, reply_markup=i18n.markup("lang_menu", lang))
 
 async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-    lang = query.data.split("_")[1]
+    await render.answer(query)
+    lang = i18n.resolve(context.args[0])
     await db.set_language(query.from_user.id, lang)
     await main_menu(update, context)
 
@@ -84,28 +206,10 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     lang = await get_lang(user_id)
-    if lang not in STRINGS: lang = 'en'
-    s = STRINGS[lang]
-    
-    # New Layout:
-    # [Daily Check]
-    # [Shop] [Profile]
-    # [Redeem] [Refer]
-    # [Add Balance] [Support]
-    
-    keyboard = [
-        [InlineKeyboardButton(s['btn_daily'], callback_data="daily_check")],
-        [InlineKeyboardButton(s['btn_shop'], callback_data="menu_shop"), 
-         InlineKeyboardButton(s['btn_profile'], callback_data="menu_profile")],
-        [InlineKeyboardButton(s['btn_redeem_main'], callback_data="redeem_start"),
-         InlineKeyboardButton(s['btn_refer'], callback_data="menu_refer")],
-        [InlineKeyboardButton(s['btn_add_balance'], callback_data="menu_balance"), 
-         InlineKeyboardButton(s['btn_support'], url="https://t.me/developermunna")],
-        [InlineKeyboardButton("🌐 Language", callback_data="menu_lang")]
-    ]
-    text = s['welcome']
-    if update.callback_query: await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    else: await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    text = i18n.get(lang)['welcome']
+    keyboard = i18n.markup("main_menu", lang)
+    if update.callback_query: await render.edit(update.callback_query, text, keyboard)
+    else: await update.message.reply_text(text, reply_markup=keyboard)
 
 # --- Daily Check Logic ---
 async def daily_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -138,19 +242,32 @@ async def daily_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
             can_claim = True
 
     if can_claim:
-        await db.update_balance(user_id, 10, add=True)
+        await db.update_balance(user_id, 10, add=True, type='daily')
         await db.update_daily_check(user_id)
-        await query.answer(STRINGS[lang]['daily_success'], show_alert=True)
+        await query.answer(i18n.get(lang)['daily_success'], show_alert=True)
     else:
-        await query.answer(STRINGS[lang]['daily_fail'], show_alert=True)
+        await query.answer(i18n.get(lang)['daily_fail'], show_alert=True)
 
 async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
     lang = await get_lang(user_id)
     user = await db.get_user(user_id)
-    stats = STRINGS[lang]['profile_stats'].format(user[0], user[3], user[5], user[6])
-    await query.edit_message_text(stats, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="menu_main")]]))
+    stats = i18n.t(lang, 'profile_stats', user[0], user[3], user[5], user[6])
+    await render.edit(query, stats, i18n.markup("profile", lang))
+
+async def my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await render.answer(query)
+    user_id = query.from_user.id
+    lang = await get_lang(user_id)
+    s = i18n.get(lang)
+    # Reads both the hot orders table and the archive
+    orders = await db.get_user_orders(user_id)
+    lines = [s.fmt('order_row', o['id'], o['service_name'] or '—', o['price'], s.texts.get(f"status_{o['status']}", o['status']))
+             for o in orders]
+    text = s['orders_title'] + "\n\n" + ("\n".join(lines) or s['orders_empty'])
+    await render.edit(query, text, i18n.markup("back_profile", lang))
 
 async def refer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -158,98 +275,154 @@ async def refer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lang = await get_lang(user_id)
     bot_username = context.bot.username
     link = f"https://t.me/{bot_username}?start={user_id}"
-    bonus = await db.get_setting('ref_bonus')
-    amount = bonus if bonus else "10"
-    text = f"👥 **Referral System**\n\nShare your link and earn {amount} TK per user!\n\nLink:\n`{link}`"
-    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="menu_main")]]))
+    s = i18n.get(lang)
+    rewards = await referral_rewards()
+    text = s.fmt('refer_text', rewards[0], link)
+    if any(rewards[1:]):
+        text += s.fmt('refer_upline', ", ".join(s.fmt('network_level_reward', level, amount)
+                                                for level, amount in enumerate(rewards[1:], 2) if amount))
+    await render.edit(query, text, i18n.markup("refer", lang), parse_mode='Markdown')
+
+async def my_network(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Users below this one per level, counted from the referral closure table
+    query = update.callback_query
+    user_id = query.from_user.id
+    lang = await get_lang(user_id)
+    s = i18n.get(lang)
+    network = await db.get_referral_network(user_id)
+    user = await db.get_user(user_id)
+    earned = user[6] if user else 0
+    if not network:
+        text = s['network_title'] + "\n\n" + s['network_empty']
+    else:
+        lines = [s.fmt('network_level', level, count) for level, count in sorted(network.items())]
+        text = s['network_title'] + "\n\n" + "\n".join(lines) + "\n\n" + s.fmt('network_total', sum(network.values()), earned)
+    await render.edit(query, text, i18n.markup("back_refer", lang), parse_mode='Markdown')
+
+# --- Leaderboard (served from memory, see leaderboard.py) ---
+async def leaderboard_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await render.answer(query)
+    user_id = query.from_user.id
+    lang = await get_lang(user_id)
+    s = i18n.get(lang)
+    name = context.args[0] if context.args else 'balance'  # menu_top / top_{board}
+    if name not in board.BOARDS: name = 'balance'
+
+    rows, valid = board.top(name)
+    if not valid:
+        # A top entry dropped out and we don't know who replaces it: one indexed query
+        await board.reconcile(db)
+        rows, _ = board.top(name)
+    names = await board.names_for(db, [uid for uid, _ in rows])
+    row_key = 'lb_row_count' if name == 'referrals' else 'lb_row_tk'
+    lines = [s.fmt(row_key, i, names[uid], score) for i, (uid, score) in enumerate(rows, 1)]
+
+    if name == 'weekly':
+        score = board.weekly.get(user_id, 0)
+    else:
+        user = await db.get_user(user_id)
+        score = user[3] if name == 'balance' else user[5]
+    rank = board.rank(name, score)
+    footer = s.fmt('lb_your_rank', rank, board.total(name)) if rank else s['lb_unranked']
+
+    text = s[f'lb_title_{name}'] + "\n\n" + ("\n".join(lines) or s['lb_empty']) + "\n\n" + footer
+    await render.edit(query, text, i18n.markup("leaderboard", lang))
 
 async def balance_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
     lang = await get_lang(user_id)
-    # Add Balance -> Coming Soon
-    # Only offer this alert
-    await query.answer(STRINGS[lang]['coming_soon'], show_alert=True)
-    # Don't change screen
+    if not tenants.current().topup_secret:
+        # No payment provider configured: only offer this alert, don't change screen
+        await query.answer(i18n.get(lang)['coming_soon'], show_alert=True)
+        return
+    await render.edit(query, i18n.get(lang)['topup_choose'], i18n.markup("topup", lang))
+
+async def topup_invoice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Invoice for the chosen amount; the balance is credited when the provider calls back (topup.py)
+    query = update.callback_query
+    user_id = query.from_user.id
+    lang = await get_lang(user_id)
+    s = i18n.get(lang)
+    amount = context.args[0]
+    if amount not in TOPUP_AMOUNTS or not tenants.current().topup_secret:
+        await query.answer(s['btn_expired'], show_alert=True)
+        return
+    invoice_id = await db.create_invoice(user_id, amount, lang, TOPUP_INVOICE_MINUTES * 60)
+    rows = []
+    url = topup.pay_url(invoice_id, amount)
+    if url: rows.append([InlineKeyboardButton(s['btn_pay'], url=url)])
+    rows.append([InlineKeyboardButton(s['btn_back'], callback_data="menu_balance")])
+    await render.edit(query, s.fmt('topup_invoice', amount, invoice_id, TOPUP_INVOICE_MINUTES), InlineKeyboardMarkup(rows))
 
 # --- Redeem Logic ---
 async def start_redeem(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.callback_query.message.reply_text("🎁 Enter your **Redeem Code**:", parse_mode='Markdown')
+    lang = await get_lang(update.effective_user.id)
+    await update.callback_query.message.reply_text(i18n.get(lang)['redeem_prompt'], parse_mode='Markdown')
     return REDEEM_CODE
 
 async def process_redeem(update: Update, context: ContextTypes.DEFAULT_TYPE):
     code = update.message.text.strip()
+    lang = await get_lang(update.effective_user.id)
+    s = i18n.get(lang)
     res = await db.use_redeem_code(code, update.effective_user.id)
     
     if res == "invalid":
-        await update.message.reply_text("❌ Invalid Code.")
+        await update.message.reply_text(s['redeem_invalid'])
     elif res == "exhausted":
-        await update.message.reply_text("❌ Code limit reached.")
+        await update.message.reply_text(s['redeem_exhausted'])
     elif res == "already_used":
-        await update.message.reply_text("❌ You have already redeemed this code.")
+        await update.message.reply_text(s['redeem_already_used'])
     else:
         # Success
-        await update.message.reply_text(f"✅ Success! Added {res} TK to your wallet.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🏠 Menu", callback_data="menu_main")]]))
+        await update.message.reply_text(s.fmt('redeem_success', res), reply_markup=i18n.markup("home", lang))
     
     return ConversationHandler.END
 
 # --- Shop Logic (Updated UI) ---
 async def shop(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # menu_shop / cats_{page} / cat_{category}_{sort}_{page}, see catalog.py
     query = update.callback_query
-    user_id = query.from_user.id
-    lang = await get_lang(user_id)
-    s = STRINGS[lang]
-    services = await db.get_services()
-    if not services:
-        await query.answer(s['shop_empty'], show_alert=True)
+    lang = await get_lang(query.from_user.id)
+    if len(context.args) == 3:
+        cat, sort, page = context.args
+        rendered = await catalog.services_page(db, lang, catalog.parse_category(cat), sort, page)
+    else:
+        page = context.args[0] if context.args else 0
+        # Without categories the shop opens straight on the service list
+        rendered = await catalog.categories_page(db, lang, page) or await catalog.services_page(db, lang, None)
+    if not rendered:
+        await query.answer(i18n.get(lang)['shop_empty'], show_alert=True)
         return
-
-    keyboard = []
-    for svc in services:
-        stock_msg = ""
-        if svc['type'] == 'auto':
-            count = await db.get_stock_count(svc['id'])
-            stock_msg = f"({count} in stock)"
-            if count == 0: stock_msg = "(❌ Stock Out)"
-        
-        # Format: Name | Price TK (Stock)
-        btn_text = f"{svc['name']} | {svc['price']} TK {stock_msg}"
-        
-        keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"buy_{svc['id']}")])
-    
-    keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="menu_main")])
-    await query.edit_message_text(s['btn_shop'], reply_markup=InlineKeyboardMarkup(keyboard))
+    await render.answer(query)
+    text, keyboard = rendered
+    await render.edit(query, text, keyboard)  # no API call when the same page is tapped again
 
 async def buy_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
     lang = await get_lang(user_id)
-    service_id = int(query.data.split("_")[1])
+    service_id = context.args[0]
     
     service = await db.get_service(service_id)
     if not service:
-        await query.answer("Service not found", show_alert=True)
+        await query.answer(i18n.get(lang)['service_not_found'], show_alert=True)
         return
 
     user = await db.get_user(user_id)
     if user[3] < service['price']:
-        await query.answer(STRINGS[lang]['insufficient_balance'], show_alert=True)
+        await query.answer(i18n.get(lang)['insufficient_balance'], show_alert=True)
         return
 
     if service['type'] == 'auto':
-        count = await db.get_stock_count(service_id)
-        if count == 0:
-            await query.answer(STRINGS[lang]['out_of_stock'], show_alert=True)
+        if service['stock_count'] <= 0:
+            await query.answer(i18n.get(lang)['out_of_stock'], show_alert=True)
             return
 
-    text = STRINGS[lang]['confirm_buy'].format(service['name'], service['price'])
+    text = i18n.t(lang, 'confirm_buy', service['name'], service['price'])
     context.user_data['buy_service'] = service
-    
-    keyboard = [
-        [InlineKeyboardButton(STRINGS[lang]['btn_confirm'], callback_data="confirm_buy_yes"),
-         InlineKeyboardButton(STRINGS[lang]['btn_cancel'], callback_data="menu_shop")]
-    ]
-    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=i18n.markup("confirm_buy", lang))
 
 async def handle_buy_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -260,7 +433,8 @@ async def handle_buy_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if service.get('question'):
         # Need Input
-        await query.edit_message_text(f"📝 **Requirement**\n\n{service['question']}\n\nPlease reply with the information:", parse_mode='Markdown')
+        lang = await get_lang(query.from_user.id)
+        await query.edit_message_text(i18n.t(lang, 'requirement_prompt', service['question']), parse_mode='Markdown')
         return WAIT_INPUT
     else:
         # Proceed standard
@@ -282,44 +456,34 @@ async def finalize_order(update: Update, context: ContextTypes.DEFAULT_TYPE, ser
         msg_method = update.message.reply_text
 
     lang = await get_lang(user_id)
-    
-    user = await db.get_user(user_id)
-    if user[3] < service['price']:
-        await msg_method(STRINGS[lang]['insufficient_balance'])
-        return
 
-    content_deliver = ""
-    order_status = "completed"
-    
-    if service['type'] == 'auto':
-        content_deliver = await db.fetch_stock_item(service['id'])
-        if not content_deliver:
-             await msg_method("Stock ran out!")
-             return
-    else:
-        content_deliver = "Manual Delivery Pending"
-        order_status = "pending"
-
-    await db.update_balance(user_id, service['price'], add=False)
-    await db.log_order(user_id, service['id'], content_deliver, service['price'], status=order_status, user_input=user_input)
-    
     if service['type'] == 'auto':
-        msg = STRINGS[lang]['order_success'].format(content_deliver)
-        await msg_method(msg)
-        await notify_admin_order(context.application, f"⚡ **Auto Service Sold**\nUser: `{user_id}`\nService: {service['name']}\nPrice: {service['price']}")
+        admin_text = f"⚡ **Auto Service Sold**\nUser: `{user_id}`\nService: {service['name']}\nPrice: {service['price']}"
     else:
-        msg = STRINGS[lang]['order_manual']
-        await msg_method(msg)
-        
         admin_text = f"🛒 **New Order Request**\nUser: `{user_id}`\nService: {service['name']}\nPrice: {service['price']}"
         if user_input: admin_text += f"\n\n📝 **User Input**: `{user_input}`"
-        await notify_admin_order(context.application, admin_text)
+
+    # Balance check, stock claim, order and admin notices are one transaction
+    order = await db.place_order(user_id, service, user_input, notify=admin_notices(admin_text), low_stock_for=low_stock_notices)
+    if order == "insufficient":
+        await msg_method(i18n.get(lang)['insufficient_balance'])
+        return
+    if order == "out_of_stock":
+        await msg_method(i18n.get(lang)['stock_ran_out'])
+        return
+
+    if order['status'] == 'completed':
+        await msg_method(i18n.t(lang, 'order_success', order['content']))
+    else:
+        await msg_method(i18n.get(lang)['order_manual'])
 
 async def cancel_conv(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await main_menu(update, context)
     return ConversationHandler.END
 
 def setup_user_bot(application):
+    tenant = application.bot_data.setdefault('tenant', tenants.default())
+    catalog.attach()
     buy_conv = ConversationHandler(
         entry_points=[CallbackQueryHandler(handle_buy_choice, pattern="^confirm_buy_yes")],
         states={WAIT_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_input)]},
@@ -334,16 +498,29 @@ def setup_user_bot(application):
         per_message=False
     )
     
+    # Buttons (router.py); conversation entry points keep their own handlers
+    routes = router.Router(tenant.label("user"), expired=expired_text)
+    routes.add("lang", set_language, str)
+    routes.add("menu_lang", set_language_menu)
+    routes.add("menu_main", main_menu)
+    routes.add("menu_shop", shop)
+    routes.add("cats", shop, int)
+    routes.add("cat", shop, str, str, int)
+    routes.add("menu_profile", profile)
+    routes.add("menu_orders", my_orders)
+    routes.add("menu_refer", refer)
+    routes.add("menu_network", my_network)
+    routes.add("menu_top", leaderboard_menu)
+    routes.add("top", leaderboard_menu, str)
+    routes.add("buy", buy_confirm, int)
+    routes.add("menu_balance", balance_menu)
+    routes.add("topup", topup_invoice, int)
+    routes.add("daily_check", daily_check)
+
+    application.add_handler(TypeHandler(Update, tenants.bind_handler), group=-100)
     application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(set_language, pattern="^lang_"))
-    application.add_handler(CallbackQueryHandler(set_language_menu, pattern="^menu_lang"))
-    application.add_handler(CallbackQueryHandler(main_menu, pattern="^menu_main"))
-    application.add_handler(CallbackQueryHandler(shop, pattern="^menu_shop"))
-    application.add_handler(CallbackQueryHandler(profile, pattern="^menu_profile"))
-    application.add_handler(CallbackQueryHandler(refer, pattern="^menu_refer"))
-    application.add_handler(CallbackQueryHandler(buy_confirm, pattern="^buy_"))
+    application.add_handler(InlineQueryHandler(inline_search))
+    application.add_handler(routes.handler())
     application.add_handler(buy_conv)
-    application.add_handler(CallbackQueryHandler(balance_menu, pattern="^menu_balance"))
-    application.add_handler(CallbackQueryHandler(daily_check, pattern="^daily_check")) # New Handler
     application.add_handler(redeem_conv)
     # application.add_handler(CallbackQueryHandler(main_menu, pattern="^menu_support")) # Support is URL now